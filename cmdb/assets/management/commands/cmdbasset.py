@@ -12,7 +12,7 @@ from assets.models import PortConnection, SwitchPort, ServerPort, AssetResource,
 from cmdb.settings import logger
 from ipman.models import IPAddress
 from resources.lib.console import ConsoleResourceWriter
-from resources.models import Resource
+from resources.models import Resource, ResourceOption
 
 
 class Command(BaseCommand):
@@ -161,22 +161,20 @@ class Command(BaseCommand):
                     if not curr_pos:
                         logger.warning("Server %s position is not set." % sorted_server)
 
-                    if curr_pos in rack_layout_map:
-                        while curr_pos in rack_layout_map:
-                            curr_pos += 1
+                    # overlapped servers are shown above, positions are not changed
+                    while curr_pos in rack_layout_map:
+                        curr_pos += 1
 
-                        sorted_server.position = curr_pos
+                    rack_layout_map[curr_pos] = sorted_server
 
-                    rack_layout_map[sorted_server.position] = sorted_server
-
-                    if sorted_server.position > curr_position:
-                        curr_position = sorted_server.position
+                    if curr_pos > curr_position:
+                        curr_position = curr_pos
 
                 while curr_position > 0:
                     if curr_position in rack_layout_map:
                         server = rack_layout_map[curr_position]
 
-                        print "[{:>3s}|  {:<40s}  |{:s}]".format(unicode(server.position), server,
+                        print "[{:>3s}|  {:<40s}  |{:s}]".format(unicode(curr_position), server,
                                                                  'o' if server.on_rails else ' ')
                     else:
                         print "[{:>3s}|{:-^46s}]".format(unicode(curr_position), '')
@@ -281,8 +279,9 @@ class Command(BaseCommand):
                 logger.info("    %s (seen %s)" % (ip_address, ip_address.last_seen))
 
         logger.info("Options:")
-        for option in server.get_options():
-            logger.info("  %s" % option)
+        options = ResourceOption.objects.decoded_by_resource([server.id])[server.id]
+        for name, value in sorted(options.items()):
+            logger.info("  %s = %s" % (name, value))
 
     def handle(self, *args, **options):
         if 'subcommand_name' in options:
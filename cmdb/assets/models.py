@@ -2,7 +2,7 @@ from __future__ import unicode_literals
 
 import netaddr
 
-from resources.models import Resource, ResourceOption
+from resources.models import Resource, ResourceOption, resource_session
 
 
 class RegionResource(Resource):
@@ -116,20 +116,34 @@ class RackMountable(AssetResource):
 
     @property
     def is_mounted(self):
-        if not self.parent or not isinstance(self.typed_parent, Rack):
-            self.position = 0
+        return self.position > 0 and self.parent_id is not None and isinstance(self.typed_parent, Rack)
 
-        return self.position > 0
+    @staticmethod
+    def reset_unmounted_positions():
+        """
+        Reset rack_position of the devices, that are not in the rack. Returns the number of the changed devices.
+        """
+        unmounted = Resource.active.filter(rack_position__gt=0).exclude(
+            parent__in=Resource.objects.filter(type=Rack.__name__).values('id'))
+
+        changed = 0
+        with resource_session():
+            for device in unmounted:
+                device.set_option('rack_position', 0, format=ResourceOption.FORMAT_INT)
+                changed += 1
+
+        return changed
 
     def mount_to(self, rack):
         assert rack
         assert isinstance(rack, Rack)
 
         if self.parent_id != rack.id:
-            self.parent = rack
-            self.save()
+            with resource_session():
+                self.parent = rack
+                self.save()
 
-            self.position = 0
+                self.position = 0
 
     def save(self, *args, **kwargs):
         super(AssetResource, self).save(*args, **kwargs)
@@ -232,11 +246,10 @@ class PortConnection(Resource):
         linked_port_id = self.linked_port_id
 
         if linked_port_id > 0:
-            ports = Resource.active.filter(pk=linked_port_id)
-            if len(ports) <= 0:
+            try:
+                return Resource.active.get(pk=linked_port_id)
+            except Resource.DoesNotExist:
                 return None
-            else:
-                return ports[0]
 
         return None
 
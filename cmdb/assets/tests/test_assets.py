@@ -1,13 +1,22 @@
 from __future__ import unicode_literals
 
+import re
+
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from assets.models import RegionResource, Server, ServerPort, Rack, Switch, VirtualServer, VirtualServerPort, \
     SwitchPort, \
     PortConnection
 from ipman.models import IPNetworkPool
-from resources.models import Resource, ModelFieldChecker
+from resources.models import Resource, ModelFieldChecker, ResourceOption
+
+
+# sqlite debug SQL is prefixed with QUERY =
+WRITE_SQL = re.compile(r"^(QUERY = u')?(INSERT|UPDATE|DELETE) ", re.IGNORECASE)
 
 
 class AssetsTest(TestCase):
@@ -59,6 +68,26 @@ class AssetsTest(TestCase):
         self.assertEqual(Resource.STATUS_DELETED, address1.status)
         self.assertNotEquals(ippool1.id, address1.parent.id)
 
+    def test_read_only_commands(self):
+        rack = Rack.objects.create(name='rack1', size=10)
+        server1 = Server.objects.create(label='server1', parent=rack, position=3)
+        Server.objects.create(label='server2', parent=rack, position=3)
+        unmounted = Server.objects.create(label='server3', position=5)
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(server1.is_mounted)
+            self.assertFalse(unmounted.is_mounted)
+            call_command('cmdbasset', 'unit', unicode(unmounted.id))
+            call_command('cmdbasset', 'rack', unicode(rack.id), '--layout')
+
+        self.assertEqual([], [query['sql'] for query in context.captured_queries if WRITE_SQL.match(query['sql'])])
+        self.assertEqual(5, unmounted.position)
+
+        # positions are reset by the batch writer
+        self.assertEqual(1, Server.reset_unmounted_positions())
+        self.assertEqual(0, ResourceOption.objects.get(resource=unmounted, name='rack_position').typed_value)
+        self.assertEqual(3, Resource.objects.get(pk=server1.id).position)
+
     def test_delete_resources(self):
         switch1 = Switch.objects.create(label="test switch", status=Resource.STATUS_INUSE)
         resource1 = VirtualServer.objects.create(label="test switch", status=Resource.STATUS_INUSE)
@@ -3,16 +3,21 @@ from __future__ import unicode_literals
 
 from django.db import migrations
 
-from resources.models import ResourceOption
-
 
 def update_field_name(apps, schema_editor):
+    ResourceOption = apps.get_model('resources', 'ResourceOption')
     ResourceOption.objects.filter(name='hypervisor_tech').update(name='hypervisor_driver')
 
 
 class Migration(migrations.Migration):
     dependencies = [
         ('cloud', '0001_initial'),
+        ('resources', '0016_resourceoption_journaling'),
+    ]
+
+    # option names are moved to the option_keys table later
+    run_before = [
+        ('resources', '0019_optionkey'),
     ]
 
     operations = [
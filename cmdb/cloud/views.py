@@ -12,9 +12,11 @@ from cloud.provisioning.backends.proxmox import ProxMoxJBONServiceBackend
 from cloud.serializers import CloudTaskTrackerSerializer, StartStopSerializer, \
     CreateVpsSerializer
 from cmdb.settings import logger
+from resources.renderers import MessagePackViewMixin
 
 
-class CloudTaskTrackerViewSet(viewsets.mixins.RetrieveModelMixin,
+class CloudTaskTrackerViewSet(MessagePackViewMixin,
+                              viewsets.mixins.RetrieveModelMixin,
                               viewsets.GenericViewSet):
     """
     ViewSet used to control cloud tasks. Is only able to retrieve the state of the task.
@@ -24,7 +26,8 @@ class CloudTaskTrackerViewSet(viewsets.mixins.RetrieveModelMixin,
     pagination_class = PageNumberPagination
 
 
-class VirtualServerViewSet(viewsets.mixins.CreateModelMixin,
+class VirtualServerViewSet(MessagePackViewMixin,
+                           viewsets.mixins.CreateModelMixin,
                            viewsets.GenericViewSet):
     queryset = VirtualServer.active.filter()
     pagination_class = PageNumberPagination
@@ -8,5 +8,6 @@ urlpatterns = [
     url(r'^v1/', include('resources.urls')),
     url(r'^v1/', include('ipman.urls')),
     url(r'^v1/', include('cloud.urls')),
+    url(r'^v1/', include('events.urls')),
     url(r'^admin/', include(admin.site.urls)),
 ]
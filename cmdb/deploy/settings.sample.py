@@ -66,6 +66,8 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # load each resource once per request
+    # 'resources.middleware.ResourceIdentityMapMiddleware',
 )
 
 ROOT_URLCONF = 'cmdb.urls'
@@ -98,6 +100,39 @@ ZABBIX_APP = {
     'PASSWORD': 'zabbix'
 }
 
+# Hierarchy of the resources: 'mptt' (nested sets, fast subtree reads) or 'cte' (adjacency list with
+# recursive queries, fast moves). Run Resource.objects.rebuild() when switching from 'cte' to 'mptt'.
+RESOURCES_HIERARCHY = 'mptt'
+
+# Cache of the resource query results and of the list versions (ETag, Last-Modified) of the conditional requests,
+# invalidated by the changes of the resources of the selected types. Disabled if None, lists are versioned with
+# an aggregate query. Use 'resources.querycache.DjangoCacheBackend' to share the cache between the processes.
+RESOURCES_QUERY_CACHE = None
+# RESOURCES_QUERY_CACHE = {
+#     'BACKEND': 'resources.querycache.LocMemLRUBackend',
+#     'OPTIONS': {'max_entries': 1000},
+# }
+
+# Storage of the resource options: 'rows' (resource_options table) or 'json' (JSON document in the resources
+# table, SQLite JSON1 or PostgreSQL). Move the options with 'cmdbctl options --migrate json' before switching,
+# index the hot keys with 'cmdbctl options --index mac,serial'. The 'json' storage filters the options by name
+# with the lookups of the typed values (exact, in, gt, range, startswith, contains, regex...), the other lookups
+# (isnull, dates) and the lookups by the option fields (value, format) raise FieldError.
+RESOURCES_OPTIONS_STORAGE = 'rows'
+
+# Deleted resources are moved to the archive tables after the number of days, see 'cmdbctl archive'.
+RESOURCES_ARCHIVE_DAYS = 90
+
+# Maximum number of the operations in one request of the bulk write endpoint (POST /v1/resources/bulk/).
+RESOURCES_BULK_MAX_ITEMS = 10000
+
+# Maximum number of seconds, that the change feed (GET /v1/changes/?wait=N) waits for the new events.
+RESOURCES_CHANGES_MAX_WAIT = 30
+
+# Number of seconds after journaling, that the events are held back from the change feed. Events of
+# the transactions, that commit later than this after journaling the events, may be skipped by the feed readers.
+RESOURCES_CHANGES_SETTLE_TIME = 2
+
 # Database
 # https://docs.djangoproject.com/en/1.7/ref/settings/#databases
 
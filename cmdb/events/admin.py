@@ -2,7 +2,6 @@ from __future__ import unicode_literals
 from django.contrib import admin
 
 from events.models import HistoryEvent
-from resources.models import Resource
 
 
 class HistoryEventAdmin(admin.ModelAdmin):
@@ -13,7 +12,7 @@ class HistoryEventAdmin(admin.ModelAdmin):
     raw_id_fields = ['resource']
 
     def get_resource(self, inst):
-        typed_res = Resource.objects.get(pk=inst.resource.id)
+        typed_res = inst.get_resource()
         return "%s (%s)" % (unicode(typed_res), typed_res.type)
 
     get_resource.short_description = 'Resource'
@@ -0,0 +1,142 @@
+from __future__ import unicode_literals
+
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from events.models import HistoryEvent
+from resources.models import Resource, ArchivedResource
+
+
+class ChangesPage(object):
+    """
+    Page of the change feed: changes and the id of the last read event, that is the cursor of the next page.
+    """
+
+    def __init__(self, changes, last_id, has_more):
+        self.changes = changes
+        self.last_id = last_id
+        self.has_more = has_more
+
+
+class ChangeFeed(object):
+    """
+    Incremental feed of the resource changes, read from the HistoryEvent journal in id order. Consumers keep
+    the id of the last read event and read the events after it (id > since), so the pages are selected by the
+    primary key index and the cost doesn't depend on the size of the journal:
+        page = ChangeFeed(types=['Server']).read(since=last_id)
+
+    Events of the same resource in the page are coalesced to one change: the first old and the last new value
+    of each field. The change is placed at the last event of the resource.
+
+    Event ids are allocated on insert, but the events are visible on commit, so a transaction, committed
+    after the other one, may add events before the read cursor. Events journaled in the last settle_time
+    seconds (RESOURCES_CHANGES_SETTLE_TIME) are not read and hold the cursor back, so the events are skipped
+    only by the transactions, that commit later than settle_time after journaling.
+    """
+    # interval of the journal reads of the long polling, seconds
+    poll_interval = 0.5
+
+    def __init__(self, types=None, coalesce=True):
+        """
+        :param types: resource types of the changes, such as 'Server', all types if None
+        :param coalesce: coalesce the events of the same resource in the page
+        """
+        self.types = types
+        self.coalesce = coalesce
+        self.settle_time = getattr(settings, 'RESOURCES_CHANGES_SETTLE_TIME', 2)
+
+    def read(self, since=0, limit=1000):
+        """
+        Returns the ChangesPage with the changes after the event id. The cursor of the filtered feed is moved
+        over the scanned events of the other types too, so the clients don't read them again, but not over
+        the unsettled events.
+        """
+        # events are scanned up to the first unsettled one or up to the last journaled one, the events journaled
+        # later are read by the next page
+        settled_at = timezone.now() - timedelta(seconds=self.settle_time)
+        unsettled_id = HistoryEvent.objects.filter(id__gt=since, created_at__gt=settled_at).aggregate(
+            Min('id'))['id__min']
+        if unsettled_id is not None:
+            scanned_id = unsettled_id - 1
+        else:
+            scanned_id = HistoryEvent.objects.aggregate(Max('id'))['id__max'] or since
+
+        queryset = HistoryEvent.objects.filter(id__gt=since, id__lte=scanned_id).order_by('id')
+        if self.types:
+            # events of the archived resources are selected by the type of the archived copy
+            queryset = queryset.filter(
+                Q(resource_id__in=Resource.objects.filter(type__in=self.types).values('id')) |
+                Q(resource_id__in=ArchivedResource.objects.filter(type__in=self.types).values('id')))
+
+        events = list(queryset.values_list('id', 'resource_id', 'type', 'field_name', 'field_old_value',
+                                           'field_new_value', 'created_at')[:limit + 1])
+
+        has_more = len(events) > limit
+        events = events[:limit]
+        last_id = events[-1][0] if has_more else max(scanned_id, since)
+
+        resource_types = self._get_resource_types(set(event[1] for event in events))
+
+        changes = OrderedDict()
+        for event_id, resource_id, event_type, field_name, old_value, new_value, created_at in events:
+            change_key = resource_id if self.coalesce else event_id
+
+            change = changes.pop(change_key, None)
+            if change is None:
+                change = dict(resource_id=resource_id, resource_type=resource_types.get(resource_id),
+                              type=event_type, fields=OrderedDict())
+            elif event_type == HistoryEvent.DELETE or change['type'] != HistoryEvent.CREATE:
+                # resource is created in the page: the change is the create, unless it is deleted
+                change['type'] = event_type
+
+            change.update(id=event_id, created_at=created_at)
+            if field_name:
+                field = change['fields'].setdefault(field_name, dict(old=old_value))
+                field['new'] = new_value
+
+            # the change is moved to its last event
+            changes[change_key] = change
+
+        changes = changes.values()
+        if self.coalesce:
+            changes = [resource_change for resource_change in changes if self._is_changed(resource_change)]
+
+        return ChangesPage(changes, last_id, has_more)
+
+    def wait(self, since=0, limit=1000, timeout=0):
+        """
+        Long polling: returns the page with the events after the event id, waits up to timeout seconds for
+        the new events, if there are no events.
+        """
+        deadline = time.time() + timeout
+
+        while True:
+            page = self.read(since, limit)
+            if page.last_id != since or time.time() + self.poll_interval > deadline:
+                return page
+
+            time.sleep(self.poll_interval)
+
+    @staticmethod
+    def _is_changed(change):
+        # fields, that are changed back and forth in the page, are not changes
+        for field_name, field in change['fields'].items():
+            if field['old'] == field['new'] and change['type'] == HistoryEvent.UPDATE:
+                del change['fields'][field_name]
+
+        return change['type'] != HistoryEvent.UPDATE or bool(change['fields'])
+
+    @staticmethod
+    def _get_resource_types(resource_ids):
+        resource_types = dict(Resource.objects.filter(pk__in=resource_ids).values_list('id', 'type'))
+
+        archived_ids = set(resource_ids) - set(resource_types)
+        if archived_ids:
+            resource_types.update(ArchivedResource.objects.filter(pk__in=archived_ids).values_list('id', 'type'))
+
+        return resource_types
@@ -1,15 +1,18 @@
 from __future__ import unicode_literals
 from argparse import ArgumentParser
 import argparse
+import json
 
 from django.core.exceptions import ObjectDoesNotExist
 
 from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from prettytable import PrettyTable
 
 from cmdb.settings import logger
 
+from events.feed import ChangeFeed
 from events.models import HistoryEvent
 
 
@@ -36,6 +39,17 @@ class Command(BaseCommand):
         event_list_cmd.add_argument('filter', nargs=argparse.ZERO_OR_MORE, help="Key=Value pairs.")
         self._register_handler('list', self._handle_res_list)
 
+        event_tail_cmd = subparsers.add_parser('tail', help="Print the changes after the event ID as JSON lines.")
+        event_tail_cmd.add_argument('--since', type=int, default=0, help="ID of the last read event.")
+        event_tail_cmd.add_argument('--type', default='', help="Comma separated resource types.")
+        event_tail_cmd.add_argument('--limit', type=int, default=1000, help="Number of events read at once.")
+        event_tail_cmd.add_argument('--no-coalesce', action='store_true',
+                                    help="Print each event, don't coalesce the events of the same resource.")
+        event_tail_cmd.add_argument('-f', '--follow', action='store_true', help="Wait for the new changes.")
+        event_tail_cmd.add_argument('--wait', type=int, default=30,
+                                    help="Seconds to wait for the new changes in the follow mode.")
+        self._register_handler('tail', self._handle_tail)
+
     def handle(self, *args, **options):
         if 'subcommand_name' in options:
             subcommand = "%s.%s" % (options['manager_name'], options['subcommand_name'])
@@ -45,6 +59,23 @@ class Command(BaseCommand):
         # call handler
         self.registered_handlers[subcommand](*args, **options)
 
+    def _handle_tail(self, *args, **options):
+        feed = ChangeFeed(types=[name for name in options['type'].split(',') if name] or None,
+                          coalesce=not options['no_coalesce'])
+
+        since = options['since']
+        while True:
+            page = feed.wait(since, limit=options['limit'], timeout=options['wait'] if options['follow'] else 0)
+
+            for change in page.changes:
+                self.stdout.write(json.dumps(change, cls=DjangoJSONEncoder))
+
+            since = page.last_id
+            if not page.has_more and not options['follow']:
+                break
+
+        logger.debug("Last event ID: %s" % since)
+
     def _handle_res_list(self, *args, **options):
         query = self._parse_reminder_arg(options['filter'])
 
@@ -77,10 +108,11 @@ class Command(BaseCommand):
 
         for event in events_set:
             try:
+                resource = event.get_resource()
                 table.add_row([event.id,
                                timezone.localtime(event.created_at).strftime('%d.%m.%Y %H:%M'),
                                event.type,
-                               event.resource.id, event.resource.type,
+                               resource.id, resource.type,
                                event.field_name, event.field_old_value, event.field_new_value])
             except ObjectDoesNotExist:
                 logger.debug("Removing event %s with missing resource %s" % (event.id, event.resource_id))
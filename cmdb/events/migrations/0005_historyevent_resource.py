@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0004_auto_20150608_1523'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historyevent',
+            name='resource',
+            field=models.ForeignKey(to='resources.Resource', on_delete=django.db.models.deletion.DO_NOTHING, db_constraint=False),
+        ),
+    ]
@@ -7,7 +7,8 @@ from django.dispatch import receiver
 from django.utils import timezone
 
 from cmdb.settings import logger
-from resources.models import Resource, ResourceOption
+from resources.models import Resource, ResourceOption, ResourceSession, ArchivedResource
+from resources.signals import resources_bulk_created, resources_bulk_updated
 
 RESOURCE_HISTORY_FIELDS = ['parent_id', 'name', 'type', 'status']
 
@@ -23,7 +24,8 @@ class HistoryEvent(models.Model):
         (DELETE, 'delete'),
     )
 
-    resource = models.ForeignKey(Resource)
+    # events of the archived resources refer to the ArchivedResource with the same id
+    resource = models.ForeignKey(Resource, db_constraint=False, on_delete=models.DO_NOTHING)
     type = models.CharField(max_length=64, choices=TYPES, db_index=True)
     field_name = models.CharField(max_length=155, db_index=True, null=True)
     field_old_value = models.CharField(max_length=255, db_index=True, null=True)
@@ -33,6 +35,15 @@ class HistoryEvent(models.Model):
     class Meta:
         db_table = "resource_history"
 
+    def get_resource(self):
+        """
+        Returns the resource of the event, that is the ArchivedResource, if the resource is archived.
+        """
+        try:
+            return Resource.objects.get(pk=self.resource_id)
+        except Resource.DoesNotExist:
+            return ArchivedResource.objects.get(pk=self.resource_id)
+
     @staticmethod
     def add_create(resource):
         assert isinstance(resource, Resource)
@@ -49,6 +60,34 @@ class HistoryEvent(models.Model):
                              field_old_value=field_old_value, field_new_value=field_new_value)
         event.save()
 
+    @staticmethod
+    def add_bulk_create(resources, options):
+        """
+        Add create events for the resources and update events for the journaling options with a single insert.
+        """
+        created_at = timezone.now()
+
+        events = [HistoryEvent(resource=resource, type=HistoryEvent.CREATE, created_at=created_at)
+                  for resource in resources]
+        events.extend([HistoryEvent(resource=option.resource, type=HistoryEvent.UPDATE, field_name=option.name,
+                                    field_old_value=None, field_new_value=option.value, created_at=created_at)
+                       for option in options if option.journaling])
+
+        HistoryEvent.objects.bulk_create(events)
+
+    @staticmethod
+    def add_bulk_update(changes):
+        """
+        Add update events with a single insert.
+        :param changes: list of tuples (resource_id, field_name, old_value, new_value)
+        """
+        created_at = timezone.now()
+
+        HistoryEvent.objects.bulk_create([
+            HistoryEvent(resource_id=resource_id, type=HistoryEvent.UPDATE, field_name=field_name,
+                         field_old_value=old_value, field_new_value=new_value, created_at=created_at)
+            for resource_id, field_name, old_value, new_value in changes])
+
     @staticmethod
     def add_delete(resource):
         assert isinstance(resource, Resource)
@@ -60,6 +99,12 @@ class HistoryEvent(models.Model):
         if not self.pk:
             self.created_at = timezone.now()
 
+            # events of the resource_session() are inserted in bulk on exit
+            session = ResourceSession.current()
+            if session and self.type != HistoryEvent.DELETE:
+                session.add_insert(self)
+                return
+
         super(HistoryEvent, self).save(*args, **kwargs)
 
 
@@ -73,7 +118,7 @@ def resource_post_init(sender, instance, **kwargs):
     for field in RESOURCE_HISTORY_FIELDS:
         value = getattr(instance, field)
         setattr(instance, '_original_%s' % field, value)
-        logger.debug("POST INIT: %s %s %s" % (instance, field, value))
+        logger.debug("POST INIT: %s %s %s", instance, field, value)
 
 
 @receiver(post_save)
@@ -88,18 +133,28 @@ def resource_post_save(sender, instance, created, **kwargs):
             value = getattr(instance, field)
             history_field = '_original_%s' % field
 
-            logger.debug("POST SAVE: %s %s %s" % (instance, field, value))
+            logger.debug("POST SAVE: %s %s %s", instance, field, value)
 
             if hasattr(instance, history_field):
                 orig_value = getattr(instance, history_field)
 
-                logger.debug("    original value: %s" % orig_value)
+                logger.debug("    original value: %s", orig_value)
 
                 if unicode(value) != unicode(orig_value):
                     HistoryEvent.add_update(instance, field, orig_value, value)
                     setattr(instance, '_original_%s' % field, value)
 
 
+@receiver(resources_bulk_created)
+def resources_post_bulk_create(sender, resources, options, **kwargs):
+    HistoryEvent.add_bulk_create(resources, options)
+
+
+@receiver(resources_bulk_updated)
+def resources_post_bulk_update(sender, changes, **kwargs):
+    HistoryEvent.add_bulk_update(changes)
+
+
 @receiver(pre_delete)
 def resource_post_delete(sender, instance, using, **kwargs):
     if not issubclass(sender, Resource):
@@ -118,13 +173,16 @@ def resource_option_post_save(sender, instance, created, **kwargs):
     field_name = instance.name
     field_new_value = instance.value
 
+    history_field = '_original_value'
+    field_old_value = getattr(instance, history_field, None)
+
+    # cached options are saved many times, track the last saved value
+    setattr(instance, history_field, field_new_value)
+
     # ability to ignore some fields (such as heartbeat), to prevent event table flooding.
     if not instance.journaling:
         return
 
-    history_field = '_original_value'
-    if hasattr(instance, history_field):
-        field_old_value = getattr(instance, history_field)
-        if unicode(field_new_value) != unicode(field_old_value) or created:
-            field_old_value = None if created else field_old_value
-            HistoryEvent.add_update(instance.resource, field_name, field_old_value, field_new_value)
+    if unicode(field_new_value) != unicode(field_old_value) or created:
+        field_old_value = None if created else field_old_value
+        HistoryEvent.add_update(instance.resource, field_name, field_old_value, field_new_value)
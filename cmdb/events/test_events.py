@@ -121,3 +121,35 @@ class HistoryEventTest(TestCase):
         self.assertEqual('parent_id', events[1].field_name)
         self.assertEqual(unicode(res1.id), events[1].field_old_value)
         self.assertEqual(None, events[1].field_new_value)
+
+    def test_bulk_create_history(self):
+        Resource.objects.bulk_create_with_options(Resource, [
+            dict(name='res1', testfield='testval1'),
+            dict(name='res2', testfield='testval2'),
+        ])
+
+        events = HistoryEvent.objects.filter(type=HistoryEvent.CREATE)
+        self.assertEqual(['res1', 'res2'], sorted([event.resource.name for event in events]))
+
+        events = HistoryEvent.objects.filter(type=HistoryEvent.UPDATE).order_by('field_new_value')
+        self.assertEqual(2, len(events))
+        self.assertEqual('testfield', events[0].field_name)
+        self.assertEqual(None, events[0].field_old_value)
+        self.assertEqual('testval1', events[0].field_new_value)
+        self.assertEqual('res1', events[0].resource.name)
+
+    def test_cascade_status_history(self):
+        root = Resource.objects.create(name='root')
+        child1 = Resource.objects.create(name='child1', parent=root)
+        child2 = Resource.objects.create(name='child2', parent=child1, status=Resource.STATUS_INUSE)
+        Resource.objects.create(name='child3', parent=child1, status=Resource.STATUS_LOCKED)
+
+        HistoryEvent.objects.all().delete()
+
+        root.lock(cascade=True)
+
+        events = HistoryEvent.objects.filter(type=HistoryEvent.UPDATE, field_name='status').order_by('resource_id')
+        self.assertEqual([(root.id, Resource.STATUS_FREE), (child1.id, Resource.STATUS_FREE),
+                          (child2.id, Resource.STATUS_INUSE)],
+                         sorted([(event.resource_id, event.field_old_value) for event in events]))
+        self.assertEqual(set([Resource.STATUS_LOCKED]), set([event.field_new_value for event in events]))
@@ -0,0 +1,167 @@
+from __future__ import unicode_literals
+
+import json
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db.models import Max
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from assets.models import Server, Rack
+from events.feed import ChangeFeed
+from events.models import HistoryEvent
+from resources.models import Resource
+
+
+@override_settings(RESOURCES_CHANGES_SETTLE_TIME=0)
+class ChangeFeedTest(APITestCase):
+    def setUp(self):
+        super(ChangeFeedTest, self).setUp()
+
+        user = User.objects.create(username='admin', is_staff=True)
+        token, created = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        # resources are loaded again, so their saves don't journal the type
+        self.rack = Rack.objects.get(pk=Rack.objects.create(name='rack1').id)
+        self.server = Server.objects.get(pk=Server.objects.create(name='server1', parent=self.rack).id)
+        self.since = HistoryEvent.objects.aggregate(Max('id'))['id__max']
+
+    def test_coalesced_changes(self):
+        self.server.name = 'server2'
+        self.server.save()
+        self.server.name = 'server3'
+        self.server.save()
+        self.server.set_option('label', 'web')
+
+        # changed back and forth
+        self.rack.status = Resource.STATUS_INUSE
+        self.rack.save()
+        self.rack.status = Resource.STATUS_FREE
+        self.rack.save()
+
+        new_server = Server.objects.create(name='server4', label='db')
+        new_server.name = 'server5'
+        new_server.save()
+
+        page = ChangeFeed().read(since=self.since)
+
+        self.assertFalse(page.has_more)
+        self.assertEqual(HistoryEvent.objects.aggregate(Max('id'))['id__max'], page.last_id)
+        self.assertEqual([(self.server.id, 'Server', HistoryEvent.UPDATE),
+                          (new_server.id, 'Server', HistoryEvent.CREATE)],
+                         [(change['resource_id'], change['resource_type'], change['type']) for change in page.changes])
+        self.assertEqual({'name': {'old': 'server1', 'new': 'server3'}, 'label': {'old': None, 'new': 'web'}},
+                         dict(page.changes[0]['fields']))
+        self.assertEqual('server5', page.changes[1]['fields']['name']['new'])
+
+        # each event
+        page = ChangeFeed(coalesce=False).read(since=self.since, limit=3)
+        self.assertTrue(page.has_more)
+        self.assertEqual([self.server.id] * 3, [change['resource_id'] for change in page.changes])
+        self.assertEqual(page.changes[-1]['id'], page.last_id)
+
+        page = ChangeFeed().read(since=page.last_id)
+        self.assertEqual([new_server.id], [change['resource_id'] for change in page.changes])
+
+        self.assertEqual([], ChangeFeed().wait(since=page.last_id, timeout=0).changes)
+
+    def test_types(self):
+        self.rack.name = 'rack2'
+        self.rack.save()
+        self.server.delete()
+
+        # resources are deleted by status
+        page = ChangeFeed(types=['Server']).read(since=self.since)
+        self.assertEqual([(self.server.id, {'status': {'old': Resource.STATUS_FREE, 'new': Resource.STATUS_DELETED}})],
+                         [(change['resource_id'], change['fields']) for change in page.changes])
+
+        # archived resources are selected by the archived type
+        Resource.objects.filter(pk=self.server.id).update(updated_at=self.server.updated_at.replace(year=2000))
+        Resource.objects.archive_deleted(retention_days=1)
+
+        page = ChangeFeed(types=['Server']).read(since=self.since)
+        self.assertEqual([(self.server.id, 'Server')],
+                         [(change['resource_id'], change['resource_type']) for change in page.changes])
+
+    def test_types_cursor(self):
+        self.rack.name = 'rack2'
+        self.rack.save()
+        last_id = HistoryEvent.objects.aggregate(Max('id'))['id__max']
+
+        # cursor is moved over the events of the other types
+        page = ChangeFeed(types=['Server']).read(since=self.since)
+        self.assertEqual(([], last_id, False), (page.changes, page.last_id, page.has_more))
+
+        self.server.name = 'server2'
+        self.server.save()
+        server_event_id = HistoryEvent.objects.aggregate(Max('id'))['id__max']
+        self.rack.name = 'rack3'
+        self.rack.save()
+        self.server.name = 'server3'
+        self.server.save()
+        self.rack.name = 'rack4'
+        self.rack.save()
+
+        # the next page is read after the last returned event
+        page = ChangeFeed(types=['Server']).read(since=last_id, limit=1)
+        self.assertEqual((['server2'], server_event_id, True),
+                         ([change['fields']['name']['new'] for change in page.changes], page.last_id, page.has_more))
+
+        page = ChangeFeed(types=['Server']).read(since=page.last_id, limit=1)
+        self.assertEqual((['server3'], HistoryEvent.objects.aggregate(Max('id'))['id__max'], False),
+                         ([change['fields']['name']['new'] for change in page.changes], page.last_id, page.has_more))
+
+    @override_settings(RESOURCES_CHANGES_SETTLE_TIME=60)
+    def test_settle_time(self):
+        self.server.name = 'server2'
+        self.server.save()
+        self.rack.name = 'rack2'
+        self.rack.save()
+        server_event_id, rack_event_id = HistoryEvent.objects.filter(id__gt=self.since).order_by('id').values_list(
+            'id', flat=True)
+
+        # recent events are held back, they may be journaled after the events of the pending transactions
+        page = ChangeFeed().read(since=self.since)
+        self.assertEqual(([], self.since), (page.changes, page.last_id))
+
+        # cursor is not moved over the unsettled event
+        HistoryEvent.objects.filter(pk=rack_event_id).update(created_at=timezone.now().replace(year=2000))
+        page = ChangeFeed(types=['Rack']).read(since=self.since)
+        self.assertEqual(([], self.since), (page.changes, page.last_id))
+
+        HistoryEvent.objects.filter(pk=server_event_id).update(created_at=timezone.now().replace(year=2000))
+        page = ChangeFeed().read(since=self.since)
+        self.assertEqual(([self.server.id, self.rack.id], rack_event_id),
+                         ([change['resource_id'] for change in page.changes], page.last_id))
+
+    def test_rest(self):
+        self.server.name = 'server2'
+        self.server.save()
+
+        response = self.client.get('/v1/changes/', data={'since': self.since, 'type': 'Server,Rack'}, format='json')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([self.server.id], [change['resource_id'] for change in response.data['results']])
+        self.assertFalse(response.data['has_more'])
+
+        # no new changes after the wait
+        response = self.client.get(response.data['next'] + '&wait=1', format='json')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([], response.data['results'])
+
+        response = self.client.get('/v1/changes/', data={'since': 'last'}, format='json')
+        self.assertEqual(400, response.status_code)
+
+    def test_tail_command(self):
+        self.server.set_option('label', 'web')
+
+        out = StringIO()
+        call_command('cmdbjournal', 'tail', '--since', str(self.since), '--type', 'Server', stdout=out)
+
+        changes = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([{'label': {'old': None, 'new': 'web'}}], [change['fields'] for change in changes])
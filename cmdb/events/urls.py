@@ -0,0 +1,8 @@
+from __future__ import unicode_literals
+from django.conf.urls import url
+
+from events.views import ChangesView
+
+urlpatterns = [
+    url(r'^changes/$', ChangesView.as_view()),
+]
@@ -1,4 +1,52 @@
 from __future__ import unicode_literals
-from django.shortcuts import render
 
-# Create your views here.
+from django.conf import settings
+from rest_framework.compat import OrderedDict
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
+
+from events.feed import ChangeFeed
+
+
+class ChangesView(APIView):
+    """
+    Incremental feed of the resource changes, see ChangeFeed:
+        /v1/changes/?since=<event id>&type=Server,IPAddress&limit=1000&wait=30
+
+    The next link continues the feed after the last read event. With the wait parameter the request waits
+    up to the number of seconds for the new events, if there are no events after since. Events of the same
+    resource in the page are coalesced, unless coalesce=0.
+    """
+    default_limit = 1000
+    max_limit = 10000
+
+    def get(self, request, format=None):
+        since = self._get_int_param(request, 'since', 0)
+        limit = min(self._get_int_param(request, 'limit', self.default_limit), self.max_limit)
+        wait = min(self._get_int_param(request, 'wait', 0), getattr(settings, 'RESOURCES_CHANGES_MAX_WAIT', 30))
+
+        types = [name.strip() for name in request.query_params.get('type', '').split(',') if name.strip()]
+        coalesce = request.query_params.get('coalesce', '1') not in ('0', 'false')
+
+        page = ChangeFeed(types=types or None, coalesce=coalesce).wait(since, limit=max(limit, 1), timeout=wait)
+
+        return Response(OrderedDict([
+            ('last_id', page.last_id),
+            ('has_more', page.has_more),
+            ('next', replace_query_param(request.build_absolute_uri(), 'since', page.last_id)),
+            ('results', page.changes),
+        ]))
+
+    @staticmethod
+    def _get_int_param(request, param_name, default):
+        try:
+            value = int(request.query_params.get(param_name, default))
+        except ValueError:
+            raise ParseError("Invalid %s: an integer is expected." % param_name)
+
+        if value < 0:
+            raise ParseError("Invalid %s: a positive integer is expected." % param_name)
+
+        return value
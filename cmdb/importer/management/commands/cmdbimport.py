@@ -8,7 +8,8 @@ from django.core.management.base import BaseCommand
 
 from django.utils import timezone
 
-from assets.models import GatewaySwitch, Switch, VirtualServer, PortConnection, SwitchPort, RegionResource
+from assets.models import GatewaySwitch, Switch, VirtualServer, PortConnection, SwitchPort, RegionResource, \
+    RackMountable
 from cmdb.settings import logger
 from importer.importlib import GenericCmdbImporter
 from importer.providers.l3_switch import L3Switch
@@ -17,7 +18,7 @@ from importer.providers.vendors.hp import HP1910Switch
 from importer.providers.vendors.qtech import QtechL3Switch, Qtech3400Switch
 from importer.providers.vendors.sw3com import Switch3Com2250
 from ipman.models import IPAddress, IPAddressPool
-from resources.models import Resource
+from resources.models import Resource, resource_identity_map
 
 
 class Command(BaseCommand):
@@ -68,6 +69,10 @@ class Command(BaseCommand):
         self._register_handler('household', self._handle_household)
 
     def _handle_household(self, *args, **options):
+        with Resource.objects.delay_mptt_updates(), resource_identity_map():
+            self._clean_unused_resources()
+
+    def _clean_unused_resources(self):
         last_seen_31days = timezone.now() - datetime.timedelta(days=31)
         last_seen_15days = timezone.now() - datetime.timedelta(days=15)
 
@@ -109,9 +114,20 @@ class Command(BaseCommand):
                 removed += 1
         logger.info("  removed: %s" % removed)
 
-        Resource.objects.rebuild()
-        
+        # derived values are not stored by the read paths
+        logger.info("Reset positions of unmounted devices: %s" % RackMountable.reset_unmounted_positions())
+
+        logger.info("Refresh IP pools usage")
+        IPAddressPool.refresh_usage()
+
+        logger.info("Archive deleted resources: %s" % Resource.objects.archive_deleted())
+
     def _handle_auto(self, *args, **options):
+        # MPTT fields of the moved resources are updated once, after all the changes
+        with Resource.objects.delay_mptt_updates(), resource_identity_map():
+            self._import_and_link_resources(**options)
+
+    def _import_and_link_resources(self, **options):
         # update via snmp
         query = dict(type__in=[GatewaySwitch.__name__, Switch.__name__])
         if options['switch_id']:
@@ -134,8 +150,6 @@ class Command(BaseCommand):
                     else:
                         logger.warning("Unknown SNMP data provider: %s" % snmp_provider_key)
 
-        Resource.objects.rebuild()
-
         logger.info("Process hypervisors.")
         for switch in Switch.active.all():
             for switch_port in SwitchPort.active.filter(parent=switch):
@@ -153,8 +167,6 @@ class Command(BaseCommand):
         link_unresolved_to_container, created = RegionResource.objects.get_or_create(name='Unresolved VPS')
         self.cmdb_importer.process_virtual_servers(link_unresolved_to=link_unresolved_to_container)
 
-        Resource.objects.rebuild()
-
     def _handle_snmp(self, *args, **options):
         device_id = options['device-id']
         provider_key = options['provider']
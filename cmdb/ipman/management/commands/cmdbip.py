@@ -6,7 +6,7 @@ from django.core.management.base import BaseCommand
 from cmdb.settings import logger
 from ipman.models import IPNetworkPool, IPAddressPool, IPAddressRangePool, IPAddress
 from resources.lib.console import ConsoleResourceWriter
-from resources.models import Resource
+from resources.models import Resource, resource_identity_map
 
 
 class Command(BaseCommand):
@@ -161,8 +161,13 @@ class Command(BaseCommand):
         logger.info(unicode(ip_address))
 
     def _list_pools(self):
-        resource_writer = ConsoleResourceWriter(IPAddressPool.get_all_pools())
-        resource_writer.print_table(fields=['id', 'parent', 'self', 'type', 'status', 'usage'], sort_by='parent')
+        with resource_identity_map():
+            pools = list(IPAddressPool.get_all_pools())
+            usages = IPAddressPool.get_usages(pools)
+
+            resource_writer = ConsoleResourceWriter(
+                [[pool.id, pool.parent, unicode(pool), pool.type, pool.status, usages[pool.id]] for pool in pools])
+            resource_writer.print_table(fields=['id', 'parent', 'self', 'type', 'status', 'usage'], sort_by='parent')
 
     def _register_handler(self, command_name, handler):
         assert command_name, "command_name must be defined."
@@ -2,8 +2,11 @@ from __future__ import unicode_literals
 
 import ipaddress
 
+from django.db.models import Count
+
 from cmdb.settings import logger
-from resources.models import Resource, ResourceOption
+from resources.models import Resource, ResourceOption, resource_session
+from resources.optionstorage import get_option_storage
 
 
 class IPAddress(Resource):
@@ -13,6 +16,9 @@ class IPAddress(Resource):
           keep tracking of IP-IP_pool relations.
     """
 
+    # free() returns the IP to its pool
+    cascade_per_row_methods = ('free',)
+
     class Meta:
         proxy = True
 
@@ -103,13 +109,14 @@ class IPAddress(Resource):
         :param cascade:
         :return:
         """
-        self.parent = self.get_origin()
-        self.status = Resource.STATUS_FREE
-        self.services = ''
-        self.main = False
-        self.save()
+        with resource_session():
+            self.parent = self.get_origin()
+            self.status = Resource.STATUS_FREE
+            self.services = ''
+            self.main = False
+            self.save()
 
-        super(IPAddress, self).free(cascade=cascade)
+            super(IPAddress, self).free(cascade=cascade)
 
     def save(self, *args, **kwargs):
         """
@@ -125,11 +132,19 @@ class IPAddress(Resource):
             # Save here, because options must be set on the existing resources
             super(IPAddress, self).save()
 
-        if self.parent and isinstance(self.parent, IPAddressPool):
+        if self.parent and isinstance(self.parent, IPAddressPool) and \
+                        self.get_option_value('ipman_pool_id', default=None) != self.parent.id:
             self.set_origin(self.parent.id)
 
         super(IPAddress, self).save()
 
+    def before_bulk_create(self):
+        if self.parent and not isinstance(self.parent, IPAddressPool):
+            raise Exception("IP address must be added to the pool for the first time.")
+
+        if self.parent:
+            self.set_origin(self.parent.id)
+
 
 class IPAddressPool(Resource):
     ip_pool_types = [
@@ -138,6 +153,9 @@ class IPAddressPool(Resource):
         'IPNetworkPool'
     ]
 
+    # total_addresses is the number of the IPs in the pool, not calculated from the pool definition
+    counts_total_addresses = True
+
     class InfiniteList:
         """
         Implementation of the ring buffer. Infinitely iterate through the given list.
@@ -242,14 +260,64 @@ class IPAddressPool(Resource):
         return IPAddress.active.filter(ipman_pool_id=self.id, status=Resource.STATUS_INUSE).count()
 
     def get_usage(self):
-        total = float(self.total_addresses)
-        used = float(self.used_addresses)
+        """
+        Usage of the pool in percents from the ipman_usage option, stored by refresh_usage(). Usage of the pool
+        without the option is calculated and not stored.
+        """
+        if self.has_option('ipman_usage'):
+            return self.get_option_value('ipman_usage')
+
+        return self.get_usages([self])[self.id]
 
-        usage_value = int(round((float(used) / total) * 100)) if total > 0 else 0
+    @staticmethod
+    def _calculate_usage(total, used):
+        return int(round((float(used) / total) * 100)) if total > 0 else 0
 
-        self.set_option('ipman_usage', usage_value, ResourceOption.FORMAT_INT)
+    @staticmethod
+    def get_usages(pools):
+        """
+        Returns usage of the pools by pool id. IPs of all the pools are counted with a single query.
+        """
+        pools = list(pools)
+        pool_ids = [pool.id for pool in pools]
+
+        if get_option_storage().stores_rows:
+            pool_ips = ResourceOption.objects.filter(
+                name='ipman_pool_id', value_int__in=pool_ids,
+                resource__type=IPAddress.__name__).exclude(resource__status=Resource.STATUS_DELETED)
+            counts = pool_ips.values_list('value_int', 'resource__status').annotate(Count('id'))
+        else:
+            # IPs are selected with the pool ids from the JSON options documents and counted in memory
+            counts = {}
+            for pool_id, status in IPAddress.active.filter(ipman_pool_id__in=pool_ids).values_list_with_options(
+                    'ipman_pool_id', 'status'):
+                counts[(pool_id, status)] = counts.get((pool_id, status), 0) + 1
+            counts = [(pool_id, status, count) for (pool_id, status), count in counts.items()]
+
+        totals = {}
+        used = {}
+        for pool_id, status, count in counts:
+            totals[pool_id] = totals.get(pool_id, 0) + count
+            if status == Resource.STATUS_INUSE:
+                used[pool_id] = count
+
+        return dict((pool.id, IPAddressPool._calculate_usage(
+            totals.get(pool.id, 0) if pool.counts_total_addresses else pool.total_addresses, used.get(pool.id, 0)))
+                    for pool in pools)
 
-        return usage_value
+    @staticmethod
+    def refresh_usage(pools=None):
+        """
+        Store the usage of the pools (all pools if None) in the ipman_usage option. Journaling flag of the stored
+        options is kept.
+        """
+        pools = list(IPAddressPool.get_all_pools() if pools is None else pools)
+        usages = IPAddressPool.get_usages(pools)
+
+        with resource_session():
+            for pool in pools:
+                journaling = pool.get_option('ipman_usage').journaling if pool.has_option('ipman_usage') else True
+                pool.set_option('ipman_usage', usages[pool.id], ResourceOption.FORMAT_INT, journaling=journaling)
 
     def browse(self):
         """
@@ -293,6 +361,8 @@ class IPAddressPool(Resource):
 
 
 class IPAddressRangePool(IPAddressPool):
+    counts_total_addresses = False
+
     class Meta:
         proxy = True
 
@@ -365,6 +435,7 @@ class IPNetworkPool(IPAddressPool):
     """
     IP addresses network.
     """
+    counts_total_addresses = False
 
     class Meta:
         proxy = True
@@ -2,9 +2,15 @@ from __future__ import unicode_literals
 from rest_framework import serializers
 
 from ipman.models import IPAddress
+from resources.serializers import SparseFieldsSerializerMixin, ResourceOptionSerializer
 
 
-class IpAddressSerializer(serializers.ModelSerializer):
+class IpAddressSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
+    options = ResourceOptionSerializer(source='get_options', many=True, read_only=True)
+
+    # options are serialized, if they are selected: ?options=mac
+    optional_fields = ('options',)
+
     class Meta:
         model = IPAddress
         fields = (
@@ -18,4 +24,5 @@ class IpAddressSerializer(serializers.ModelSerializer):
             'status',
             'created_at',
             'updated_at',
-            'last_seen')
+            'last_seen',
+            'options')
@@ -1,11 +1,20 @@
 from __future__ import unicode_literals
 
+import re
+
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from assets.models import VirtualServer
 from ipman.models import IPAddress, IPNetworkPool, IPAddressPool, IPAddressRangePool
-from resources.models import Resource
+from resources.models import Resource, ResourceOption
+
+
+# sqlite debug SQL is prefixed with QUERY =
+WRITE_SQL = re.compile(r"^(QUERY = u')?(INSERT|UPDATE|DELETE) ", re.IGNORECASE)
 
 
 class IPmanTest(TestCase):
@@ -176,6 +185,49 @@ class IPmanTest(TestCase):
         self.assertEqual(49, ipset.used_addresses)
         self.assertEqual(49, ipset.usage)
 
+    def test_usage_read_only(self):
+        ipnet = IPNetworkPool.objects.create(network='192.168.1.1/24')
+        ipset = IPAddressPool.objects.create(name='Test ip set')
+        for x in range(1, 5):
+            ipset += IPAddress.objects.create(address='172.27.27.%s' % x, status=Resource.STATUS_INUSE)
+        ipnet.available().next().use()
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(0, ipnet.usage)
+            self.assertEqual(100, ipset.usage)
+            self.assertEqual({ipnet.id: 0, ipset.id: 100}, IPAddressPool.get_usages([ipnet, ipset]))
+            call_command('cmdbip', 'pool', 'list')
+
+        self.assertEqual([], [query['sql'] for query in context.captured_queries if WRITE_SQL.match(query['sql'])])
+        self.assertFalse(ipset.has_option('ipman_usage'))
+
+        IPAddressPool.refresh_usage()
+        self.assertEqual(100, Resource.active.get(pk=ipset.id).get_option_value('ipman_usage'))
+
+    def test_stored_usage(self):
+        ipnet = IPNetworkPool.objects.create(network='192.168.1.1/24')
+        ipset = IPAddressPool.objects.create(name='Test ip set')
+        ipset.set_option('ipman_usage', 0, ResourceOption.FORMAT_INT, journaling=False)
+        for x in range(1, 5):
+            ipset += IPAddress.objects.create(address='172.27.27.%s' % x, status=Resource.STATUS_INUSE)
+
+        IPAddressPool.refresh_usage()
+
+        # stored usage is read without counting the IPs
+        ipset = Resource.active.get(pk=ipset.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(100, ipset.usage)
+
+        # journaling flag of the stored options is kept
+        self.assertFalse(ipset.get_option('ipman_usage').journaling)
+        self.assertTrue(Resource.active.get(pk=ipnet.id).get_option('ipman_usage').journaling)
+
+        # usage is not recalculated on read
+        IPAddress.objects.create(address='172.27.27.5', parent=ipset)
+        self.assertEqual(100, Resource.active.get(pk=ipset.id).usage)
+        IPAddressPool.refresh_usage([Resource.active.get(pk=ipset.id)])
+        self.assertEqual(80, Resource.active.get(pk=ipset.id).usage)
+
     def test_pool_add_sub(self):
         ipnet = IPNetworkPool.objects.create(network='192.168.1.1/24')
 
@@ -329,3 +381,31 @@ class IPmanTest(TestCase):
         self.assertEqual(1, len(polipnets))
         self.assertTrue(polipnets[0].can_add(ip1))
         self.assertFalse(polipnets[0].can_add(ip2))
+
+    def test_bulk_create_ips(self):
+        ipnet = IPNetworkPool.objects.create(network='192.168.1.0/24')
+        ipnet2 = IPNetworkPool.objects.create(network='192.168.2.0/24')
+
+        rows = [dict(address='192.168.1.%s' % idx, parent=ipnet) for idx in range(1, 101)]
+        rows.append(dict(address='192.168.2.77', parent=ipnet2, status=Resource.STATUS_INUSE))
+
+        ips = IPAddress.objects.bulk_create_with_options(IPAddress, rows, batch_size=40)
+        self.assertEqual(101, len(ips))
+
+        ip = IPAddress.active.get(address='192.168.1.77')
+        self.assertEqual(ips[76].id, ip.id)
+        self.assertEqual(ipnet.id, ip.parent_id)
+        self.assertEqual(4, ip.version)
+        self.assertEqual(ip._get_beauty('192.168.1.77'), ip.get_option_value('beauty'))
+        self.assertEqual(ipnet.id, ip.get_origin().id)
+
+        ip = IPAddress.active.get(address='192.168.2.77')
+        self.assertEqual(Resource.STATUS_INUSE, ip.status)
+        self.assertEqual(ipnet2.id, ip.get_origin().id)
+
+        self.assertEqual(100, len(list(ipnet)))
+        self.assertEqual(100, ipnet.get_descendant_count())
+
+        # IP is created by the pool only
+        self.assertRaises(Exception, IPAddress.objects.bulk_create_with_options, IPAddress,
+                          [dict(address='192.168.3.1', parent=Resource.objects.create())])
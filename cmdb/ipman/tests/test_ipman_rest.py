@@ -41,3 +41,17 @@ class ResourcesAPITests(APITestCase):
         self.assertEqual(5, items[2]['id'])
         self.assertEqual('192.168.1.3', items[2]['address'])
         self.assertEqual(Resource.STATUS_LOCKED, items[2]['status'])
+
+    def test_ippool_newip_fields(self):
+        ipnet1 = IPNetworkPool.objects.create(network='192.168.1.1/24')
+
+        response = self.client.get('/v1/ipman/rent?pool=%s&count=1&fields=id,address' % ipnet1.id, format='json')
+
+        self.assertEqual([{'id': 2, 'address': '192.168.1.2'}], [dict(item) for item in response.data['results']])
+
+        response = self.client.get('/v1/ipman/rent?pool=%s&count=1&fields=address&options=version' % ipnet1.id,
+                                   format='json')
+
+        item = response.data['results'][0]
+        self.assertEqual(['address', 'options'], sorted(item.keys()))
+        self.assertEqual([('version', '4')], [(option['name'], option['value']) for option in item['options']])
@@ -7,9 +7,10 @@ from cmdb.settings import logger
 from ipman.models import IPAddressPool
 from ipman.serializers import IpAddressSerializer
 from resources.models import Resource
+from resources.renderers import MessagePackViewMixin
 
 
-class IpManagerRentIPs(generics.RetrieveAPIView):
+class IpManagerRentIPs(MessagePackViewMixin, generics.RetrieveAPIView):
     """
     Rent new IPs by locking them.
     """
@@ -32,13 +32,13 @@ class ResourceAdmin(DjangoMpttAdmin):
     ]
 
     def filter_tree_queryset(self, queryset):
-        return queryset.exclude(status=Resource.STATUS_DELETED)
+        return queryset.filter(pk__live=True)
 
 
 class ResourceOptionAdmin(admin.ModelAdmin):
     list_display = ['resource', 'id', 'name', 'value', 'format', 'updated_at']
-    search_fields = ['name', 'value', 'format', 'resource']
-    list_filter = ['name', 'format']
+    search_fields = ['key__name', 'value', 'format', 'resource']
+    list_filter = ['key', 'format']
     raw_id_fields = ['resource']
 
 
@@ -0,0 +1,343 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+from django.apps import apps
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from resources.models import Resource, ResourceOption, resource_session
+
+
+class ResourceBulkWriter(object):
+    """
+    Apply many create/update/status operations of the resources in one transaction:
+        {"op": "create", "type": "assets.Server", "name": "srv1", "parent": 1, "options": [{"name": "label", ...}]}
+        {"op": "update", "id": 10, "name": "srv2", "options": [{"name": "label", "value": "db"}]}
+        {"op": "status", "id": 11, "status": "deleted"}
+
+    Options are also accepted as the name -> value map of the compact clients: "options": {"label": "db"}.
+
+    The op is optional: items with the id are updates, the others are creates. All items are validated
+    before the first write, no items are written if any of them is invalid. Creates are inserted with
+    bulk_create_with_options() grouped by type, then updates are written in one resource session.
+    """
+    OP_CREATE = 'create'
+    OP_UPDATE = 'update'
+    OP_STATUS = 'status'
+    OPERATIONS = (OP_CREATE, OP_UPDATE, OP_STATUS)
+
+    FIELDS = ('name', 'parent', 'status', 'last_seen')
+
+    # resources and parents are loaded in chunks, the number of query parameters is limited
+    query_chunk_size = 500
+
+    def __init__(self, items, batch_size=1000):
+        self.items = items
+        self.batch_size = batch_size
+
+        self.errors = []
+        self.results = None
+
+        # validated operations: (index, op, data)
+        self._operations = []
+        self._resources = {}
+        self._parents = {}
+
+    def is_valid(self):
+        """
+        Validate the items, errors are collected per item: [{'index': 0, 'errors': {'field': ['message']}}].
+        """
+        self.errors = []
+        self._operations = []
+
+        if not isinstance(self.items, list):
+            self.errors.append({'index': None, 'errors': {'non_field_errors': ["Expected a list of items."]}})
+            return False
+
+        for index, item in enumerate(self.items):
+            errors = {}
+            operation = self._validate_item(item, errors)
+            if errors:
+                self.errors.append({'index': index, 'errors': errors})
+            else:
+                self._operations.append((index,) + operation)
+
+        if not self.errors:
+            self._load_resources()
+
+        return not self.errors
+
+    def save(self):
+        """
+        Write the validated operations, returns the per item results: [{'index': 0, 'op': 'create', 'id': 1}].
+        """
+        assert self.results is None, "Operations are already saved."
+        assert not self.errors, "Operations are not valid."
+
+        results = {}
+        with transaction.atomic(), Resource.objects.delay_mptt_updates():
+            self._save_creates(results)
+            self._save_updates(results)
+
+        self.results = [results[index] for index, op, data in self._operations]
+
+        return self.results
+
+    def _validate_item(self, item, errors):
+        if not isinstance(item, dict):
+            errors['non_field_errors'] = ["Expected an object."]
+            return None
+
+        op = item.get('op', self.OP_UPDATE if 'id' in item else self.OP_CREATE)
+        if op not in self.OPERATIONS:
+            errors['op'] = ["Invalid operation \"%s\", use one of: %s." % (op, ', '.join(self.OPERATIONS))]
+            return None
+
+        data = {}
+
+        if op == self.OP_CREATE:
+            if 'id' in item:
+                errors['id'] = ["Id of the new resource is not expected."]
+
+            data['model'] = self._validate_type(item.get('type', 'resources.Resource'), errors)
+        else:
+            data['id'] = self._validate_id(item.get('id'), 'id', errors)
+
+        allowed_fields = ('status',) if op == self.OP_STATUS else self.FIELDS
+        for field_name in self.FIELDS:
+            if field_name not in item:
+                continue
+
+            if field_name not in allowed_fields:
+                errors[field_name] = ["Field is not expected in the \"%s\" operation." % op]
+                continue
+
+            data[field_name] = self._validate_field(field_name, item[field_name], errors)
+
+        if op == self.OP_STATUS and 'status' not in item:
+            errors['status'] = ["This field is required."]
+
+        if 'options' in item and op == self.OP_STATUS:
+            errors['options'] = ["Field is not expected in the \"%s\" operation." % op]
+        elif 'options' in item:
+            data['options'] = self._validate_options(item['options'], errors)
+
+        unknown_fields = set(item) - set(self.FIELDS) - {'op', 'id', 'type', 'options'}
+        for field_name in unknown_fields:
+            errors[field_name] = ["Unknown field."]
+
+        return op, data
+
+    @staticmethod
+    def _validate_type(type_name, errors):
+        try:
+            model = apps.get_model(type_name)
+        except (LookupError, ValueError, TypeError):
+            model = None
+
+        if model is None or not issubclass(model, Resource):
+            errors['type'] = ["Invalid resource type \"%s\", use app.Model." % type_name]
+
+        return model
+
+    @staticmethod
+    def _validate_id(value, field_name, errors):
+        if isinstance(value, bool) or not isinstance(value, (int, long)):
+            errors[field_name] = ["A valid integer is required."]
+            return None
+
+        return value
+
+    def _validate_field(self, field_name, value, errors):
+        if field_name == 'parent':
+            return None if value is None else self._validate_id(value, field_name, errors)
+
+        if field_name == 'status':
+            if value not in dict(Resource.STATUS_CHOICES):
+                errors[field_name] = ["\"%s\" is not a valid choice." % value]
+            return value
+
+        if field_name == 'last_seen':
+            last_seen = parse_datetime(value) if isinstance(value, basestring) else None
+            if last_seen is None:
+                errors[field_name] = ["Datetime has wrong format."]
+            return last_seen
+
+        if not isinstance(value, basestring) or len(value) > Resource._meta.get_field(field_name).max_length:
+            errors[field_name] = ["Not a valid string."]
+
+        return value
+
+    @staticmethod
+    def _validate_options(options, errors):
+        """
+        Returns the list of options: (name, value, format, journaling), None format and journaling are kept
+        from the existing options.
+        """
+        if isinstance(options, dict):
+            options = [{'name': name, 'value': value} for name, value in options.items()]
+
+        if not isinstance(options, list):
+            errors['options'] = ["Expected a list of options."]
+            return []
+
+        option_errors = []
+        validated = []
+        formats = dict(ResourceOption.FORMAT_CHOICES)
+        for option in options:
+            if not isinstance(option, dict) or not option.get('name') or 'value' not in option:
+                option_errors.append("Option name and value are required.")
+            elif 'format' in option and option['format'] not in formats:
+                option_errors.append("\"%s\" is not a valid option format." % option['format'])
+            elif not isinstance(option.get('journaling', True), bool):
+                option_errors.append("Option journaling must be a boolean.")
+            else:
+                validated.append((option['name'], option['value'], option.get('format'), option.get('journaling')))
+
+        if option_errors:
+            errors['options'] = option_errors
+
+        return validated
+
+    def _load_resources(self):
+        """
+        Load the updated resources with their options and the parents, missing resources are the item errors.
+        """
+        resource_ids = set()
+        parent_ids = set()
+        for index, op, data in self._operations:
+            if 'id' in data:
+                resource_ids.add(data['id'])
+            if data.get('parent') is not None:
+                parent_ids.add(data['parent'])
+
+        self._resources = self._load_chunked(Resource.active.prefetch_options(), resource_ids)
+        self._parents = self._load_chunked(Resource.active.all(), parent_ids - set(self._resources))
+        self._parents.update((resource_id, self._resources[resource_id])
+                             for resource_id in parent_ids if resource_id in self._resources)
+
+        for index, op, data in self._operations:
+            errors = {}
+            if 'id' in data and data['id'] not in self._resources:
+                errors['id'] = ["Resource %s is not found." % data['id']]
+            if data.get('parent') is not None and data['parent'] not in self._parents:
+                errors['parent'] = ["Parent resource %s is not found." % data['parent']]
+
+            if errors:
+                self.errors.append({'index': index, 'errors': errors})
+
+        if not self.errors:
+            self._check_deleted_children()
+
+    def _check_deleted_children(self):
+        """
+        Deleted resources must have no children, as Resource.delete() checks. Children, that are deleted or moved
+        to the other parent in the same request, are not counted.
+        """
+        deleted = {}
+        moved_parents = {}
+        new_parent_ids = set()
+        for index, op, data in self._operations:
+            if data.get('status') == Resource.STATUS_DELETED:
+                deleted[data['id']] = index
+
+            if 'id' not in data:
+                new_parent_ids.add(data.get('parent'))
+            elif 'parent' in data:
+                moved_parents[data['id']] = data['parent']
+
+        if not deleted:
+            return
+
+        # children are created or moved to the deleted resources in the same request
+        parent_ids = set(parent_id for child_id, parent_id in moved_parents.items() if child_id not in deleted)
+        parent_ids.update(new_parent_ids)
+
+        deleted_ids = sorted(deleted)
+        for chunk_start in range(0, len(deleted_ids), self.query_chunk_size):
+            chunk_ids = deleted_ids[chunk_start:chunk_start + self.query_chunk_size]
+            for child_id, parent_id in Resource.active.filter(parent__in=chunk_ids).values_list('id', 'parent'):
+                if child_id not in deleted and moved_parents.get(child_id, parent_id) == parent_id:
+                    parent_ids.add(parent_id)
+
+        for resource_id, index in sorted(deleted.items(), key=lambda item: item[1]):
+            if resource_id in parent_ids:
+                self.errors.append({'index': index, 'errors': {
+                    'status': ["Resource %s has one or more children." % resource_id]}})
+
+    def _load_chunked(self, queryset, ids):
+        ids = sorted(ids)
+
+        resources = {}
+        for chunk_start in range(0, len(ids), self.query_chunk_size):
+            for resource in queryset.filter(pk__in=ids[chunk_start:chunk_start + self.query_chunk_size]):
+                resources[resource.id] = resource
+
+        return resources
+
+    def _save_creates(self, results):
+        creates = OrderedDict()
+        for index, op, data in self._operations:
+            if op == self.OP_CREATE:
+                creates.setdefault(data['model'], []).append((index, data))
+
+        for model, model_creates in creates.items():
+            rows = []
+            rows_options = []
+            for index, data in model_creates:
+                row = dict((field_name, data[field_name]) for field_name in self.FIELDS if field_name in data)
+                if row.get('parent') is not None:
+                    row['parent'] = self._parents[row['parent']]
+
+                rows.append(row)
+                rows_options.append([(name, value, value_format, True if journaling is None else journaling)
+                                     for name, value, value_format, journaling in data.get('options', [])])
+
+            created = Resource.objects.bulk_create_with_options(model, rows, batch_size=self.batch_size,
+                                                                rows_options=rows_options)
+
+            for (index, data), resource in zip(model_creates, created):
+                results[index] = {'index': index, 'op': self.OP_CREATE, 'id': resource.id}
+
+    def _save_updates(self, results):
+        with resource_session():
+            for index, op, data in self._operations:
+                if op == self.OP_CREATE:
+                    continue
+
+                resource = self._resources[data['id']]
+
+                changed = False
+                for field_name in self.FIELDS:
+                    if field_name not in data:
+                        continue
+
+                    value = data[field_name]
+                    if field_name == 'parent':
+                        if resource.parent_id != value:
+                            resource.parent = self._parents[value] if value is not None else None
+                            changed = True
+                    elif getattr(resource, field_name) != value:
+                        setattr(resource, field_name, value)
+                        changed = True
+
+                if changed:
+                    resource.save()
+
+                self._set_options(resource, data.get('options', []))
+
+                results[index] = {'index': index, 'op': op, 'id': resource.id}
+
+    @staticmethod
+    def _set_options(resource, options):
+        for name, value, value_format, journaling in options:
+            # format and journaling of the existing option are kept, if they are not given
+            saved_option = resource.get_option(name) if resource.has_option(name) else None
+
+            if value_format is None and saved_option:
+                value_format = saved_option.format
+            if journaling is None:
+                journaling = saved_option.journaling if saved_option else True
+
+            resource.set_option(name, value, format=value_format, journaling=journaling)
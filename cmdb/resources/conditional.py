@@ -0,0 +1,141 @@
+from __future__ import unicode_literals
+
+import hashlib
+from datetime import timedelta
+
+from django.db.models import Count, Max
+from django.db.models.query import QuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from resources.models import Resource
+from resources.optionstorage import get_option_storage
+from resources.querycache import get_query_cache, query_cache_key
+
+
+class ResourcesVersion(object):
+    """
+    Version of the resources representation for the conditional requests, read from the database, so all
+    the processes give the same version of the same data. ETag is the hash of the representation key (such as
+    the request path) and the state of the selected resources and their options: the latest updated_at,
+    the number of the rows and the latest id. Removed resources and options change the numbers.
+
+    Last-Modified is the latest updated_at of the resource and its options (removed options touch the resource).
+
+    With the query cache (RESOURCES_QUERY_CACHE) the state of the list is stored with the change counters of
+    the selected types, so the version is read from the cache, until the resources of these types are changed.
+    Last-Modified of the list is the time, when the changed state was found: the resources, removed from
+    the list, are not in the selected timestamps. Lists have no Last-Modified without the query cache.
+    """
+
+    def __init__(self, key, last_modified, state):
+        self.key = key
+        self.last_modified = last_modified
+        self.state = state
+
+    @property
+    def etag(self):
+        version = '%s|%s' % (self.key, '.'.join(unicode(value) for value in self.state))
+
+        return hashlib.md5(version.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def of_resource(cls, resource_id, key=''):
+        """
+        Returns the version of the live resource, or None, if it is not found.
+        """
+        queryset = QuerySet(Resource).filter(pk=resource_id, pk__live=True)
+        fields = ['updated_at']
+        if get_option_storage().stores_rows:
+            queryset = queryset.annotate(options_updated_at=Max('resourceoption__updated_at'),
+                                         options_count=Count('resourceoption'))
+            fields.extend(['options_updated_at', 'options_count'])
+
+        rows = list(queryset.values(*fields))
+        if not rows:
+            return None
+
+        last_modified = cls._latest(rows[0]['updated_at'], rows[0].get('options_updated_at'))
+
+        return cls(key, last_modified, [last_modified.isoformat() if last_modified else '',
+                                        rows[0].get('options_count')])
+
+    @classmethod
+    def of_queryset(cls, queryset, key=''):
+        """
+        Returns the version of the selected resources.
+        """
+        query_cache = get_query_cache()
+        if query_cache is None:
+            return cls(key, None, cls._get_state(queryset))
+
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return cls(key, None, cls._get_state(queryset))
+
+        # queries with the hierarchy, options and the other not cached lookups depend on the changes of any type
+        cache_key = query_cache_key(queryset)
+        types = cache_key[1] if cache_key else None
+
+        version_key = 'resources:version:%s' % hashlib.md5(('%s|%r' % (sql, params)).encode('utf-8')).hexdigest()
+        counters = query_cache.get_counters(types)
+
+        cached = query_cache.backend.get(version_key)
+        if cached is not None and cached[0] == counters:
+            return cls(key, cached[2], cached[1])
+
+        state = cls._get_state(queryset)
+        if cached is not None and cached[1] == state:
+            last_modified = cached[2]
+        else:
+            # Last-Modified has the second precision, the changed state is always in the later second
+            last_modified = timezone.now().replace(microsecond=0)
+            if cached is not None and cached[2] >= last_modified:
+                last_modified = cached[2] + timedelta(seconds=1)
+
+        # counters, read in the transaction with the changes, are bumped after it
+        if query_cache.is_usable():
+            query_cache.backend.set(version_key, (counters, state, last_modified))
+
+        return cls(key, last_modified, state)
+
+    @classmethod
+    def _get_state(cls, queryset):
+        """
+        Returns the state of the selected resources, read with one aggregate query.
+        """
+        aggregates = dict(updated_at=Max('updated_at'), count=Count('id', distinct=True), last_id=Max('id'))
+        if get_option_storage().stores_rows:
+            aggregates.update(options_updated_at=Max('resourceoption__updated_at'),
+                              options_count=Count('resourceoption'))
+
+        latest = queryset.order_by().aggregate(**aggregates)
+
+        updated_at = cls._latest(latest['updated_at'], latest.get('options_updated_at'))
+
+        return [updated_at.isoformat() if updated_at else '', latest['count'], latest['last_id'],
+                latest.get('options_count')]
+
+    @staticmethod
+    def _latest(*timestamps):
+        timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+
+        return max(timestamps) if timestamps else None
+
+
+def conditional_response(request, version, view_func):
+    """
+    Returns 304 Not Modified, if the conditional request (If-None-Match, If-Modified-Since) matches
+    the version, otherwise the response of view_func() with the ETag and Last-Modified headers.
+    :param version: ResourcesVersion or None, if the resource is not found
+    """
+    etag = version.etag if version else None
+    last_modified = version.last_modified if version else None
+
+    @condition(etag_func=lambda request: etag, last_modified_func=lambda request: last_modified)
+    def view(request):
+        return view_func()
+
+    return view(request)
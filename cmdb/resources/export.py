@@ -0,0 +1,142 @@
+from __future__ import unicode_literals
+
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.encoding import force_bytes
+
+from resources.hierarchy import get_hierarchy
+from resources.models import Resource, ResourceOption
+
+
+class _EchoBuffer(object):
+    """
+    File-like object for csv.writer: the written line is returned, not buffered.
+    """
+
+    def write(self, value):
+        return value
+
+
+class ResourceExporter(object):
+    """
+    Streaming export of the resources with their options. Resources are selected in chunks by id
+    (id > last id of the previous chunk), options of the chunk are selected with one query, so memory
+    doesn't depend on the number of the exported resources:
+        for line in ResourceExporter(Resource.active.filter(type='Server')).ndjson():
+            out.write(line)
+
+    Lines are the utf-8 encoded bytes.
+    """
+    FORMAT_NDJSON = 'ndjson'
+    FORMAT_CSV = 'csv'
+    FORMATS = (FORMAT_NDJSON, FORMAT_CSV)
+
+    CONTENT_TYPES = {
+        FORMAT_NDJSON: 'application/x-ndjson',
+        FORMAT_CSV: 'text/csv',
+    }
+
+    FIELDS = ('id', 'type', 'name', 'status', 'parent_id', 'created_at', 'updated_at', 'last_seen')
+
+    def __init__(self, queryset, option_names=None, chunk_size=500):
+        """
+        :param queryset: resources to export
+        :param option_names: options to export, all options if None
+        :param chunk_size: number of resources selected with one query
+        """
+        self.queryset = queryset
+        self.option_names = option_names
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def filter(cls, types=None, statuses=None, subtree=None):
+        """
+        Returns the resources to export: live resources by default, deleted resources are exported
+        only with the explicit statuses.
+        :param types: type names of the resources, such as 'Server'
+        :param statuses: statuses of the resources
+        :param subtree: root resource of the exported subtree
+        """
+        queryset = Resource.objects.filter(status__in=statuses) if statuses else Resource.active.all()
+
+        if types:
+            queryset = queryset.filter(type__in=types)
+
+        if subtree is not None:
+            queryset = get_hierarchy().descendants(subtree, queryset, include_self=True)
+
+        return queryset
+
+    def export(self, export_format):
+        assert export_format in self.FORMATS, "Unknown export format: %s" % export_format
+
+        return self.ndjson() if export_format == self.FORMAT_NDJSON else self.csv()
+
+    def rows(self):
+        """
+        Returns dicts with the resource fields and the dict of options, ordered by id.
+        """
+        for chunk in self._chunks():
+            options = ResourceOption.objects.decoded_by_resource([row[0] for row in chunk], names=self.option_names,
+                                                                  batch_size=len(chunk))
+
+            for row in chunk:
+                resource = dict(zip(self.FIELDS, row))
+                resource['options'] = options[resource['id']]
+                yield resource
+
+    def ndjson(self):
+        for resource in self.rows():
+            yield force_bytes(json.dumps(resource, cls=DjangoJSONEncoder, sort_keys=True)) + b'\n'
+
+    def csv(self):
+        """
+        Columns are the resource fields and the selected options. If options are not selected, all options
+        are written to the 'options' column as the JSON object.
+        """
+        option_columns = list(self.option_names) if self.option_names is not None else None
+        writer = csv.writer(_EchoBuffer())
+
+        yield writer.writerow([force_bytes(column) for column in
+                               self.FIELDS + tuple(option_columns if option_columns is not None else ['options'])])
+
+        for resource in self.rows():
+            values = [self._csv_value(resource[field_name]) for field_name in self.FIELDS]
+            if option_columns is not None:
+                values.extend(self._csv_value(resource['options'].get(name)) for name in option_columns)
+            else:
+                values.append(force_bytes(json.dumps(resource['options'], cls=DjangoJSONEncoder, sort_keys=True)))
+
+            yield writer.writerow(values)
+
+    def _chunks(self):
+        queryset = self.queryset.order_by('id').values_list(*self.FIELDS)
+
+        last_id = None
+        while True:
+            chunk_queryset = queryset.filter(id__gt=last_id) if last_id is not None else queryset
+            chunk = list(chunk_queryset[:self.chunk_size])
+            if not chunk:
+                return
+
+            yield chunk
+
+            if len(chunk) < self.chunk_size:
+                return
+
+            last_id = chunk[-1][0]
+
+    @staticmethod
+    def _csv_value(value):
+        if value is None:
+            return b''
+
+        if hasattr(value, 'isoformat'):
+            return force_bytes(value.isoformat())
+
+        if isinstance(value, (dict, list)):
+            return force_bytes(json.dumps(value, cls=DjangoJSONEncoder, sort_keys=True))
+
+        return force_bytes(value)
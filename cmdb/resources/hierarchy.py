@@ -0,0 +1,123 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import connection
+
+
+class MPTTHierarchy(object):
+    """
+    Nested sets of django-mptt: subtrees are read by the lft/rght range, but every move shifts lft/rght
+    of the large part of the tree.
+    """
+    name = 'mptt'
+
+    # MPTT fields are updated by django-mptt on save
+    maintains_nested_sets = True
+
+    # order of the nodes, that is the depth-first order inside the subtree
+    tree_order = 'lft'
+
+    def descendants(self, resource, queryset, include_self=False):
+        """
+        Filter queryset by the subtree of the resource. Bounds are selected by the subqueries, because
+        lft and rght of the resource instance are not updated when nodes are moved into its tree.
+        """
+        return self._filter_range(queryset, resource, '>=' if include_self else '>', '<=' if include_self else '<')
+
+    def ancestors(self, resource, queryset, include_self=False):
+        return self._filter_range(queryset, resource, '<=' if include_self else '<', '>=' if include_self else '>')
+
+    def node_moved(self, resource):
+        pass
+
+    @staticmethod
+    def _filter_range(queryset, resource, lft_op, rght_op):
+        table = queryset.model._meta.db_table
+        bound_sql = '(SELECT %%s FROM %s WHERE id = %%%%s)' % table
+
+        return queryset.extra(
+            where=['%s.tree_id = %s' % (table, bound_sql % 'tree_id'),
+                   '%s.lft %s %s' % (table, lft_op, bound_sql % 'lft'),
+                   '%s.rght %s %s' % (table, rght_op, bound_sql % 'rght')],
+            params=[resource.id] * 3)
+
+
+class RecursiveCTEHierarchy(object):
+    """
+    Adjacency list, subtrees and paths are read by the recursive CTE queries over the parent links.
+    Move is a single UPDATE of tree_id and level of the moved subtree, lft/rght are not maintained:
+    run Resource.objects.rebuild() before switching back to the 'mptt' hierarchy.
+    """
+    name = 'cte'
+
+    maintains_nested_sets = False
+
+    tree_order = 'id'
+
+    DESCENDANTS_SQL = """
+        WITH RECURSIVE subtree(id) AS (
+            SELECT id FROM %(table)s WHERE id = %%s
+            UNION ALL
+            SELECT child.id FROM %(table)s child INNER JOIN subtree ON child.parent_id = subtree.id
+        )
+        SELECT id FROM subtree"""
+
+    ANCESTORS_SQL = """
+        WITH RECURSIVE path(id, parent_id) AS (
+            SELECT id, parent_id FROM %(table)s WHERE id = %%s
+            UNION ALL
+            SELECT parent.id, parent.parent_id FROM %(table)s parent INNER JOIN path ON parent.id = path.parent_id
+        )
+        SELECT id FROM path"""
+
+    def descendants(self, resource, queryset, include_self=False):
+        return self._filter_recursive(queryset, resource, self.DESCENDANTS_SQL, include_self)
+
+    def ancestors(self, resource, queryset, include_self=False):
+        return self._filter_recursive(queryset, resource, self.ANCESTORS_SQL, include_self)
+
+    def node_moved(self, resource):
+        """
+        Set tree_id and level of the moved (or created) resource and its subtree from the new parent.
+        """
+        table = resource._meta.db_table
+
+        with connection.cursor() as cursor:
+            if resource.parent_id:
+                cursor.execute('SELECT tree_id, level FROM %s WHERE id = %%s' % table, [resource.parent_id])
+                tree_id, parent_level = cursor.fetchone()
+                level = parent_level + 1
+            else:
+                cursor.execute('SELECT MAX(tree_id) FROM %s' % table)
+                tree_id = (cursor.fetchone()[0] or 0) + 1
+                level = 0
+
+            cursor.execute(
+                'UPDATE %(table)s SET tree_id = %%s, level = level + %%s WHERE id IN (%(subtree)s)' % dict(
+                    table=table, subtree=self.DESCENDANTS_SQL % dict(table=table)),
+                [tree_id, level - resource.level, resource.id])
+
+        resource.tree_id = tree_id
+        resource.level = level
+
+    @staticmethod
+    def _filter_recursive(queryset, resource, recursive_sql, include_self):
+        table = queryset.model._meta.db_table
+
+        where = ['%s.id IN (%s)' % (table, recursive_sql % dict(table=table))]
+        params = [resource.id]
+        if not include_self:
+            where.append('%s.id <> %%s' % table)
+            params.append(resource.id)
+
+        return queryset.extra(where=where, params=params)
+
+
+HIERARCHY_BACKENDS = dict((backend.name, backend) for backend in (MPTTHierarchy(), RecursiveCTEHierarchy()))
+
+
+def get_hierarchy():
+    """
+    Returns the hierarchy backend, selected by the RESOURCES_HIERARCHY setting ('mptt' by default).
+    """
+    return HIERARCHY_BACKENDS[getattr(settings, 'RESOURCES_HIERARCHY', MPTTHierarchy.name)]
@@ -1,39 +1,61 @@
 from __future__ import unicode_literals
 
+from resources.hierarchy import get_hierarchy
+from resources.models import Resource, ModelFieldChecker
+
+
+def _needs_options(fields):
+    return fields and not all(ModelFieldChecker.is_model_field(Resource, field) for field in fields)
+
+
 class PathIterator(object):
-    def __init__(self, resource):
+    """
+    Iterate from the tree root to the resource. Ancestors are loaded with a single query.
+    """
+
+    def __init__(self, resource, fields=None):
         self.resource = resource
+        self.fields = fields
 
     def __iter__(self):
-        for res in self._iter_inner(self.resource):
-            yield res
+        ancestors = get_hierarchy().ancestors(self.resource, Resource.objects.all()).order_by('level')
 
-    def _iter_inner(self, resource):
-        if resource.parent:
-            for res in self._iter_inner(resource.typed_parent):
-                yield res
+        if _needs_options(self.fields):
+            ancestors = ancestors.prefetch_options()
 
-        yield resource
+        for res in ancestors:
+            yield res
+
+        yield self.resource
 
 
 class TreeIterator(object):
-    def __init__(self, resource):
+    """
+    Iterate through the active subtree of the resource in depth-first order. Nodes are loaded with a single
+    query, self.level is the level of the current node (1 for the resource itself).
+    """
+
+    def __init__(self, resource, fields=None):
         self.resource = resource
+        self.fields = fields
         self.level = 0
 
     def __iter__(self):
-        self.level = 0
+        hierarchy = get_hierarchy()
+        descendants = hierarchy.descendants(self.resource, Resource.active.all()).order_by(hierarchy.tree_order)
 
-        for res in self._iter_inner(self.resource):
-            yield res
+        if _needs_options(self.fields):
+            descendants = descendants.prefetch_options()
 
-    def _iter_inner(self, resource):
-        self.level += 1
+        # subtrees of the deleted resources are skipped, as they are not reachable through the active childs
+        children = {}
+        for res in descendants:
+            children.setdefault(res.parent_id, []).append(res)
 
-        yield resource
+        stack = [(self.resource, 1)]
+        while stack:
+            res, self.level = stack.pop()
 
-        for res in resource:
-            for res_inner in self._iter_inner(res):
-                yield res_inner
+            yield res
 
-        self.level -= 1
+            stack.extend((child, self.level + 1) for child in reversed(children.get(res.id, [])))
@@ -7,10 +7,13 @@ from django.utils import timezone
 from prettytable import PrettyTable
 
 from cmdb.settings import logger
-from resources.models import ModelFieldChecker
+from resources.models import ModelFieldChecker, ResourceOption
 
 
 class ConsoleResourceWriter:
+    # fields, that are printed from the resource instance
+    special_fields = ('self', 'parent_id')
+
     def __init__(self, resources_iterable):
         if not resources_iterable:
             resources_iterable = []
@@ -28,9 +31,21 @@ class ConsoleResourceWriter:
         for afield in table.align:
             table.align[afield] = 'l'
 
-        for resource in self.resources_iterable:
+        resources = list(self.resources_iterable)
+
+        # option columns of all the resources are decoded in bulk, options are not instantiated
+        option_fields = [field for field in fields
+                         if field not in self.special_fields and ModelFieldChecker.is_option_field(field)]
+        resource_ids = [resource.id for resource in resources if isinstance(resource, models.Model)]
+        options = ResourceOption.objects.decoded_by_resource(resource_ids, option_fields) \
+            if option_fields and resource_ids else {}
+
+        for resource in resources:
             if isinstance(resource, models.Model):
-                table.add_row(self._get_resource_data_row(resource, fields))
+                row_options = dict((field, '%s?' % field) for field in option_fields)
+                row_options.update(options.get(resource.id, {}))
+
+                table.add_row(self._get_resource_data_row(resource, fields, row_options))
             else:
                 table.add_row(resource)
 
@@ -69,6 +84,9 @@ class ConsoleResourceWriter:
 
         # dump model fields
         for field in resource.__class__._meta.fields:
+            if field.name == 'options_data':
+                continue
+
             field_value = getattr(resource, field.name)
             if isinstance(field, DateTimeField):
                 field_value = timezone.localtime(field_value)
@@ -76,11 +94,15 @@ class ConsoleResourceWriter:
             logger.info("%s = %s" % (field.name, field_value))
 
         # dump resource options
-        for option in resource.get_options():
-            logger.info("%s" % option)
+        options = ResourceOption.objects.decoded_by_resource([resource.id])[resource.id]
+        for name, value in sorted(options.items()):
+            logger.info("%s = %s" % (name, value))
 
     @staticmethod
-    def _get_resource_data_row(resource, fields=None):
+    def _get_resource_data_row(resource, fields=None, options=None):
+        """
+        :param options: already loaded option values by name
+        """
         assert resource
         assert fields
 
@@ -88,6 +110,8 @@ class ConsoleResourceWriter:
         for field in fields:
             if field == 'parent_id':
                 field_value = resource.parent_id
+            elif options and field in options:
+                field_value = options[field]
             elif field == 'self':
                 field_value = unicode(resource)
             else:
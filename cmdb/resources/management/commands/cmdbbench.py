@@ -0,0 +1,766 @@
+from __future__ import unicode_literals
+
+import random
+import resource as resource_usage
+import time
+from argparse import ArgumentParser
+from datetime import timedelta
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.db.models import Max
+from django.db.models.query import QuerySet
+from django.test.utils import CaptureQueriesContext, override_settings
+from prettytable import PrettyTable
+
+from cmdb.settings import logger
+from resources.iterators import TreeIterator
+from resources.models import Resource, ResourceOption
+
+
+class Command(BaseCommand):
+    """
+    Performance benchmarks of the CMDB storage. Synthetic data is generated in a transaction,
+    that is rolled back at the end, so the existing data is not modified.
+    """
+    registered_handlers = {}
+
+    batch_size = 5000
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(title="CMDB performance benchmarks",
+                                           help="Commands help",
+                                           dest='manager_name',
+                                           parser_class=ArgumentParser)
+
+        filter_cmd = subparsers.add_parser('filter', help="Compare query time of the search by options.")
+        filter_cmd.add_argument('--resources', type=int, default=100000, help="Number of resources to generate.")
+        filter_cmd.add_argument('--options', type=int, default=10, help="Number of options per resource.")
+        filter_cmd.add_argument('--repeat', type=int, default=3, help="Repeat each query N times, take the best.")
+        self._register_handler('filter', self._handle_filter)
+
+        create_cmd = subparsers.add_parser('create', help="Compare create() and bulk_create_with_options().")
+        create_cmd.add_argument('--count', type=int, default=1024, help="Number of IP addresses to create.")
+        self._register_handler('create', self._handle_create)
+
+        storage_cmd = subparsers.add_parser('storage', help="Size of the resource options tables and indexes.")
+        storage_cmd.add_argument('--resources', type=int, default=100000, help="Number of IP addresses to generate.")
+        self._register_handler('storage', self._handle_storage)
+
+        hierarchy_cmd = subparsers.add_parser('hierarchy', help="Compare move and subtree read costs of the "
+                                                                "resource hierarchy backends.")
+        hierarchy_cmd.add_argument('--nodes', type=int, default=500000, help="Number of resources to generate.")
+        hierarchy_cmd.add_argument('--moves', type=int, default=100, help="Number of servers to move.")
+        hierarchy_cmd.add_argument('--reads', type=int, default=20, help="Number of subtrees to read.")
+        self._register_handler('hierarchy', self._handle_hierarchy)
+
+        options_cmd = subparsers.add_parser('options', help="Compare filter and serializer time of the option "
+                                                            "storages: rows and JSON documents.")
+        options_cmd.add_argument('--resources', type=int, default=100000, help="Number of resources to generate.")
+        options_cmd.add_argument('--options', type=int, default=10, help="Number of options per resource.")
+        options_cmd.add_argument('--serialize', type=int, default=1000, help="Number of resources to serialize.")
+        options_cmd.add_argument('--repeat', type=int, default=3, help="Repeat each query N times, take the best.")
+        self._register_handler('options', self._handle_options)
+
+        api_cmd = subparsers.add_parser('api', help="Compare response size and time of the resources API with "
+                                                    "the selected fields and options.")
+        api_cmd.add_argument('--resources', type=int, default=10000, help="Number of resources to generate.")
+        api_cmd.add_argument('--options', type=int, default=10, help="Number of options per resource.")
+        api_cmd.add_argument('--page-size', type=int, default=1000, help="Number of resources per page.")
+        api_cmd.add_argument('--repeat', type=int, default=3, help="Repeat each request N times, take the best.")
+        self._register_handler('api', self._handle_api)
+
+        bulk_cmd = subparsers.add_parser('bulk', help="Compare the per item resources API with the bulk endpoint.")
+        bulk_cmd.add_argument('--count', type=int, default=10000, help="Number of resources to create and update.")
+        self._register_handler('bulk', self._handle_bulk)
+
+        export_cmd = subparsers.add_parser('export', help="Measure time and memory of the streaming export.")
+        export_cmd.add_argument('--resources', type=int, default=1000000, help="Number of resources to generate.")
+        export_cmd.add_argument('--options', type=int, default=10, help="Number of options per resource.")
+        self._register_handler('export', self._handle_export)
+
+        changes_cmd = subparsers.add_parser('changes', help="Compare the change feed page with the full scan.")
+        changes_cmd.add_argument('--resources', type=int, default=100000, help="Number of resources to generate.")
+        changes_cmd.add_argument('--events', type=int, default=1000000, help="Number of history events to generate.")
+        changes_cmd.add_argument('--changed', type=int, default=1000, help="Number of the new events to read.")
+        changes_cmd.add_argument('--repeat', type=int, default=3, help="Repeat each read N times, take the best.")
+        self._register_handler('changes', self._handle_changes)
+
+        msgpack_cmd = subparsers.add_parser('msgpack', help="Compare serialization time and payload size of "
+                                                            "the JSON and MessagePack representations.")
+        msgpack_cmd.add_argument('--resources', type=int, default=10000, help="Number of resources to serialize.")
+        msgpack_cmd.add_argument('--options', type=int, default=10, help="Number of options per resource.")
+        msgpack_cmd.add_argument('--repeat', type=int, default=3, help="Repeat each step N times, take the best.")
+        self._register_handler('msgpack', self._handle_msgpack)
+
+    def handle(self, *args, **options):
+        if 'subcommand_name' in options:
+            subcommand = "%s.%s" % (options['manager_name'], options['subcommand_name'])
+        else:
+            subcommand = options['manager_name']
+
+        # call handler
+        self.registered_handlers[subcommand](*args, **options)
+
+    def _handle_filter(self, *args, **options):
+        options_count = options['options']
+        repeat = options['repeat']
+
+        lookups_list = [
+            dict(opt_1='value_1'),
+            dict(opt_1='value_1', opt_2='value_2'),
+            dict(opt_1='value_1', opt_2='value_2', opt_3__contains='lue_3'),
+            dict(opt_4__in=['value_4', 'value_5'], status=Resource.STATUS_FREE),
+            dict(opt_5__startswith='value_1', opt_6__contains='value'),
+        ]
+
+        with transaction.atomic():
+            self._populate(options['resources'], options_count)
+
+            table = PrettyTable(['query', 'found', 'joins + DISTINCT, ms', 'subqueries, ms'])
+            table.align['query'] = 'l'
+
+            for lookups in lookups_list:
+                legacy_ids, legacy_time = self._measure(self._legacy_filter(lookups), repeat)
+                new_ids, new_time = self._measure(Resource.objects.filter(**lookups), repeat)
+
+                assert set(legacy_ids) == set(new_ids), "Query results differ for %s" % lookups
+
+                table.add_row([', '.join(sorted(lookups.keys())), len(new_ids),
+                               "%.1f" % (legacy_time * 1000), "%.1f" % (new_time * 1000)])
+
+            logger.info(table.get_string())
+
+            transaction.set_rollback(True)
+
+    def _handle_options(self, *args, **options):
+        """
+        Options are generated as rows and measured, then moved to the JSON documents, opt_1 and opt_2
+        are indexed and the same queries are measured again. Only the options of the generated resources
+        are moved. Indexes are built over the whole resources table, so they are created only if the database
+        has no other resources (dedicated benchmark database).
+        """
+        # serializers depend on rest_framework, so they are imported on demand
+        from resources.serializers import ResourceSerializer
+
+        repeat = options['repeat']
+
+        lookups_list = [
+            dict(opt_1='value_1'),
+            dict(opt_1='value_1', opt_2='value_2'),
+            dict(opt_1='value_1', opt_3__contains='lue_3'),
+            dict(opt_4__in=['value_4', 'value_5'], status=Resource.STATUS_FREE),
+            dict(opt_5__startswith='value_1'),
+        ]
+
+        with transaction.atomic():
+            self._populate(options['resources'], options['options'])
+
+            bench_resources = QuerySet(Resource).filter(name__startswith='bench-')
+            serialized_ids = list(bench_resources.order_by('id').values_list('id', flat=True)[:options['serialize']])
+
+            results = {}
+            for storage_name in ('rows', 'json'):
+                if storage_name == 'json':
+                    started = time.time()
+                    Resource.objects.migrate_options(storage_name, resources=bench_resources)
+                    if QuerySet(Resource).exclude(name__startswith='bench-').exists():
+                        logger.warning("The database has other resources, JSON options are not indexed.")
+                    else:
+                        Resource.objects.create_option_indexes(['opt_1', 'opt_2'])
+                    logger.info("Options are moved to the JSON documents in %.1f s" % (time.time() - started))
+
+                with override_settings(RESOURCES_OPTIONS_STORAGE=storage_name):
+                    results[storage_name] = [self._measure(Resource.objects.filter(**lookups), repeat)
+                                             for lookups in lookups_list]
+                    results[storage_name].append(self._measure_serializer(ResourceSerializer, serialized_ids,
+                                                                          repeat))
+
+            table = PrettyTable(['query', 'found', 'rows, ms', 'json, ms'])
+            table.align['query'] = 'l'
+
+            queries = [', '.join(sorted(lookups.keys())) for lookups in lookups_list]
+            queries.append('ResourceSerializer(many=True)')
+            for idx, query in enumerate(queries):
+                (rows_ids, rows_time), (json_ids, json_time) = results['rows'][idx], results['json'][idx]
+
+                assert set(rows_ids) == set(json_ids), "Results differ for %s" % query
+
+                table.add_row([query, len(json_ids), "%.1f" % (rows_time * 1000), "%.1f" % (json_time * 1000)])
+
+            logger.info(table.get_string())
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def _measure_serializer(serializer_class, resource_ids, repeat):
+        best_time = None
+        data = []
+
+        for idx in range(repeat):
+            started = time.time()
+            data = serializer_class(Resource.objects.filter(id__in=resource_ids).prefetch_options(), many=True).data
+            spent = time.time() - started
+
+            best_time = spent if best_time is None else min(best_time, spent)
+
+        return [row['id'] for row in data], best_time
+
+    def _handle_api(self, *args, **options):
+        """
+        The first page of the resources is requested with all fields and options, then with the selected
+        fields and options.
+        """
+        # views depend on rest_framework, so they are imported on demand
+        from django.contrib.auth.models import User
+        from rest_framework.renderers import JSONRenderer
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from resources.views import ResourcesViewSet
+
+        params_list = [
+            dict(),
+            dict(fields='id,status,parent'),
+            dict(fields='id,status,parent', options='opt_1,opt_2'),
+        ]
+
+        with transaction.atomic():
+            self._populate(options['resources'], options['options'])
+
+            user = User.objects.create(username='bench-api', is_staff=True)
+            view = ResourcesViewSet.as_view({'get': 'list'})
+            factory = APIRequestFactory()
+
+            table = PrettyTable(['query', 'queries', 'response, KB', 'time, ms'])
+            table.align['query'] = 'l'
+
+            for params in params_list:
+                best_time = None
+                for idx in range(options['repeat']):
+                    request = factory.get('/v1/resources/', dict(params, cursor='', page_size=options['page_size']))
+                    force_authenticate(request, user=user)
+
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.time()
+                        response = view(request)
+                        content = JSONRenderer().render(response.data)
+                        spent = time.time() - started
+
+                    assert response.status_code == 200, "Request failed: %s" % response.data
+                    best_time = spent if best_time is None else min(best_time, spent)
+
+                table.add_row(['&'.join('%s=%s' % item for item in sorted(params.items())) or 'all',
+                               len(queries), "%.1f" % (len(content) / 1024.0), "%.1f" % (best_time * 1000)])
+
+            logger.info(table.get_string())
+
+            transaction.set_rollback(True)
+
+    def _handle_bulk(self, *args, **options):
+        """
+        Resources are created with options and then updated: with one POST/PATCH request per resource,
+        then with one request of the bulk endpoint.
+        """
+        # views depend on rest_framework, so they are imported on demand
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from resources.views import ResourcesViewSet
+
+        count = options['count']
+        factory = APIRequestFactory()
+
+        # the query log is limited, so queries are not counted
+        table = PrettyTable(['method', 'operation', 'resources', 'time, s'])
+
+        for method_name in ('per item', 'bulk'):
+            with transaction.atomic():
+                user = User.objects.create(username='bench-bulk', is_staff=True)
+                parent = Resource.objects.create(name='bench-parent')
+
+                creates = [dict(name='bench-%s' % idx, parent=parent.id,
+                                options=[dict(name='opt_1', value='value_%s' % idx),
+                                         dict(name='opt_2', value=idx, format=ResourceOption.FORMAT_INT)])
+                           for idx in range(count)]
+
+                def update_items(ids):
+                    return [dict(id=resource_id, status=Resource.STATUS_INUSE,
+                                 options=[dict(name='opt_1', value='updated_%s' % idx)])
+                            for idx, resource_id in enumerate(ids)]
+
+                def request(method, path, data):
+                    api_request = getattr(factory, method)(path, data, format='json')
+                    force_authenticate(api_request, user=user)
+                    return api_request
+
+                started = time.time()
+                if method_name == 'per item':
+                    view = ResourcesViewSet.as_view({'post': 'create'})
+                    ids = [view(request('post', '/v1/resources/', item)).data['id'] for item in creates]
+                else:
+                    view = ResourcesViewSet.as_view({'post': 'bulk'})
+                    response = view(request('post', '/v1/resources/bulk/', creates))
+                    assert response.status_code == 200, "Request failed: %s" % response.data
+                    ids = [result['id'] for result in response.data['results']]
+                spent = time.time() - started
+                table.add_row([method_name, 'create', len(ids), "%.2f" % spent])
+
+                started = time.time()
+                if method_name == 'per item':
+                    view = ResourcesViewSet.as_view({'patch': 'partial_update'})
+                    for item in update_items(ids):
+                        response = view(request('patch', '/v1/resources/%s/' % item['id'], item), pk=item['id'])
+                        assert response.status_code == 200, "Request failed: %s" % response.data
+                else:
+                    view = ResourcesViewSet.as_view({'post': 'bulk'})
+                    response = view(request('post', '/v1/resources/bulk/', update_items(ids)))
+                    assert response.status_code == 200, "Request failed: %s" % response.data
+                spent = time.time() - started
+                table.add_row([method_name, 'update', len(ids), "%.2f" % spent])
+
+                assert Resource.objects.filter(status=Resource.STATUS_INUSE, opt_1='updated_1').count() == 1
+
+                transaction.set_rollback(True)
+
+        logger.info(table.get_string())
+
+    def _handle_export(self, *args, **options):
+        """
+        All the resources are exported to the null output, max RSS of the process is measured
+        after the generation and after each export.
+        """
+        from resources.export import ResourceExporter
+
+        table = PrettyTable(['format', 'resources', 'output, MB', 'time, s', 'max RSS, MB'])
+
+        with transaction.atomic():
+            self._populate(options['resources'], options['options'])
+            logger.info("Max RSS after the generation: %.1f MB" % self._max_rss_mb())
+
+            for export_format in ResourceExporter.FORMATS:
+                exported = 0
+                size = 0
+
+                started = time.time()
+                for line in ResourceExporter(ResourceExporter.filter()).export(export_format):
+                    exported += 1
+                    size += len(line)
+                spent = time.time() - started
+
+                if export_format == ResourceExporter.FORMAT_CSV:
+                    exported -= 1  # header
+
+                table.add_row([export_format, exported, "%.1f" % (size / 1048576.0), "%.1f" % spent,
+                               "%.1f" % self._max_rss_mb()])
+
+            transaction.set_rollback(True)
+
+        logger.info(table.get_string())
+
+    @staticmethod
+    def _max_rss_mb():
+        # ru_maxrss is in KB on Linux
+        return resource_usage.getrusage(resource_usage.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    def _handle_changes(self, *args, **options):
+        """
+        The journal is filled with the update events of the generated resources, the last events are read
+        by the change feed, the same changes are found by the full scan of the resources and options.
+        """
+        # events depend on resources, so they are imported on demand
+        from django.utils import timezone
+        from events.feed import ChangeFeed
+        from events.models import HistoryEvent
+
+        resources_count = options['resources']
+
+        with transaction.atomic():
+            self._populate(resources_count, 10)
+            last_id = Resource.objects.filter(name__startswith='bench-').aggregate(Max('id'))['id__max']
+            first_id = last_id - resources_count + 1
+
+            started = time.time()
+            # events are journaled before the settle time of the feed, so they are read at once
+            created_at = timezone.now() - timedelta(days=1)
+            for batch_start in range(0, options['events'], self.batch_size):
+                HistoryEvent.objects.bulk_create([
+                    HistoryEvent(resource_id=first_id + idx % resources_count, type=HistoryEvent.UPDATE,
+                                 field_name='opt_1', field_old_value='value_1', field_new_value='value_%s' % idx,
+                                 created_at=created_at)
+                    for idx in range(batch_start, min(batch_start + self.batch_size, options['events']))])
+            logger.info("Generated %s history events in %.1f s" % (options['events'], time.time() - started))
+
+            since = HistoryEvent.objects.aggregate(Max('id'))['id__max'] - options['changed']
+
+            table = PrettyTable(['method', 'rows', 'time, ms'])
+            table.align['method'] = 'l'
+
+            def full_scan():
+                return list(Resource.active.values_list_with_options('id', 'name', 'status', 'opt_1'))
+
+            def feed_page():
+                return ChangeFeed().read(since=since, limit=options['changed']).changes
+
+            for method_name, read in (('full scan of resources and options', full_scan),
+                                      ('change feed page', feed_page)):
+                best_time = None
+                for idx in range(options['repeat']):
+                    started = time.time()
+                    rows = read()
+                    spent = time.time() - started
+
+                    best_time = spent if best_time is None else min(best_time, spent)
+
+                table.add_row([method_name, len(rows), "%.1f" % (best_time * 1000)])
+
+            logger.info(table.get_string())
+
+            transaction.set_rollback(True)
+
+    def _handle_msgpack(self, *args, **options):
+        """
+        The generated resources are serialized with the list of the option objects and with the options map,
+        rendered with JSONRenderer and MessagePackRenderer, then parsed back as the clients do.
+        """
+        # renderers depend on rest_framework, so they are imported on demand
+        import json
+        import msgpack
+        from rest_framework.renderers import JSONRenderer
+        from resources.renderers import MessagePackRenderer
+        from resources.serializers import ResourceSerializer
+
+        repeat = options['repeat']
+
+        def best_of(func):
+            best_time = None
+            result = None
+            for idx in range(repeat):
+                started = time.time()
+                result = func()
+                spent = time.time() - started
+
+                best_time = spent if best_time is None else min(best_time, spent)
+
+            return result, best_time
+
+        with transaction.atomic():
+            self._populate(options['resources'], options['options'])
+            resources = list(Resource.objects.filter(name__startswith='bench-').prefetch_options())
+
+            table = PrettyTable(['format', 'options', 'serialize, ms', 'render, ms', 'parse, ms', 'payload, KB'])
+            table.align['format'] = 'l'
+
+            variants = [
+                ('JSON', JSONRenderer(), json.loads, False),
+                ('MessagePack', MessagePackRenderer(), lambda content: msgpack.unpackb(content, encoding='utf-8'),
+                 False),
+                ('MessagePack', MessagePackRenderer(), lambda content: msgpack.unpackb(content, encoding='utf-8'),
+                 True),
+            ]
+            for format_name, renderer, parse, flat_options in variants:
+                data, serialize_time = best_of(
+                    lambda: ResourceSerializer(resources, many=True, context={'flat_options': flat_options}).data)
+                content, render_time = best_of(lambda: renderer.render(data))
+                parsed, parse_time = best_of(lambda: parse(content))
+
+                assert len(parsed) == len(resources), "Parsed %s of %s resources" % (len(parsed), len(resources))
+
+                table.add_row([format_name, 'map' if flat_options else 'list', "%.1f" % (serialize_time * 1000),
+                               "%.1f" % (render_time * 1000), "%.1f" % (parse_time * 1000),
+                               "%.1f" % (len(content) / 1024.0)])
+
+            logger.info(table.get_string())
+
+            transaction.set_rollback(True)
+
+    def _handle_create(self, *args, **options):
+        # ipman depends on resources, so it is imported on demand
+        from ipman.models import IPAddress, IPNetworkPool
+
+        count = options['count']
+
+        table = PrettyTable(['method', 'resources', 'queries', 'time, s'])
+
+        for method_name in ('create', 'bulk_create_with_options'):
+            with transaction.atomic():
+                pool = IPNetworkPool.objects.create(network='10.0.0.0/8')
+                rows = [dict(address='10.%s.%s.%s' % (idx >> 16 & 255, idx >> 8 & 255, idx & 255), parent=pool)
+                        for idx in range(1, count + 1)]
+
+                reset_queries()
+                started = time.time()
+
+                with CaptureQueriesContext(connection) as queries:
+                    if method_name == 'create':
+                        for row in rows:
+                            IPAddress.objects.create(**row)
+                    else:
+                        IPAddress.objects.bulk_create_with_options(IPAddress, rows)
+
+                table.add_row([method_name, count, len(queries), "%.2f" % (time.time() - started)])
+
+                transaction.set_rollback(True)
+
+        logger.info(table.get_string())
+
+    def _handle_storage(self, *args, **options):
+        with transaction.atomic():
+            self._populate(options['resources'], 0)
+
+            # options of the typical IPAddress resource
+            resource_ids = Resource.objects.filter(name__startswith='bench-').values_list('id', flat=True)
+            for batch_start in range(0, len(resource_ids), self.batch_size):
+                ResourceOption.objects.bulk_create([
+                    ResourceOption(resource_id=resource_id, name=name, value=value, format=value_format)
+                    for resource_id in resource_ids[batch_start:batch_start + self.batch_size]
+                    for name, value, value_format in (
+                        ('address', '10.%s.%s.%s' % (resource_id >> 16 & 255, resource_id >> 8 & 255, resource_id & 255),
+                         ResourceOption.FORMAT_STRING),
+                        ('version', 4, ResourceOption.FORMAT_INT),
+                        ('beauty', resource_id % 10, ResourceOption.FORMAT_INT),
+                        ('ipman_pool_id', resource_id % 50, ResourceOption.FORMAT_INT),
+                    )])
+
+            table = PrettyTable(['table', 'index', 'size, KB'])
+            table.align['index'] = 'l'
+            table.align['size, KB'] = 'r'
+
+            sizes = self._relation_sizes()
+            for table_name, index_name, size in sizes:
+                table.add_row([table_name, index_name, size / 1024])
+            table.add_row(['total', '', sum([size for table_name, index_name, size in sizes]) / 1024])
+
+            logger.info(table.get_string())
+
+            transaction.set_rollback(True)
+
+    def _handle_hierarchy(self, *args, **options):
+        """
+        Moves are measured for the MPTT hierarchy first, as the moves in the 'cte' hierarchy leave lft/rght
+        of the moved nodes invalid.
+        """
+        rnd = random.Random(1)
+
+        with transaction.atomic():
+            datacenter_ids, rack_ids, server_ids = self._populate_inventory(options['nodes'])
+
+            moves = [(server_id, rnd.choice(rack_ids))
+                     for server_id in rnd.sample(server_ids, min(options['moves'], len(server_ids)))]
+            read_racks = rnd.sample(rack_ids, min(options['reads'], len(rack_ids)))
+            read_datacenters = datacenter_ids[:options['reads']]
+
+            table = PrettyTable(['operation', 'count', 'mptt, ms/op', 'cte, ms/op'])
+            table.align['operation'] = 'l'
+
+            results = {}
+            for backend_name in ('mptt', 'cte'):
+                with override_settings(RESOURCES_HIERARCHY=backend_name):
+                    results[backend_name] = [
+                        self._measure_moves(moves[backend_name == 'cte'::2]),
+                        self._measure_reads(read_racks, self._subtree_ids),
+                        self._measure_reads(read_datacenters, self._subtree_ids),
+                        self._measure_reads(read_datacenters, TreeIterator),
+                    ]
+
+            operations = ['move server', 'filter_childs(rack)', 'filter_childs(datacenter)',
+                          'TreeIterator(datacenter)']
+            counts = [len(moves) / 2, len(read_racks), len(read_datacenters), len(read_datacenters)]
+            for idx, operation in enumerate(operations):
+                table.add_row([operation, counts[idx]] + ["%.1f" % (results[backend_name][idx] * 1000)
+                                                          for backend_name in ('mptt', 'cte')])
+
+            logger.info(table.get_string())
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def _subtree_ids(resource):
+        return resource.filter_childs(Resource).values_list('id', flat=True)
+
+    @staticmethod
+    def _measure_moves(moves):
+        spent = 0
+        for server_id, rack_id in moves:
+            server = Resource.objects.get(pk=server_id)
+            server.parent = Resource.objects.get(pk=rack_id)
+
+            started = time.time()
+            server.save()
+            spent += time.time() - started
+
+        return spent / max(len(moves), 1)
+
+    @staticmethod
+    def _measure_reads(resource_ids, read_subtree):
+        spent = 0
+        for resource_id in resource_ids:
+            resource = Resource.objects.get(pk=resource_id)
+
+            started = time.time()
+            len(list(read_subtree(resource)))
+            spent += time.time() - started
+
+        return spent / max(len(resource_ids), 1)
+
+    def _populate_inventory(self, nodes_count, racks_per_datacenter=50, servers_per_rack=40, ports_per_server=24):
+        """
+        Bulk insert the inventory of about nodes_count resources: datacenters, racks, servers and server ports.
+        Each datacenter is a separate tree.
+        :return: tuple of lists (datacenter ids, rack ids, server ids)
+        """
+        datacenter_size = 1 + racks_per_datacenter * (1 + servers_per_rack * (1 + ports_per_server))
+        datacenters_count = max(nodes_count / datacenter_size, 1)
+
+        logger.info("Generating %s resources in %s datacenters..." % (datacenters_count * datacenter_size,
+                                                                      datacenters_count))
+
+        ids = dict(datacenter=[], rack=[], server=[], port=[])
+
+        started = time.time()
+        batch = []
+        for kind, resource in self._inventory_nodes(datacenters_count, racks_per_datacenter, servers_per_rack,
+                                                    ports_per_server):
+            ids[kind].append(resource.id)
+            batch.append(resource)
+
+            if len(batch) >= self.batch_size:
+                Resource.objects.bulk_create(batch)
+                batch = []
+
+        Resource.objects.bulk_create(batch)
+
+        logger.info("    done in %.1f s" % (time.time() - started))
+
+        return ids['datacenter'], ids['rack'], ids['server']
+
+    @staticmethod
+    def _inventory_nodes(datacenters_count, racks_per_datacenter, servers_per_rack, ports_per_server):
+        """
+        Generate resources of the inventory in depth-first order with the MPTT fields.
+        :return: iterator of tuples (kind, resource)
+        """
+        content_type = ContentType.objects.get_for_model(Resource)
+        next_id = (Resource.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+        next_tree_id = (Resource.objects.aggregate(Max('tree_id'))['tree_id__max'] or 0) + 1
+
+        kinds = ['datacenter', 'rack', 'server', 'port']
+        children_counts = [racks_per_datacenter, servers_per_rack, ports_per_server, 0]
+
+        for tree_id in range(next_tree_id, next_tree_id + datacenters_count):
+            # (level, parent id, resource), lft and rght are set on enter and exit
+            stack = [(0, None, None)]
+            position = 1
+            while stack:
+                level, parent_id, resource = stack.pop()
+
+                if resource:
+                    resource.rght = position
+                    position += 1
+                    yield kinds[level], resource
+                    continue
+
+                resource = Resource(id=next_id, name='bench-%s-%s' % (kinds[level], next_id), parent_id=parent_id,
+                                    content_type=content_type, tree_id=tree_id, lft=position, level=level)
+                next_id += 1
+                position += 1
+
+                stack.append((level, parent_id, resource))
+                stack.extend([(level + 1, resource.id, None)] * children_counts[level])
+
+    @staticmethod
+    def _relation_sizes():
+        """
+        Size of the option tables and their indexes in bytes (SQLite and PostgreSQL).
+        :return: list of tuples (table, index, size)
+        """
+        tables = [model._meta.db_table for model in apps.get_app_config('resources').get_models()
+                  if model._meta.db_table in ('resource_options', 'option_keys')]
+
+        if connection.vendor == 'sqlite':
+            sizes_sql = """
+                SELECT m.tbl_name, CASE WHEN m.type = 'table' THEN '' ELSE m.name END, SUM(s.pgsize)
+                FROM sqlite_master m INNER JOIN dbstat s ON s.name = m.name
+                WHERE m.tbl_name = %s GROUP BY m.name ORDER BY m.type DESC, m.name"""
+        elif connection.vendor == 'postgresql':
+            sizes_sql = """
+                SELECT %s, '', pg_relation_size(%s::regclass)
+                UNION ALL
+                SELECT tablename, indexname, pg_relation_size(indexname::regclass)
+                FROM pg_indexes WHERE tablename = %s"""
+        else:
+            raise CommandError("Database %s is not supported." % connection.vendor)
+
+        sizes = []
+        with connection.cursor() as cursor:
+            for table_name in sorted(tables):
+                cursor.execute(sizes_sql, [table_name] * sizes_sql.count('%s'))
+                sizes.extend(cursor.fetchall())
+
+        return sizes
+
+    @staticmethod
+    def _legacy_filter(lookups):
+        """
+        Search by options as it was implemented before: one join to resource_options per option and DISTINCT.
+        """
+        query_set = QuerySet(Resource)
+        for field_name_with_lookup, field_value in lookups.items():
+            field_name, lookup_sep, lookup = field_name_with_lookup.partition('__')
+
+            if field_name == 'status':
+                query_set = query_set.filter(**{field_name_with_lookup: field_value})
+            else:
+                query_set = query_set.filter(**{
+                    'resourceoption__key__name__exact': field_name,
+                    'resourceoption__value%s%s' % (lookup_sep, lookup): field_value})
+
+        return query_set.distinct()
+
+    @staticmethod
+    def _measure(query_set, repeat):
+        best_time = None
+        result = []
+
+        for idx in range(repeat):
+            started = time.time()
+            result = [row[0] for row in query_set.values_list(*[field.attname for field in Resource._meta.fields])]
+            spent = time.time() - started
+
+            best_time = spent if best_time is None else min(best_time, spent)
+
+        return result, best_time
+
+    def _populate(self, resources_count, options_count):
+        """
+        Bulk insert resources_count root resources with options_count options each.
+        Option opt_N have value_0...value_99 values, so each value matches 1% of the resources.
+        """
+        content_type = ContentType.objects.get_for_model(Resource)
+        last_id = Resource.objects.aggregate(Max('id'))['id__max'] or 0
+        last_tree_id = Resource.objects.aggregate(Max('tree_id'))['tree_id__max'] or 0
+
+        logger.info("Generating %s resources with %s options each..." % (resources_count, options_count))
+
+        started = time.time()
+        for batch_start in range(1, resources_count + 1, self.batch_size):
+            batch_ids = range(batch_start, min(batch_start + self.batch_size, resources_count + 1))
+
+            Resource.objects.bulk_create([
+                Resource(id=last_id + idx, name='bench-%s' % idx, content_type=content_type,
+                         status=Resource.STATUSES_NOT_DELETED[idx % len(Resource.STATUSES_NOT_DELETED)],
+                         tree_id=last_tree_id + idx, lft=1, rght=2, level=0)
+                for idx in batch_ids])
+
+            ResourceOption.objects.bulk_create([
+                ResourceOption(resource_id=last_id + idx, name='opt_%s' % opt_idx,
+                               value='value_%s' % ((idx + opt_idx) % 100), format=ResourceOption.FORMAT_STRING)
+                for idx in batch_ids
+                for opt_idx in range(1, options_count + 1)])
+
+        logger.info("    done in %.1f s" % (time.time() - started))
+
+    def _register_handler(self, command_name, handler):
+        assert command_name, "command_name must be defined."
+        assert handler, "handler must be defined."
+
+        self.registered_handlers[command_name] = handler
@@ -4,12 +4,15 @@ import argparse
 from argparse import ArgumentParser
 
 from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
 from django.core.management.base import BaseCommand
 
 from cmdb.settings import logger
+from resources.export import ResourceExporter
 from resources.iterators import PathIterator, TreeIterator
 from resources.lib.console import ConsoleResourceWriter
 from resources.models import Resource, ResourceOption, ModelFieldChecker
+from resources.optionstorage import OPTION_STORAGES
 
 
 class Command(BaseCommand):
@@ -81,6 +84,35 @@ class Command(BaseCommand):
         res_delete_cmd.add_argument('--recursive', action='store_true', help="Delete resource recursively.")
         self._register_handler('delete', self._handle_command_delete)
 
+        # OPTIONS
+        res_options_cmd = subparsers.add_parser('options', help="Manage the storage of the resource options.")
+        res_options_cmd.add_argument('--migrate', choices=sorted(OPTION_STORAGES.keys()),
+                                     help="Move options of all the resources to the storage layout, "
+                                          "then set RESOURCES_OPTIONS_STORAGE.")
+        res_options_cmd.add_argument('--index', default='', help="Comma separated option names: create the "
+                                                                 "expression indexes for the JSON storage.")
+        self._register_handler('options', self._handle_command_options)
+
+        # ARCHIVE
+        res_archive_cmd = subparsers.add_parser('archive', help="Move deleted resources to the archive tables.")
+        res_archive_cmd.add_argument('--days', type=int, default=None,
+                                     help="Archive resources deleted earlier, than the number of days ago "
+                                          "(RESOURCES_ARCHIVE_DAYS by default).")
+        self._register_handler('archive', self._handle_command_archive)
+
+        # EXPORT
+        res_export_cmd = subparsers.add_parser('export', help="Export resources with their options.")
+        res_export_cmd.add_argument('-f', '--format', default=ResourceExporter.FORMAT_NDJSON,
+                                    choices=ResourceExporter.FORMATS, help="Output format.")
+        res_export_cmd.add_argument('-t', '--type', default='', help="Comma separated resource types.")
+        res_export_cmd.add_argument('-s', '--status', default='',
+                                    help="Comma separated statuses of the resources, live resources by default.")
+        res_export_cmd.add_argument('--subtree', type=int, help="Export the subtree of the resource ID.")
+        res_export_cmd.add_argument('--options', default=None,
+                                    help="Comma separated option names to export, all options by default.")
+        res_export_cmd.add_argument('-o', '--output', help="Output file, stdout by default.")
+        self._register_handler('export', self._handle_command_export)
+
     def handle(self, *args, **options):
         if 'subcommand_name' in options:
             subcommand = "%s.%s" % (options['manager_name'], options['subcommand_name'])
@@ -110,6 +142,38 @@ class Command(BaseCommand):
 
         node.delete()
 
+    def _handle_command_options(self, *args, **options):
+        if options['migrate']:
+            moved = Resource.objects.migrate_options(options['migrate'])
+            logger.info("Moved options of %s resources to '%s'." % (moved, options['migrate']))
+
+        if options['index']:
+            option_names = options['index'].split(',')
+            Resource.objects.create_option_indexes(option_names)
+            logger.info("Indexed options: %s" % ', '.join(option_names))
+
+    def _handle_command_archive(self, *args, **options):
+        archived = Resource.objects.archive_deleted(retention_days=options['days'])
+        logger.info("Archived %s deleted resources." % archived)
+
+    def _handle_command_export(self, *args, **options):
+        queryset = ResourceExporter.filter(
+            types=[name for name in options['type'].split(',') if name],
+            statuses=[name for name in options['status'].split(',') if name],
+            subtree=Resource.objects.get(pk=options['subtree']) if options['subtree'] else None)
+
+        option_names = options['options'].split(',') if options['options'] is not None else None
+        lines = ResourceExporter(queryset, option_names=option_names).export(options['format'])
+
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        with open(options['output'], 'wb') as output:
+            for line in lines:
+                output.write(line)
+
     def _handle_command_add(self, *args, **options):
         parsed_data = self._parse_reminder_arguments(options['fields'])
 
@@ -152,6 +216,8 @@ class Command(BaseCommand):
             query['status__in'] = options['status'].split(',')
             resource_set = Resource.objects.filter(**query)
 
+        resource_set = resource_set.prefetch_options()
+
         # order by
         table_sort_by_field = None
         if options['order']:
@@ -173,9 +239,29 @@ class Command(BaseCommand):
         # tabular output with column align
         show_fields = options['show_fields'].split(',')
 
+        # rows of the plain fields and options are selected with a single query
+        if all(self._is_column_field(field_name) for field_name in show_fields):
+            resource_set = resource_set.values_list_with_options(*show_fields)
+
         console_writer = ConsoleResourceWriter(resource_set)
         console_writer.print_table(show_fields, sort_by=table_sort_by_field)
 
+    @staticmethod
+    def _is_column_field(field_name):
+        """
+        Check if the field is printed as is: non relation Resource field or option.
+        """
+        if field_name in ConsoleResourceWriter.special_fields:
+            return False
+
+        if ModelFieldChecker.is_option_field(field_name):
+            return True
+
+        try:
+            return not Resource._meta.get_field(field_name).is_relation
+        except FieldDoesNotExist:
+            return False
+
     def _handle_command_get(self, *args, **options):
         show_fields = options['show_fields'].split(',')
 
@@ -183,10 +269,10 @@ class Command(BaseCommand):
             resource = Resource.objects.get(pk=res_id)
 
             if options['path']:
-                console_printer = ConsoleResourceWriter(PathIterator(resource))
+                console_printer = ConsoleResourceWriter(PathIterator(resource, show_fields))
                 console_printer.print_path(show_fields)
             elif options['tree']:
-                console_printer = ConsoleResourceWriter(TreeIterator(resource))
+                console_printer = ConsoleResourceWriter(TreeIterator(resource, show_fields))
                 console_printer.print_tree(show_fields)
             else:
                 ConsoleResourceWriter.dump_item(resource)
@@ -214,7 +300,7 @@ class Command(BaseCommand):
                                         value=field_value,
                                         format=options['format'] if options['format'] else ResourceOption.FORMAT_STRING)
                 elif resource.get_option_value(field_name, default=None):
-                    resource.get_option(field_name).delete()  # delete option
+                    resource.delete_option(field_name)
 
         cascade = options['cascade']
         if options['use']:
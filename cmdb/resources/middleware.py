@@ -0,0 +1,21 @@
+from __future__ import unicode_literals
+
+from resources.models import resource_identity_map
+
+
+class ResourceIdentityMapMiddleware(object):
+    """
+    Load each resource once per request: the request is processed inside resource_identity_map().
+    """
+
+    def process_request(self, request):
+        request.resource_identity_map = resource_identity_map()
+        request.resource_identity_map.__enter__()
+
+    def process_response(self, request, response):
+        identity_map = getattr(request, 'resource_identity_map', None)
+        if identity_map:
+            identity_map.__exit__(None, None, None)
+            request.resource_identity_map = None
+
+        return response
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0016_resourceoption_journaling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resourceoption',
+            name='value_bool',
+            field=models.NullBooleanField(verbose_name='Boolean value'),
+        ),
+        migrations.AddField(
+            model_name='resourceoption',
+            name='value_float',
+            field=models.FloatField(null=True, verbose_name='Numeric value'),
+        ),
+        migrations.AddField(
+            model_name='resourceoption',
+            name='value_int',
+            field=models.BigIntegerField(null=True, verbose_name='Integer value'),
+        ),
+        migrations.AddField(
+            model_name='resourceoption',
+            name='value_prefix',
+            field=models.CharField(default='', max_length=64, verbose_name='Value prefix'),
+        ),
+        migrations.AlterIndexTogether(
+            name='resourceoption',
+            index_together=set([('name', 'value_prefix'), ('name', 'value_int'), ('name', 'value_bool'), ('name', 'value_float')]),
+        ),
+    ]
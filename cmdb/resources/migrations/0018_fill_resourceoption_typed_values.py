@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Case, Q, When, Value
+from django.db.models.functions import Substr
+
+# the conversion is a copy of ResourceOption.update_typed_values() at the time of the migration
+VALUE_PREFIX_LENGTH = 64
+VALUE_INT_RANGE = (-2 ** 63, 2 ** 63 - 1)
+BOOL_TRUE_VALUES = ['yes', 'true', '1']
+
+BATCH_SIZE = 500
+
+
+def _number_columns(option_format, value):
+    """
+    Returns value_int and value_float of the int and float options, None if the value is not a number.
+    """
+    try:
+        number = int(value) if option_format == 'int' else float(value)
+    except (TypeError, ValueError, OverflowError):
+        return None, None
+
+    value_int = number if option_format == 'int' and VALUE_INT_RANGE[0] <= number <= VALUE_INT_RANGE[1] else None
+
+    return value_int, float(number)
+
+
+def fill_typed_values(apps, schema_editor):
+    """
+    Fill the typed columns of the existing options: the value prefix and the booleans are filled with one
+    UPDATE each, the numbers are converted in batches and written with one UPDATE ... CASE per batch.
+    """
+    ResourceOption = apps.get_model('resources', 'ResourceOption')
+
+    ResourceOption.objects.update(value_prefix=Substr('value', 1, VALUE_PREFIX_LENGTH),
+                                  value_int=None, value_float=None, value_bool=None)
+
+    # prefix of the booleans is the typed value
+    bool_options = ResourceOption.objects.filter(format='bool')
+    bool_options.update(value_bool=False, value_prefix='False')
+    true_values = Q()
+    for true_value in BOOL_TRUE_VALUES:
+        true_values |= Q(value__iexact=true_value)
+    bool_options.filter(true_values).update(value_bool=True, value_prefix='True')
+
+    number_options = ResourceOption.objects.filter(format__in=['int', 'float']).order_by('id')
+    batch = list(number_options.values_list('id', 'format', 'value')[:BATCH_SIZE])
+    while batch:
+        columns = dict((option_id, _number_columns(option_format, value)) for option_id, option_format, value in batch)
+        columns = dict((option_id, values) for option_id, values in columns.items() if values != (None, None))
+
+        if columns:
+            ResourceOption.objects.filter(id__in=columns.keys()).update(
+                value_int=Case(*[When(id=option_id, then=Value(value_int)) for option_id, (value_int, value_float)
+                                 in columns.items()], output_field=ResourceOption._meta.get_field('value_int')),
+                value_float=Case(*[When(id=option_id, then=Value(value_float)) for option_id, (value_int, value_float)
+                                   in columns.items()], output_field=ResourceOption._meta.get_field('value_float')))
+
+        if len(batch) < BATCH_SIZE:
+            break
+
+        batch = list(number_options.filter(id__gt=batch[-1][0]).values_list('id', 'format', 'value')[:BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('resources', '0017_resourceoption_typed_values'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_typed_values, migrations.RunPython.noop),
+    ]
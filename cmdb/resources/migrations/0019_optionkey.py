@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0018_fill_resourceoption_typed_values'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OptionKey',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(unique=True, max_length=155)),
+            ],
+            options={
+                'db_table': 'option_keys',
+            },
+        ),
+        migrations.AddField(
+            model_name='resourceoption',
+            name='key',
+            field=models.ForeignKey(to='resources.OptionKey', null=True, db_index=False),
+        ),
+    ]
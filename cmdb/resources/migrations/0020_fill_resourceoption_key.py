@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def fill_option_keys(apps, schema_editor):
+    """
+    Move the option names to the option_keys dictionary.
+    """
+    OptionKey = apps.get_model('resources', 'OptionKey')
+    ResourceOption = apps.get_model('resources', 'ResourceOption')
+
+    for name in ResourceOption.objects.values_list('name', flat=True).distinct():
+        option_key = OptionKey.objects.create(name=name)
+        ResourceOption.objects.filter(name=name).update(key=option_key)
+
+
+def fill_option_names(apps, schema_editor):
+    OptionKey = apps.get_model('resources', 'OptionKey')
+    ResourceOption = apps.get_model('resources', 'ResourceOption')
+
+    for option_key in OptionKey.objects.all():
+        ResourceOption.objects.filter(key=option_key).update(name=option_key.name)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('resources', '0019_optionkey'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_option_keys, fill_option_names),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0020_fill_resourceoption_key'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='resourceoption',
+            index_together=set([('key', 'value_int'), ('key', 'value_float'), ('key', 'value_bool'), ('key', 'value_prefix')]),
+        ),
+        migrations.RemoveField(
+            model_name='resourceoption',
+            name='name',
+        ),
+        migrations.AlterField(
+            model_name='resourceoption',
+            name='key',
+            field=models.ForeignKey(to='resources.OptionKey', db_index=False),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0021_remove_resourceoption_name'),
+    ]
+
+    # data migrations of the other apps use the current Resource model
+    run_before = [
+        ('software', '0002_auto_20150831_2223'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='options_data',
+            field=models.TextField(default='{}', verbose_name='Options document', editable=False),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('resources', '0022_resource_options_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedResource',
+            fields=[
+                ('id', models.IntegerField(serialize=False, primary_key=True)),
+                ('parent_id', models.IntegerField(null=True, db_index=True)),
+                ('name', models.CharField(max_length=155, db_index=True)),
+                ('type', models.CharField(max_length=155, db_index=True)),
+                ('status', models.CharField(max_length=25)),
+                ('created_at', models.DateTimeField(verbose_name='Date created')),
+                ('updated_at', models.DateTimeField(verbose_name='Date updated')),
+                ('last_seen', models.DateTimeField(verbose_name='Date last seen')),
+                ('options_data', models.TextField(default='{}', verbose_name='Options document', editable=False)),
+                ('archived_at', models.DateTimeField(verbose_name='Date archived', db_index=True)),
+                ('content_type', models.ForeignKey(editable=False, to='contenttypes.ContentType', null=True)),
+            ],
+            options={
+                'db_table': 'resources_archive',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedResourceComment',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created_at', models.DateTimeField(verbose_name='Date created')),
+                ('updated_at', models.DateTimeField(verbose_name='Date updated')),
+                ('message', models.TextField(verbose_name='Comment text')),
+                ('author', models.ForeignKey(to=settings.AUTH_USER_MODEL)),
+                ('resource', models.ForeignKey(related_name='comments', to='resources.ArchivedResource')),
+            ],
+            options={
+                'db_table': 'resource_comments_archive',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedResourceOption',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('value', models.TextField(verbose_name='Option value')),
+                ('format', models.CharField(max_length=25, choices=[('dict', 'Dictionary string'), ('int', 'Integer value'), ('bool', 'Boolean value'), ('float', 'Float value'), ('string', 'String value')])),
+                ('journaling', models.BooleanField(default=True)),
+                ('key', models.ForeignKey(to='resources.OptionKey', db_index=False)),
+                ('resource', models.ForeignKey(related_name='options', to='resources.ArchivedResource')),
+            ],
+            options={
+                'db_table': 'resource_options_archive',
+            },
+        ),
+    ]
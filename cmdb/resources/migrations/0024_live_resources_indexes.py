@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# partial indexes are supported by SQLite and PostgreSQL, the condition is the same as of the
+# Resource.active queries (see LiveResource lookup)
+PARTIAL_INDEX_VENDORS = ('sqlite', 'postgresql')
+
+LIVE_CONDITION = "NOT (status = 'deleted')"
+
+LIVE_INDEXES = {
+    'resources_live_type': ['type'],
+    'resources_live_parent_id': ['parent_id'],
+    'resources_live_name': ['name'],
+}
+
+
+def create_live_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor not in PARTIAL_INDEX_VENDORS:
+        return
+
+    quote_name = schema_editor.quote_name
+    for index_name, columns in sorted(LIVE_INDEXES.items()):
+        schema_editor.execute('CREATE INDEX %s ON %s (%s) WHERE %s' % (
+            quote_name(index_name), quote_name('resources'), ', '.join(quote_name(column) for column in columns),
+            LIVE_CONDITION))
+
+
+def drop_live_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor not in PARTIAL_INDEX_VENDORS:
+        return
+
+    for index_name in sorted(LIVE_INDEXES):
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % schema_editor.quote_name(index_name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0023_archivedresource'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_live_indexes, drop_live_indexes),
+    ]
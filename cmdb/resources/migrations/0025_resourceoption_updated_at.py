@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0024_live_resources_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='resourceoption',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Date updated', db_index=True),
+        ),
+    ]
@@ -1,20 +1,37 @@
 from __future__ import unicode_literals
 
+import contextlib
+import copy
+import datetime
 import json
+import re
+import threading
+from collections import OrderedDict
 
 from django.apps import apps
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
-from django.core import exceptions as djexceptions
-from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.exceptions import FieldError, ValidationError
+from django.db import models, transaction, connection
+from django.db.models import Q, Case, When, Value, Max, Prefetch
+from django.db.models.expressions import RawSQL
+from django.db.models.fields.related import ReverseSingleRelatedObjectDescriptor
+from django.db.models.signals import post_save, post_delete
+from django.db.models.lookups import Lookup
 from django.db.models.query import QuerySet
+from django.db.models.sql.where import ExtraWhere, AND
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from mptt.managers import TreeManager
 from mptt.models import MPTTModel, TreeForeignKey
 
 from cmdb.settings import logger
+from resources.hierarchy import get_hierarchy
+from resources.optionstorage import get_option_storage, JSONOptionStorage, OPTION_STORAGES
+from resources.querycache import get_query_cache, query_cache_key, invalidate_query_cache
+from resources.signals import resources_bulk_created, resources_bulk_updated
 
 
 class ModelFieldChecker:
@@ -52,6 +69,15 @@ class ModelFieldChecker:
         except models.FieldDoesNotExist:
             return False
 
+    @staticmethod
+    def is_option_field(name):
+        """
+        Check if the field name is stored as the resource option: it is not the Resource field
+        and not the property of the resource models.
+        """
+        return not ModelFieldChecker.is_model_field(Resource, name) and not any(
+            hasattr(model, name) for model in apps.get_models() if issubclass(model, Resource))
+
     @staticmethod
     def get_field_value(resource, field_name, default=''):
         if ModelFieldChecker.is_field_or_property(resource, field_name):
@@ -60,6 +86,161 @@ class ModelFieldChecker:
             return resource.get_option_value(field_name, default=default)
 
 
+class OptionExists(Lookup):
+    """
+    Correlated EXISTS subquery over the resource options. Value is the ResourceOption queryset:
+        Resource.objects.filter(pk__option_exists=ResourceOption.objects.filter(name='mac', value='...'))
+    """
+    lookup_name = 'option_exists'
+
+    def get_prep_lookup(self):
+        return self.rhs
+
+    def as_sql(self, compiler, connection):
+        lhs_sql, lhs_params = self.process_lhs(compiler, connection)
+
+        option_query = self.rhs.query.clone()
+        option_query.bump_prefix(compiler.query)
+
+        option_compiler = option_query.get_compiler(connection=connection)
+        option_resource_column = '%s.%s' % (
+            option_compiler.quote_name_unless_alias(option_query.get_initial_alias()),
+            option_compiler.quote_name_unless_alias(ResourceOption._meta.get_field('resource').column))
+        option_query.where.add(ExtraWhere(['%s = %s' % (option_resource_column, lhs_sql)], lhs_params), AND)
+
+        option_sql, option_params = option_compiler.as_sql()
+
+        return 'EXISTS (%s)' % option_sql, option_params
+
+
+models.AutoField.register_lookup(OptionExists)
+
+
+class OptionDocumentValue(Lookup):
+    """
+    Lookup by the option value in the JSON options document of the resource (see JSONOptionStorage). Value is
+    the tuple (option name, lookup, lookup value):
+        Resource.objects.filter(pk__option_document=('mac', 'exact', '...'))
+
+    Values are compared by type, as the typed columns of the option rows: numbers with numbers, booleans with
+    booleans. Strings of exact and in lookups are also compared with the typed values, as the option rows are
+    found by the value string. Resources without the option are not matched, so exclude() finds them.
+    """
+    lookup_name = 'option_document'
+
+    INT_RE = re.compile(r'^-?[0-9]+$')
+
+    # lookups of the typed values, the other lookups (isnull, dates) raise FieldError
+    SUPPORTED_LOOKUPS = ('exact', 'iexact', 'in', 'gt', 'gte', 'lt', 'lte', 'range', 'contains', 'icontains',
+                         'startswith', 'istartswith', 'endswith', 'iendswith', 'regex', 'iregex')
+
+    def get_prep_lookup(self):
+        return self.rhs
+
+    @classmethod
+    def check_lookup(cls, name, lookup):
+        if lookup not in cls.SUPPORTED_LOOKUPS:
+            raise FieldError("Lookup '%s' of the option '%s' is not supported by the JSON option storage, use one "
+                             "of: %s." % (lookup, name, ', '.join(cls.SUPPORTED_LOOKUPS)))
+
+    def as_sql(self, compiler, connection):
+        name, lookup, value = self.rhs
+        self.check_lookup(name, lookup)
+
+        storage = get_option_storage()
+        column = '%s.%s' % (compiler.quote_name_unless_alias(self.lhs.alias),
+                            connection.ops.quote_name(Resource._meta.get_field('options_data').column))
+
+        conditions = []
+        params = []
+        for value_type, value_field, lookup_value in self._value_variants(lookup, value):
+            # expression is formatted with the parameters
+            value_expression = RawSQL(storage.value_sql(connection.vendor, column, name, value_type).replace('%', '%%'),
+                                      [], output_field=value_field)
+            lookup_class = value_field.get_lookup(lookup)
+
+            condition_sql, condition_params = compiler.compile(lookup_class(value_expression, lookup_value))
+            conditions.append(condition_sql)
+            params.extend(condition_params)
+
+        return '(%s IS NOT NULL AND (%s))' % (storage.value_sql(connection.vendor, column, name).replace('%', '%%'),
+                                              ' OR '.join(conditions)), params
+
+    @classmethod
+    def _value_variants(cls, lookup, value):
+        """
+        Returns list of tuples (value type, output field, lookup value) of the compared option values.
+        """
+        is_list = lookup in ('in', 'range') and isinstance(value, (list, tuple, set))
+        values = list(value) if is_list else [value]
+        value_types = set(type(item) for item in values)
+
+        if values and value_types == {bool}:
+            return [('boolean', models.NullBooleanField(), value)]
+
+        if values and value_types <= {int, long}:
+            return [('number', models.BigIntegerField(), value)]
+
+        if values and value_types <= {int, long, float}:
+            return [('number', models.FloatField(), value)]
+
+        variants = [(None, models.TextField(), value)]
+
+        if lookup in ('exact', 'in') and values and all(isinstance(item, basestring) for item in values):
+            booleans = [item == 'True' for item in values if item in ('True', 'False')]
+            numbers = [cls._parse_number(item) for item in values]
+            numbers = [item for item in numbers if item is not None]
+
+            if booleans:
+                variants.append(('boolean', models.NullBooleanField(), booleans if is_list else booleans[0]))
+            if numbers:
+                variants.append(('number', models.FloatField(), numbers if is_list else numbers[0]))
+
+        return variants
+
+    @classmethod
+    def _parse_number(cls, value):
+        """
+        Returns the number, that is stored as the value string of the int or float option.
+        """
+        if cls.INT_RE.match(value):
+            return int(value)
+
+        try:
+            number = float(value)
+        except ValueError:
+            return None
+
+        return number if unicode(number) == value else None
+
+
+models.AutoField.register_lookup(OptionDocumentValue)
+
+
+class LiveResource(Lookup):
+    """
+    Resource is not deleted: Resource.objects.filter(pk__live=True). The deleted status is the literal in
+    the condition, not the query parameter, so the partial indexes of the live resources (see migration
+    0024_live_resources_indexes) are used: SQLite matches the index condition with the literal only.
+    """
+    lookup_name = 'live'
+
+    CONDITION_SQL = "NOT (%(status)s = 'deleted')"
+
+    def get_prep_lookup(self):
+        return bool(self.rhs)
+
+    def as_sql(self, compiler, connection):
+        status = '%s.%s' % (compiler.quote_name_unless_alias(self.lhs.alias),
+                            connection.ops.quote_name(Resource._meta.get_field('status').column))
+        condition = self.CONDITION_SQL % dict(status=status)
+
+        return (condition if self.rhs else 'NOT (%s)' % condition), []
+
+
+models.AutoField.register_lookup(LiveResource)
+
+
 class SubclassingQuerySet(QuerySet):
     def __getitem__(self, k):
         result = super(SubclassingQuerySet, self).__getitem__(k)
@@ -107,10 +288,196 @@ class SubclassingQuerySet(QuerySet):
 
         return new_object
 
+    def bulk_create_with_options(self, type, rows, batch_size=1000, rows_options=None):
+        """
+        Create many resources of the given type with their options. Resources and options are inserted
+        with bulk_create() in batches, MPTT fields are calculated once per batch. Proxy model properties
+        are set as in create(), their options are deferred and inserted in bulk. Parents must be saved,
+        new resources are added as the last children.
+
+        :param type: model class or 'app.Model' name
+        :param rows: list of dicts with resource fields and options, same as create() kwargs
+        :param batch_size: number of resources inserted in one transaction
+        :param rows_options: options of the rows with the explicit format and journaling: list of the lists
+                             of tuples (name, value, format, journaling), one list per row
+        :return: list of created resources
+        """
+        requested_model = apps.get_model(type) if isinstance(type, basestring) else type
+        assert issubclass(requested_model, Resource), "Resource model is expected."
+
+        rows = list(rows)
+        rows_options = list(rows_options) if rows_options is not None else [()] * len(rows)
+        assert len(rows_options) == len(rows), "Options are expected for each row."
+
+        created = []
+        for batch_start in range(0, len(rows), batch_size):
+            with transaction.atomic():
+                created.extend(self._bulk_create_batch(requested_model, rows[batch_start:batch_start + batch_size],
+                                                       rows_options[batch_start:batch_start + batch_size]))
+
+        return created
+
+    def _bulk_create_batch(self, requested_model, rows, rows_options):
+        resources = []
+        for row, row_options in zip(rows, rows_options):
+            model_fields = {}
+            option_fields = {}
+
+            for field_name, field_value in row.items():
+                if ModelFieldChecker.is_model_field(Resource, field_name):
+                    model_fields[field_name] = field_value
+                else:
+                    option_fields[field_name] = field_value
+
+            resource = requested_model(**model_fields)
+            resource._fill_type_fields()
+            resource._deferred_options = OrderedDict()
+
+            for option_field, option_value in option_fields.items():
+                if hasattr(resource, option_field):
+                    setattr(resource, option_field, option_value)
+                else:
+                    resource.set_option(option_field, option_value)
+
+            for name, value, value_format, journaling in row_options:
+                resource.set_option(name, value, format=value_format, journaling=journaling)
+
+            resource.before_bulk_create()
+            resources.append(resource)
+
+        self._fill_tree_fields(resources)
+
+        stores_rows = get_option_storage().stores_rows
+        if not stores_rows:
+            for resource in resources:
+                resource.options_data = JSONOptionStorage.dump(resource._deferred_options.values())
+
+        Resource.objects.bulk_create(resources)
+
+        # bulk_create() does not return ids, find resources by their unique tree positions
+        positions = {}
+        for resource in resources:
+            positions.setdefault(resource.tree_id, set()).add(resource.lft)
+
+        positions_query = Q()
+        for tree_id, lefts in positions.items():
+            positions_query |= Q(tree_id=tree_id, lft__gte=min(lefts), lft__lte=max(lefts))
+
+        resource_ids = dict(((tree_id, lft), resource_id) for resource_id, tree_id, lft in
+                            QuerySet(Resource).filter(positions_query).values_list('id', 'tree_id', 'lft'))
+
+        options = []
+        for resource in resources:
+            resource.id = resource_ids[(resource.tree_id, resource.lft)]
+            resource._state.adding = False
+            resource._state.db = self.db
+
+            for option in resource._deferred_options.values():
+                option.resource = resource
+                options.append(option)
+
+            resource._deferred_options = None
+            resource._reset_options_cache()
+
+        if stores_rows:
+            ResourceOption.objects.bulk_create(options)
+
+        resources_bulk_created.send(sender=Resource, resources=resources, options=options)
+
+        return resources
+
+    def _fill_tree_fields(self, resources):
+        """
+        Calculate MPTT fields of the new resources. Space for the children is created once per parent,
+        root resources get the new tree ids.
+        """
+        tree_manager = Resource._tree_manager
+
+        children_by_parent = OrderedDict()
+        roots = []
+        for resource in resources:
+            if resource.parent_id:
+                children_by_parent.setdefault(resource.parent_id, []).append(resource)
+            else:
+                roots.append(resource)
+
+        parents = dict((parent_id, [tree_id, lft, rght, level]) for parent_id, tree_id, lft, rght, level in
+                       QuerySet(Resource).filter(id__in=children_by_parent.keys()).values_list(
+                           'id', 'tree_id', 'lft', 'rght', 'level'))
+
+        placed_children = []
+        for parent_id, children in children_by_parent.items():
+            tree_id, parent_lft, parent_rght, parent_level = parents[parent_id]
+            space_size = len(children) * 2
+            target = parent_rght - 1
+
+            tree_manager._create_space(space_size, target, tree_id)
+
+            # the space shifts the saved rows, keep positions of the other parents and of the children,
+            # that are placed in the same tree, up to date
+            for parent_position in parents.values():
+                if parent_position[0] == tree_id:
+                    parent_position[1] += space_size if parent_position[1] > target else 0
+                    parent_position[2] += space_size if parent_position[2] > target else 0
+
+            for child in placed_children:
+                if child.tree_id == tree_id:
+                    child.lft += space_size if child.lft > target else 0
+                    child.rght += space_size if child.rght > target else 0
+
+            for idx, child in enumerate(children):
+                child.tree_id = tree_id
+                child.lft = parent_rght + idx * 2
+                child.rght = child.lft + 1
+                child.level = parent_level + 1
+
+                placed_children.append(child)
+
+        # cached parent instances are updated as in mptt insert_node()
+        for child in placed_children:
+            parent = getattr(child, Resource._meta.get_field('parent').get_cache_name(), None)
+            if parent and parent.id in parents:
+                parent.lft, parent.rght = parents[parent.id][1:3]
+
+        if roots:
+            next_tree_id = tree_manager._get_next_tree_id()
+            for idx, root in enumerate(roots):
+                root.tree_id = next_tree_id + idx
+                root.lft = 1
+                root.rght = 2
+                root.level = 0
+
     def __iter__(self):
         for item in super(SubclassingQuerySet, self).__iter__():
             yield item.as_leaf_class() if isinstance(item, Resource) else item
 
+    def iterator(self):
+        """
+        If RESOURCES_QUERY_CACHE is enabled, ids of the results are cached and the resources are loaded by
+        the primary keys on the next evaluation of the same query.
+        """
+        query_cache = get_query_cache()
+        cache_key = query_cache_key(self) if query_cache else None
+        if not cache_key:
+            return super(SubclassingQuerySet, self).iterator()
+
+        query_key, types = cache_key
+        ids = query_cache.get_ids(query_key, types)
+        if ids is not None:
+            return iter(self._load_by_ids(ids))
+
+        results = list(super(SubclassingQuerySet, self).iterator())
+        query_cache.set_ids(query_key, types, [resource.id for resource in results])
+
+        return iter(results)
+
+    def _load_by_ids(self, ids, batch_size=500):
+        resources = {}
+        for batch_start in range(0, len(ids), batch_size):
+            resources.update(QuerySet(self.model, using=self.db).in_bulk(ids[batch_start:batch_start + batch_size]))
+
+        return [resources[resource_id] for resource_id in ids if resource_id in resources]
+
     def filter(self, *args, **kwargs):
         """
         Search for Resources using Options
@@ -126,48 +493,541 @@ class SubclassingQuerySet(QuerySet):
         if self.model != Resource:
             search_fields['type'] = self.model.__name__
 
+        return super(SubclassingQuerySet, self).filter(*args, **search_fields)
+
+    def _filter_or_exclude(self, negate, *args, **kwargs):
+        """
+        Translate option lookups in kwargs and Q objects for filter(), exclude() and get().
+        """
+        query, conditions = self._translate_query(kwargs, driving_subquery=not negate)
+
+        args = [self._translate_q(arg) if isinstance(arg, Q) else arg for arg in args]
+        args.extend(conditions)
+
+        return super(SubclassingQuerySet, self)._filter_or_exclude(negate, *args, **query)
+
+    def _translate_q(self, q_object):
+        translated_q = Q()
+        translated_q.connector = q_object.connector
+        translated_q.negated = q_object.negated
+
+        for child in q_object.children:
+            if isinstance(child, Q):
+                translated_q.children.append(self._translate_q(child))
+            else:
+                query, conditions = self._translate_query(dict([child]))
+                translated_q.children.extend(query.items())
+                translated_q.children.extend(conditions)
+
+        return translated_q
+
+    @staticmethod
+    def _translate_query(search_fields, driving_subquery=False):
+        """
+        Split lookups to the Resource fields and options conditions. Option lookups are converted to the
+        subqueries, so resources are not multiplied by joined options and no DISTINCT is needed:
+            field__lookup = value -> EXISTS (SELECT ... FROM resource_options
+                                             WHERE resource_id = resources.id AND name = 'field' AND value ...)
+
+        If driving_subquery is True (plain AND filter), then the most selective option condition is
+        converted to the 'id IN (SELECT resource_id ...)' subquery: it is evaluated once and used to
+        find resources by primary key, the rest of the conditions are checked with EXISTS.
+
+        :param search_fields: lookups dict
+        :param driving_subquery: use IN subquery for the first option condition
+        :return: tuple (Resource fields lookups, list of Q conditions for options)
+        """
+        if not get_option_storage().stores_rows:
+            return SubclassingQuerySet._translate_document_query(search_fields)
+
         query = {}
-        related_query = []
+        option_fields_query = {}
+        options_queries = []
 
-        for field_name_with_lookup in search_fields.keys():
-            field_name = field_name_with_lookup.split('__')[0]
+        for field_name_with_lookup, field_value in search_fields.items():
+            field_name, lookup_sep, lookup = field_name_with_lookup.partition('__')
 
             if ModelFieldChecker.is_model_field(Resource, field_name):
-                query[field_name_with_lookup] = search_fields[field_name_with_lookup]
+                query[field_name_with_lookup] = field_value
+            elif ModelFieldChecker.is_model_field(ResourceOption, field_name):
+                option_fields_query[field_name_with_lookup] = field_value
             else:
-                if ModelFieldChecker.is_model_field(ResourceOption, field_name):
-                    query['resourceoption__%s' % field_name_with_lookup] = search_fields[field_name_with_lookup]
-                else:
-                    # convert field__lookup = value to:
-                    # resourceoption__name__exact = field
-                    # resourceoption__value__lookup = value
-                    field_related_value = field_name_with_lookup.replace(field_name, 'resourceoption__value')
-                    related_query.append(
-                        {'resourceoption__name__exact': field_name,
-                         field_related_value: search_fields[field_name_with_lookup]}
-                    )
-
-        # Chaining queries
-        query_set = super(SubclassingQuerySet, self).filter(*args, **query)
-        for related_query_item in related_query:
-            query_set = super(SubclassingQuerySet, query_set).filter(*args, **related_query_item)
-
-        return query_set.distinct()
+                # convert field__lookup = value to:
+                # name__exact = field
+                # value__lookup = value (or the typed column lookup)
+                option_query = ResourceOption.get_value_lookups(lookup, field_value) & Q(name__exact=field_name)
+
+                options_queries.append((lookup in ('', 'exact', 'in'), option_query))
+
+        # lookups by the option model fields are related to the same option
+        if option_fields_query:
+            options_queries.append((False, Q(**option_fields_query)))
+
+        # exact matches are the most selective
+        options_queries.sort(key=lambda is_exact_and_query: not is_exact_and_query[0])
+
+        conditions = []
+        for is_exact, option_query in options_queries:
+            option_set = ResourceOption.objects.filter(option_query)
+
+            if driving_subquery and not conditions:
+                conditions.append(Q(pk__in=option_set.values('resource_id')))
+            else:
+                conditions.append(Q(pk__option_exists=option_set.values('pk')))
+
+        return query, conditions
+
+    @staticmethod
+    def _translate_document_query(search_fields):
+        """
+        Split lookups to the Resource fields and the conditions over the JSON options documents:
+            field__lookup = value -> pk__option_document = (field, lookup, value)
+        """
+        query = {}
+        conditions = []
+
+        for field_name_with_lookup, field_value in search_fields.items():
+            field_name, lookup_sep, lookup = field_name_with_lookup.partition('__')
+
+            if ModelFieldChecker.is_model_field(Resource, field_name):
+                query[field_name_with_lookup] = field_value
+            elif ModelFieldChecker.is_model_field(ResourceOption, field_name):
+                raise FieldError("Lookups by the option field '%s' are not supported by the JSON option storage, "
+                                 "the options are filtered by the option name." % field_name)
+            else:
+                OptionDocumentValue.check_lookup(field_name, lookup or 'exact')
+                conditions.append(Q(pk__option_document=(field_name, lookup or 'exact', field_value)))
+
+        return query, conditions
 
     def get(self, *args, **kwargs):
         logger.debug("%s, %s" % (args, kwargs))
 
         return super(SubclassingQuerySet, self).get(*args, **kwargs).as_leaf_class()
 
+    def prefetch_options(self, names=None):
+        """
+        Load options of all the resources in the result set with a single extra query. Noop for the JSON
+        option storage, options are loaded with the resources.
+        :param names: option names to load, these options are returned by get_options(names). All options
+                      of the resource are still loaded on the other access.
+        """
+        if not get_option_storage().stores_rows:
+            return self._clone()
+
+        if names is not None:
+            return self.prefetch_related(Prefetch('resourceoption_set', to_attr='_selected_options',
+                                                  queryset=ResourceOption.objects.filter(name__in=names)))
+
+        return self.prefetch_related('resourceoption_set')
+
+    def values_with_options(self, *fields):
+        """
+        Returns dicts with the Resource fields and options of the selected resources, like values().
+        See values_list_with_options().
+        """
+        for row in self.values_list_with_options(*fields):
+            yield dict(zip(fields, row))
+
+    def values_list_with_options(self, *fields):
+        """
+        Returns tuples with the Resource fields and options of the selected resources, like values_list().
+        Options are pivoted to the columns with the conditional aggregation over the joined options, so
+        rows are selected with a single query, resources and options are not instantiated:
+            MAX(CASE WHEN option_keys.name = 'mac' THEN resource_options.value END)
+
+        Option values are decoded by the option format, missing options are None.
+        """
+        assert fields, "fields must be defined."
+
+        model_fields = [field_name for field_name in fields if ModelFieldChecker.is_model_field(Resource, field_name)]
+        option_names = [field_name for field_name in fields if field_name not in model_fields]
+
+        if not get_option_storage().stores_rows:
+            for row in self.prefetch_related(None).values('options_data', *model_fields):
+                values = ResourceOption.decode_document(row['options_data'], option_names)
+                values.update((field_name, row[field_name]) for field_name in model_fields)
+
+                yield tuple(values.get(field_name) for field_name in fields)
+            return
+
+        # resources are grouped by id, field names are used as is
+        queryset = self.prefetch_related(None).values('id', *model_fields)
+        for index, option_name in enumerate(option_names):
+            condition = Q(resourceoption__key__name=option_name)
+            queryset = queryset.annotate(**{
+                'option_value_%d' % index: Max(Case(When(condition, then='resourceoption__value'),
+                                                    output_field=models.TextField())),
+                'option_format_%d' % index: Max(Case(When(condition, then='resourceoption__format'),
+                                                     output_field=models.CharField()))})
+
+        # conditions of When() make the joins inner, resources without options are selected too
+        queryset.query.promote_joins(list(queryset.query.alias_map))
+
+        for row in queryset:
+            values = dict((field_name, row[field_name]) for field_name in model_fields)
+
+            for index, option_name in enumerate(option_names):
+                value = row['option_value_%d' % index]
+                if value is not None:
+                    value = ResourceOption.FORMAT_DECODERS[row['option_format_%d' % index]](value)
+
+                values[option_name] = value
+
+            yield tuple(values[field_name] for field_name in fields)
+
 
 class ResourcesWithOptionsManager(TreeManager):
     """
     Query manager with support for query by options.
     """
+    _local = threading.local()
 
     def get_queryset(self):
         return SubclassingQuerySet(self.model)
 
+    def get(self, *args, **kwargs):
+        """
+        Inside resource_identity_map() lookups by the primary key return the already loaded instance,
+        other lookups return the loaded instance, if it is already in the map.
+        """
+        identity_map = ResourceIdentityMap.current()
+        if not identity_map:
+            return self.get_queryset().get(*args, **kwargs)
+
+        resource_id = ResourceIdentityMap.lookup_id(args, kwargs)
+        resource = identity_map.get(resource_id) if resource_id is not None else None
+        if resource is not None and self.is_visible(resource):
+            return resource
+
+        return identity_map.add(self.get_queryset().get(*args, **kwargs))
+
+    def is_visible(self, resource):
+        """
+        Check if the loaded resource can be selected by this manager.
+        """
+        return self.model == Resource or resource.type == self.model.__name__
+
+    def prefetch_options(self, names=None):
+        return self.get_queryset().prefetch_options(names=names)
+
+    def values_with_options(self, *fields):
+        return self.get_queryset().values_with_options(*fields)
+
+    def values_list_with_options(self, *fields):
+        return self.get_queryset().values_list_with_options(*fields)
+
+    def bulk_create_with_options(self, type, rows, batch_size=1000, rows_options=None):
+        return self.get_queryset().bulk_create_with_options(type, rows, batch_size=batch_size,
+                                                            rows_options=rows_options)
+
+    @contextlib.contextmanager
+    def delay_mptt_updates(self):
+        """
+        Defer MPTT updates of the moved and created resources to the end of the block. Trees of these
+        resources (and the trees of their new parents) are rebuilt on exit with rebuild(tree_ids=...),
+        so the cost is proportional to the changed trees, not to the table size.
+
+        MPTT fields are not valid inside the block: don't use filter_childs(), filter_parents() and
+        the tree iterators for the resources moved in the block.
+        Nested blocks are merged with the outer one. Noop for the hierarchies, that don't use MPTT fields.
+        """
+        if self.changed_tree_ids() is not None or not get_hierarchy().maintains_nested_sets:
+            yield
+            return
+
+        ResourcesWithOptionsManager._local.changed_tree_ids = set()
+        try:
+            with Resource._tree_manager.disable_mptt_updates():
+                yield
+        finally:
+            tree_ids = ResourcesWithOptionsManager._local.changed_tree_ids
+            ResourcesWithOptionsManager._local.changed_tree_ids = None
+
+            if tree_ids:
+                self.rebuild(tree_ids=tree_ids)
+
+    @staticmethod
+    def changed_tree_ids():
+        """
+        Returns the set of the changed tree ids inside delay_mptt_updates(), None outside of it.
+        """
+        return getattr(ResourcesWithOptionsManager._local, 'changed_tree_ids', None)
+
+    def rebuild(self, tree_ids=None):
+        """
+        Rebuild MPTT fields using the parent links. All nodes of the rebuilt trees are loaded with a single
+        query, positions are calculated in memory and only the changed rows are updated.
+
+        :param tree_ids: rebuild only these trees, all trees if None. Trees of the new parents of the nodes
+                         are rebuilt too. Root nodes keep their tree ids, unless several roots share the
+                         same tree id (as the nodes, that are moved to the top inside delay_mptt_updates()).
+        """
+        with transaction.atomic():
+            nodes = OrderedDict()
+            tree_fields = ('id', 'parent_id', 'tree_id', 'lft', 'rght', 'level')
+
+            if tree_ids is None:
+                for row in QuerySet(Resource).order_by('id').values_list(*tree_fields):
+                    nodes[row[0]] = row
+            else:
+                tree_ids = set(tree_ids)
+                new_tree_ids = set(tree_ids)
+                while new_tree_ids:
+                    for row in QuerySet(Resource).filter(tree_id__in=new_tree_ids).values_list(*tree_fields):
+                        nodes[row[0]] = row
+
+                    missing_parent_ids = set(row[1] for row in nodes.values() if row[1] and row[1] not in nodes)
+                    new_tree_ids = set(QuerySet(Resource).filter(id__in=missing_parent_ids).values_list(
+                        'tree_id', flat=True)) - tree_ids if missing_parent_ids else set()
+                    tree_ids |= new_tree_ids
+
+                nodes = OrderedDict(sorted(nodes.items()))
+
+            positions = self._calculate_tree_positions(nodes, keep_tree_ids=tree_ids is not None)
+
+            changed = [(node_id, position) for node_id, position in positions.items()
+                       if position != nodes[node_id][2:]]
+
+            self._update_tree_positions(changed)
+
+        logger.debug("Rebuilt %s tree nodes, %s changed" % (len(nodes), len(changed)))
+
+    def partial_rebuild(self, tree_id):
+        self.rebuild(tree_ids=[tree_id])
+
+    def _calculate_tree_positions(self, nodes, keep_tree_ids):
+        """
+        Calculate (tree_id, lft, rght, level) of the nodes. Children are ordered by id, as in mptt rebuild().
+        :param nodes: dict of node rows by id, ordered by id
+        :param keep_tree_ids: keep tree ids of the root nodes, otherwise trees are numbered from 1
+        :return: dict of positions by node id
+        """
+        roots = []
+        children = {}
+        for node_id, parent_id, tree_id, lft, rght, level in nodes.values():
+            if parent_id is None:
+                roots.append((node_id, tree_id))
+            else:
+                children.setdefault(parent_id, []).append(node_id)
+
+        next_tree_id = Resource._tree_manager._get_next_tree_id() if keep_tree_ids else 1
+        used_tree_ids = set()
+
+        positions = {}
+        for root_id, tree_id in roots:
+            if not keep_tree_ids or not tree_id or tree_id in used_tree_ids:
+                tree_id = next_tree_id
+                next_tree_id += 1
+            used_tree_ids.add(tree_id)
+
+            position = 1
+            stack = [(root_id, 0, True)]
+            while stack:
+                node_id, level, entering = stack.pop()
+                if entering:
+                    positions[node_id] = [tree_id, position, None, level]
+                    stack.append((node_id, level, False))
+                    stack.extend((child_id, level + 1, True) for child_id in reversed(children.get(node_id, [])))
+                else:
+                    positions[node_id][2] = position
+                    positions[node_id] = tuple(positions[node_id])
+                position += 1
+
+        unreachable_ids = set(nodes.keys()) - set(positions.keys())
+        if unreachable_ids:
+            logger.warning("Tree nodes are not reachable from the roots: %s" % sorted(unreachable_ids))
+
+        return positions
+
+    def _update_tree_positions(self, changed, batch_size=100):
+        """
+        Update MPTT fields of the nodes with a single UPDATE ... CASE query per batch.
+        :param changed: list of tuples (node id, (tree_id, lft, rght, level))
+        """
+        fields = [Resource._meta.get_field(field_name) for field_name in ('tree_id', 'lft', 'rght', 'level')]
+
+        for batch_start in range(0, len(changed), batch_size):
+            batch = changed[batch_start:batch_start + batch_size]
+
+            updates = {}
+            for field_idx, field in enumerate(fields):
+                updates[field.attname] = Case(
+                    *[When(pk=node_id, then=Value(position[field_idx])) for node_id, position in batch],
+                    output_field=field)
+
+            QuerySet(Resource).filter(pk__in=[node_id for node_id, position in batch]).update(**updates)
+
+    def update_options_data(self, resources, batch_size=100):
+        """
+        Write the JSON options documents of the resources from their options (see JSONOptionStorage) with
+        a single UPDATE ... CASE query per batch. Options have no own timestamps, so updated_at of the resources
+        is updated too.
+        """
+        resources = list(resources)
+        updated_at = timezone.now()
+        for resource in resources:
+            resource.options_data = JSONOptionStorage.dump(resource._get_options_cache().values())
+            resource.updated_at = updated_at
+
+        field = Resource._meta.get_field('options_data')
+        for batch_start in range(0, len(resources), batch_size):
+            batch = resources[batch_start:batch_start + batch_size]
+
+            QuerySet(Resource).filter(pk__in=[resource.id for resource in batch]).update(
+                updated_at=updated_at,
+                options_data=Case(*[When(pk=resource.id, then=Value(resource.options_data)) for resource in batch],
+                                  output_field=field))
+
+        invalidate_query_cache({resource.type for resource in resources})
+
+    def migrate_options(self, storage_name, batch_size=500, resources=None):
+        """
+        Move options of all the resources to the layout of the option storage: 'rows' or 'json'
+        (see RESOURCES_OPTIONS_STORAGE). Each batch of the resources is moved in a transaction, so the
+        interrupted migration is continued by the next run.
+        :param resources: query set of the resources to move, all resources if None
+        :return: number of the moved resources
+        """
+        assert storage_name in OPTION_STORAGES, "Unknown option storage: %s" % storage_name
+
+        if OPTION_STORAGES[storage_name].stores_rows:
+            moved_resources = QuerySet(Resource).exclude(options_data__in=['', '{}'])
+            if resources is not None:
+                moved_resources = moved_resources.filter(id__in=resources.values('id'))
+
+            resource_ids = list(moved_resources.order_by('id').values_list('id', flat=True))
+            move_batch = self._move_options_to_rows
+        else:
+            moved_options = ResourceOption.objects.all()
+            if resources is not None:
+                moved_options = moved_options.filter(resource_id__in=resources.values('id'))
+
+            resource_ids = list(moved_options.order_by('resource').values_list('resource', flat=True).distinct())
+            move_batch = self._move_options_to_documents
+
+        for batch_start in range(0, len(resource_ids), batch_size):
+            with transaction.atomic():
+                move_batch(resource_ids[batch_start:batch_start + batch_size])
+
+        ResourceIdentityMap.invalidate()
+        invalidate_query_cache()
+
+        logger.debug("Moved options of %s resources to '%s'" % (len(resource_ids), storage_name))
+
+        return len(resource_ids)
+
+    @staticmethod
+    def _move_options_to_documents(resource_ids):
+        documents = dict((resource_id, JSONOptionStorage.load(data)) for resource_id, data in
+                         QuerySet(Resource).filter(id__in=resource_ids).values_list('id', 'options_data'))
+
+        for option in ResourceOption.objects.filter(resource_id__in=resource_ids).order_by('id'):
+            documents[option.resource_id][option.name] = JSONOptionStorage.encode(option)
+
+        field = Resource._meta.get_field('options_data')
+        QuerySet(Resource).filter(pk__in=resource_ids).update(options_data=Case(
+            *[When(pk=resource_id, then=Value(JSONOptionStorage.dumps(document)))
+              for resource_id, document in documents.items()], output_field=field))
+
+        # options are deleted without loading, as the moved options are not changed
+        ResourcesWithOptionsManager._delete_rows(ResourceOption, 'resource', resource_ids)
+
+    @staticmethod
+    def _move_options_to_rows(resource_ids):
+        options = []
+        for resource_id, data in QuerySet(Resource).filter(id__in=resource_ids).values_list('id', 'options_data'):
+            for name, (value, value_format, journaling) in JSONOptionStorage.load(data).items():
+                options.append(ResourceOption(resource_id=resource_id, name=name, value=value, format=value_format,
+                                              journaling=journaling))
+
+        ResourceOption.objects.bulk_create(options)
+        QuerySet(Resource).filter(pk__in=resource_ids).update(options_data='{}')
+
+    def create_option_indexes(self, names):
+        """
+        Create the expression indexes of the option values for the JSON option storage (noop, if the index
+        already exists). Index the options, that are often used in the lookups, such as mac or serial.
+        """
+        storage = OPTION_STORAGES[JSONOptionStorage.name]
+
+        with connection.cursor() as cursor:
+            for name in names:
+                cursor.execute(storage.index_sql(connection.vendor, connection.ops.quote_name, Resource._meta.db_table,
+                                                 Resource._meta.get_field('options_data').column, name))
+
+    def archive_deleted(self, retention_days=None, batch_size=500):
+        """
+        Move the deleted resources, that are not changed for the retention period, with their options and
+        comments to the archive tables (see ArchivedResource). Resources are archived from the leaves up,
+        resources with the children in the resources table are kept. Each batch is moved in a transaction.
+        :param retention_days: days after the deletion, RESOURCES_ARCHIVE_DAYS (90) by default
+        :return: number of the archived resources
+        """
+        if retention_days is None:
+            retention_days = getattr(settings, 'RESOURCES_ARCHIVE_DAYS', 90)
+
+        deleted_resources = QuerySet(Resource).filter(
+            status=Resource.STATUS_DELETED,
+            updated_at__lt=timezone.now() - datetime.timedelta(days=retention_days)).exclude(
+            id__in=QuerySet(Resource).filter(parent__isnull=False).values('parent'))
+
+        archived = 0
+        while True:
+            resource_ids = list(deleted_resources.order_by('id').values_list('id', flat=True)[:batch_size])
+            if not resource_ids:
+                break
+
+            with transaction.atomic():
+                self._archive_batch(resource_ids)
+
+            archived += len(resource_ids)
+
+        if archived:
+            ResourceIdentityMap.invalidate()
+            invalidate_query_cache()
+
+        logger.debug("Archived %s deleted resources" % archived)
+
+        return archived
+
+    @staticmethod
+    def _archive_batch(resource_ids):
+        archived_at = timezone.now()
+
+        ArchivedResource.objects.bulk_create([
+            ArchivedResource(archived_at=archived_at, **dict(zip(ArchivedResource.RESOURCE_FIELDS, values)))
+            for values in QuerySet(Resource).filter(pk__in=resource_ids).values_list(
+                *ArchivedResource.RESOURCE_FIELDS)])
+
+        ArchivedResourceOption.objects.bulk_create([
+            ArchivedResourceOption(resource_id=resource_id, key_id=key_id, value=value, format=value_format,
+                                   journaling=journaling)
+            for resource_id, key_id, value, value_format, journaling in ResourceOption.objects.filter(
+                resource_id__in=resource_ids).order_by('id').values_list('resource', 'key', 'value', 'format',
+                                                                         'journaling')])
+
+        ArchivedResourceComment.objects.bulk_create([
+            ArchivedResourceComment(resource_id=resource_id, author_id=author_id, created_at=created_at,
+                                    updated_at=updated_at, message=message)
+            for resource_id, author_id, created_at, updated_at, message in ResourceComment.objects.filter(
+                resource_id__in=resource_ids).order_by('id').values_list('resource', 'author', 'created_at',
+                                                                         'updated_at', 'message')])
+
+        # options and comments are deleted with the dependent rows of the other apps. Resources are deleted
+        # without loading: history events are kept and the delete events are not added.
+        ResourceOption.objects.filter(resource_id__in=resource_ids).delete()
+        ResourceComment.objects.filter(resource_id__in=resource_ids).delete()
+        ResourcesWithOptionsManager._delete_rows(Resource, 'id', resource_ids)
+
+    @staticmethod
+    def _delete_rows(model, field_name, values):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+                connection.ops.quote_name(model._meta.db_table),
+                connection.ops.quote_name(model._meta.get_field(field_name).column),
+                ', '.join(['%s'] * len(values))), values)
+
 
 class ResourcesActiveWithOptionsManager(ResourcesWithOptionsManager):
     """
@@ -175,7 +1035,12 @@ class ResourcesActiveWithOptionsManager(ResourcesWithOptionsManager):
     """
 
     def get_queryset(self):
-        return SubclassingQuerySet(self.model).filter().exclude(status=Resource.STATUS_DELETED)
+        # the partial indexes of the live resources are used by the literal status condition
+        return SubclassingQuerySet(self.model).filter(pk__live=True)
+
+    def is_visible(self, resource):
+        return resource.status != Resource.STATUS_DELETED and \
+               super(ResourcesActiveWithOptionsManager, self).is_visible(resource)
 
 
 class ResourceComment(models.Model):
@@ -191,6 +1056,223 @@ class ResourceComment(models.Model):
     message = models.TextField('Comment text')
 
 
+class OptionKey(models.Model):
+    """
+    Dictionary of the resource option names. Options refer to the names by id,
+    names are resolved through the in-process cache.
+    """
+    name = models.CharField(max_length=155, unique=True)
+
+    # key id -> name
+    _names_cache = {}
+    # name -> key id of the committed keys
+    _ids_cache = {}
+    # names of the keys, created by the thread in the open transaction
+    _local = threading.local()
+
+    class Meta:
+        db_table = "option_keys"
+
+    def __unicode__(self):
+        return self.name
+
+    @staticmethod
+    def get_id(name):
+        """
+        Returns the key id of the option name, the key is created if missing. Only the committed keys are
+        cached: keys, created in the transaction, are checked in the database until the transaction is
+        finished, because the transaction may be rolled back.
+        """
+        assert name, "Parameter 'name' must be defined."
+
+        key_id = OptionKey._ids_cache.get(name)
+        if key_id is not None:
+            return key_id
+
+        created_names = OptionKey._created_names()
+        if not connection.in_atomic_block:
+            # transactions of the created keys are finished: committed keys are found and cached below
+            created_names.clear()
+
+        key, created = OptionKey.objects.get_or_create(name=name)
+        OptionKey._cache_name(key.id, key.name)
+
+        if created and connection.in_atomic_block:
+            created_names.add(name)
+        elif name not in created_names:
+            OptionKey._ids_cache[name] = key.id
+
+        return key.id
+
+    @staticmethod
+    def get_name(key_id):
+        """
+        Returns the option name by the key id. The whole dictionary is loaded on a cache miss.
+        """
+        if key_id not in OptionKey._names_cache:
+            for cached_id, name in OptionKey.objects.values_list('id', 'name'):
+                OptionKey._cache_name(cached_id, name)
+
+        try:
+            return OptionKey._names_cache[key_id]
+        except KeyError:
+            raise OptionKey.DoesNotExist("Option key %s is not found." % key_id)
+
+    @staticmethod
+    def clear_cache():
+        OptionKey._names_cache.clear()
+        OptionKey._ids_cache.clear()
+
+    @staticmethod
+    def _created_names():
+        if not hasattr(OptionKey._local, 'created_names'):
+            OptionKey._local.created_names = set()
+
+        return OptionKey._local.created_names
+
+    @staticmethod
+    def _cache_name(key_id, name):
+        if OptionKey._names_cache.get(key_id, name) != name:
+            # ids of the rolled back keys are reused, cache is outdated
+            OptionKey.clear_cache()
+
+        OptionKey._names_cache[key_id] = name
+
+
+class ResourceOptionQuerySet(QuerySet):
+    """
+    Resource options query set. Lookups by option name are translated to the lookups by option key.
+    """
+
+    def _filter_or_exclude(self, negate, *args, **kwargs):
+        args = [self._translate_q(arg) if isinstance(arg, Q) else arg for arg in args]
+
+        return super(ResourceOptionQuerySet, self)._filter_or_exclude(negate, *args,
+                                                                      **self._translate_query(kwargs))
+
+    def order_by(self, *field_names):
+        field_names = ['%skey__name' % field_name[:-4] if field_name.lstrip('-') == 'name' else field_name
+                       for field_name in field_names]
+
+        return super(ResourceOptionQuerySet, self).order_by(*field_names)
+
+    def decoded(self):
+        """
+        Read only bulk path: returns tuples (resource_id, name, typed value) of the selected options.
+        Rows are selected with values_list() and decoded by the FORMAT_DECODERS, options are not instantiated
+        and no signals are sent.
+        """
+        decoders = ResourceOption.FORMAT_DECODERS
+
+        for resource_id, key_id, value, value_format in self.values_list('resource', 'key', 'value',
+                                                                         'format').iterator():
+            yield resource_id, OptionKey.get_name(key_id), decoders[value_format](value)
+
+    def decoded_by_resource(self, resource_ids, names=None, batch_size=500):
+        """
+        Returns typed option values of the resources: {resource_id: {name: value}}, see decoded(). With the JSON
+        option storage the values are decoded from the options documents of the resources.
+        :param resource_ids: ids of the resources
+        :param names: option names to select, all options if None
+        """
+        resource_ids = list(resource_ids)
+        options = dict((resource_id, {}) for resource_id in resource_ids)
+
+        if not get_option_storage().stores_rows:
+            # options are selected from the JSON options documents of the resources
+            for batch_start in range(0, len(resource_ids), batch_size):
+                for resource_id, data in QuerySet(Resource).filter(
+                        id__in=resource_ids[batch_start:batch_start + batch_size]).values_list('id', 'options_data'):
+                    options[resource_id] = ResourceOption.decode_document(data, names)
+
+            return options
+
+        for batch_start in range(0, len(resource_ids), batch_size):
+            queryset = self.filter(resource_id__in=resource_ids[batch_start:batch_start + batch_size])
+            if names is not None:
+                queryset = queryset.filter(name__in=list(names))
+
+            for resource_id, name, value in queryset.decoded():
+                options[resource_id][name] = value
+
+        return options
+
+    def _translate_q(self, q_object):
+        translated_q = Q()
+        translated_q.connector = q_object.connector
+        translated_q.negated = q_object.negated
+
+        for child in q_object.children:
+            if isinstance(child, Q):
+                translated_q.children.append(self._translate_q(child))
+            else:
+                translated_q.children.extend(self._translate_query(dict([child])).items())
+
+        return translated_q
+
+    @staticmethod
+    def _translate_query(search_fields):
+        """
+        Convert name__lookup = value to key_id IN (SELECT id FROM option_keys WHERE name__lookup = value).
+        The key subquery is not correlated, so it is evaluated once, and options are found by the key index.
+        """
+        query = {}
+
+        for field_name_with_lookup, field_value in search_fields.items():
+            field_name, lookup_sep, lookup = field_name_with_lookup.partition('__')
+
+            if field_name == 'name':
+                field_value = OptionKey.objects.filter(**{field_name_with_lookup: field_value}).values('id')
+                field_name_with_lookup = 'key_id__in'
+
+            query[field_name_with_lookup] = field_value
+
+        return query
+
+
+class ResourceOptionManager(models.Manager.from_queryset(ResourceOptionQuerySet)):
+    """
+    Resource options manager. Bulk created options get the option keys and typed columns filled.
+    """
+
+    def bulk_create(self, objs, batch_size=None):
+        objs = list(objs)
+
+        key_ids = {}
+        for option in objs:
+            if option.key_id is None:
+                if option.name not in key_ids:
+                    key_ids[option.name] = OptionKey.get_id(option.name)
+                option.key_id = key_ids[option.name]
+
+            option.update_typed_values()
+
+        return super(ResourceOptionManager, self).bulk_create(objs, batch_size=batch_size)
+
+    def bulk_update(self, objs, batch_size=50):
+        """
+        Update values of the saved options with a single UPDATE ... CASE query per batch.
+        """
+        fields = [ResourceOption._meta.get_field(field_name) for field_name in
+                  ('value', 'format', 'journaling', 'value_int', 'value_float', 'value_bool', 'value_prefix')]
+
+        objs = list(objs)
+        updated_at = timezone.now()
+        for option in objs:
+            option.updated_at = updated_at
+
+        for batch_start in range(0, len(objs), batch_size):
+            batch = objs[batch_start:batch_start + batch_size]
+
+            updates = {}
+            for field in fields:
+                updates[field.attname] = Case(
+                    *[When(pk=option.pk, then=Value(field.get_prep_value(getattr(option, field.attname))))
+                      for option in batch], output_field=field)
+
+            self.filter(pk__in=[option.pk for option in batch]).update(updated_at=updated_at, **updates)
+
+
 class ResourceOption(models.Model):
     """
     Resource options. Resources is able to have different options and
@@ -272,36 +1354,208 @@ class ResourceOption(models.Model):
         FORMAT_STRING: StringValue,
     }
 
-    resource = models.ForeignKey('Resource')
-    name = models.CharField(max_length=155, db_index=True)
-    updated_at = models.DateTimeField('Date updated', auto_now_add=True, db_index=True)
-    format = models.CharField(max_length=25, db_index=True, choices=FORMAT_CHOICES, default=FORMAT_STRING)
-    value = models.TextField('Option value')
-    journaling = models.BooleanField(default=True)
+    # decode the stored (raw) values without the value handlers, used by the bulk read paths
+    FORMAT_DECODERS = {
+        FORMAT_DICT: json.loads,
+        FORMAT_INT: int,
+        FORMAT_BOOL: lambda value, true_vals=BooleanValue.true_vals: unicode(value).lower() in true_vals,
+        FORMAT_FLOAT: float,
+        FORMAT_STRING: unicode,
+    }
+
+    @staticmethod
+    def decode_document(data, names=None):
+        """
+        Returns typed values of the options in the JSON options document by name, see JSONOptionStorage.
+        :param names: option names to decode, all options if None
+        """
+        values = {}
+        for name, (value, value_format, journaling) in JSONOptionStorage.load(data).items():
+            if names is None or name in names:
+                values[name] = ResourceOption.FORMAT_DECODERS[value_format](value)
+
+        return values
+
+    # typed shadow columns are indexed together with the option name
+    VALUE_PREFIX_LENGTH = 64
+    VALUE_INT_RANGE = (-2 ** 63, 2 ** 63 - 1)
+    VALUE_COLUMNS = {
+        bool: 'value_bool',
+        int: 'value_int',
+        long: 'value_int',
+        float: 'value_float',
+    }
+    TYPED_LOOKUPS = ['exact', 'in', 'gt', 'gte', 'lt', 'lte', 'range']
+    PREFIX_LOOKUPS = ['exact', 'in', 'startswith']
+
+    resource = models.ForeignKey('Resource')
+    key = models.ForeignKey(OptionKey, db_index=False)
+    updated_at = models.DateTimeField('Date updated', auto_now=True, db_index=True)
+    format = models.CharField(max_length=25, db_index=True, choices=FORMAT_CHOICES, default=FORMAT_STRING)
+    value = models.TextField('Option value')
+    value_int = models.BigIntegerField('Integer value', null=True)
+    value_float = models.FloatField('Numeric value', null=True)
+    value_bool = models.NullBooleanField('Boolean value')
+    value_prefix = models.CharField('Value prefix', max_length=VALUE_PREFIX_LENGTH, default='')
+    journaling = models.BooleanField(default=True)
+
+    objects = ResourceOptionManager()
+
+    value_format_handler = None
+
+    # option name, resolved from the key on demand
+    _name = None
+
+    class Meta:
+        db_table = "resource_options"
+        index_together = [
+            ['key', 'value_int'],
+            ['key', 'value_float'],
+            ['key', 'value_bool'],
+            ['key', 'value_prefix'],
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super(ResourceOption, self).__init__(*args, **kwargs)
+        self.format = self.guess_format(self.value) if not self.format else self.format
+        self.value_format_handler = self.FORMAT_HANDLERS[self.format]
+        self.value = self._value_handler().raw_value()
+
+    def __unicode__(self):
+        return "%s = %s" % (self.name, self._value_handler())
+
+    @property
+    def name(self):
+        if self._name is None and self.key_id is not None:
+            self._name = OptionKey.get_name(self.key_id)
+
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        if self.key_id is not None and value == self.name:
+            return
+
+        self._name = value
+        self.key_id = None
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+
+        self.prepare_save()
+
+        if update_fields and 'name' in update_fields:
+            update_fields = set(update_fields) - {'name'} | {'key'}
+
+        if update_fields and 'value' in update_fields:
+            update_fields = set(update_fields) | {'format', 'value_int', 'value_float', 'value_bool', 'value_prefix',
+                                                  'updated_at'}
+
+        super(ResourceOption, self).save(force_insert, force_update, using, update_fields)
+
+        resource = self._get_cached_resource()
+        if resource:
+            resource._update_options_cache(self)
+
+    def delete(self, using=None):
+        resource = self._get_cached_resource()
+
+        super(ResourceOption, self).delete(using=using)
+
+        if resource:
+            resource._evict_options_cache(self.name)
+
+    def _get_cached_resource(self):
+        """
+        Returns the owner Resource instance, if it is already loaded. Used to keep the owner options cache
+        coherent without extra queries.
+        """
+        return getattr(self, self._meta.get_field('resource').get_cache_name(), None)
+
+    def prepare_save(self):
+        """
+        Resolve the option key, format and typed values before the option is written.
+        """
+        if self.key_id is None:
+            self.key_id = OptionKey.get_id(self.name)
+
+        self.update_format()
+        self.update_typed_values()
+
+    def update_format(self):
+        self.format = self.guess_format(self.value) if not self.format else self.format
+        self.value_format_handler = self.FORMAT_HANDLERS[self.format]
+
+    def _value_handler(self):
+        return self.value_format_handler(self.value)
+
+    def update_typed_values(self):
+        """
+        Fill the typed shadow columns from the value format handler: value_int for integers,
+        value_float for integers and floats, value_bool for booleans and value_prefix for any value.
+        """
+        value_handler = self._value_handler()
+
+        try:
+            typed_value = value_handler.typed_value()
+        except (TypeError, ValueError, OverflowError):
+            typed_value = None
+
+        self.value_int = self.value_float = self.value_bool = None
+
+        if typed_value is not None:
+            if self.format == self.FORMAT_BOOL:
+                self.value_bool = typed_value
+            elif self.format in (self.FORMAT_INT, self.FORMAT_FLOAT):
+                if self.format == self.FORMAT_INT and self.VALUE_INT_RANGE[0] <= typed_value <= self.VALUE_INT_RANGE[1]:
+                    self.value_int = typed_value
+                self.value_float = float(typed_value)
 
-    value_format_handler = None
+        self.value_prefix = unicode(value_handler.raw_value())[:self.VALUE_PREFIX_LENGTH]
 
-    class Meta:
-        db_table = "resource_options"
+    @staticmethod
+    def get_value_lookups(lookup, value):
+        """
+        Translate the lookup by option value to the lookups by the indexed typed columns. Integers are matched
+        by value_int, numbers are compared by value_float and booleans by value_bool. Options without the typed
+        value (stored in the other format, such as the string '10') are matched by the value string, as before
+        the typed columns. Strings are looked up by the value prefix and then checked by the whole value, if it
+        is longer than the prefix. Other lookups use the value column.
+
+        :param lookup: field lookup name, exact if empty
+        :param value: lookup value
+        :return: Q to filter options
+        """
+        lookup = lookup or 'exact'
+        values = list(value) if lookup in ('in', 'range') and isinstance(value, (list, tuple, set)) else [value]
 
-    def __init__(self, *args, **kwargs):
-        super(ResourceOption, self).__init__(*args, **kwargs)
-        self.format = self.guess_format(self.value) if not self.format else self.format
-        self.value_format_handler = self.FORMAT_HANDLERS[self.format]
-        self.value = self._value_handler().raw_value()
+        if values and lookup in ResourceOption.TYPED_LOOKUPS:
+            columns = set(ResourceOption.VALUE_COLUMNS.get(type(item)) for item in values)
+            column = columns.pop() if len(columns) == 1 else None
 
-    def __unicode__(self):
-        return "%s = %s" % (self.name, self._value_handler())
+            if column == 'value_int' and lookup not in ('exact', 'in'):
+                # numbers are compared with both integer and float options
+                column = 'value_float'
 
-    def save(self, force_insert=False, force_update=False, using=None,
-             update_fields=None):
+            if column and (column != 'value_bool' or lookup in ('exact', 'in')):
+                if lookup in ResourceOption.PREFIX_LOOKUPS:
+                    string_query = ResourceOption.get_value_lookups(lookup, [unicode(item) for item in values]
+                                                                    if lookup == 'in' else unicode(value))
+                else:
+                    string_query = Q(**{'value__%s' % lookup: value})
 
-        self.format = self.guess_format(self.value) if not self.format else self.format
+                return Q(**{'%s__%s' % (column, lookup): value}) | (Q(**{'%s__isnull' % column: True}) & string_query)
 
-        super(ResourceOption, self).save(force_insert, force_update, using, update_fields)
+        if values and lookup in ResourceOption.PREFIX_LOOKUPS and all(isinstance(item, basestring) for item in values):
+            prefixes = [item[:ResourceOption.VALUE_PREFIX_LENGTH] for item in values]
+            query = {'value_prefix__%s' % lookup: prefixes if lookup == 'in' else prefixes[0]}
 
-    def _value_handler(self):
-        return self.value_format_handler(self.value)
+            if any(len(item) >= ResourceOption.VALUE_PREFIX_LENGTH for item in values):
+                query['value__%s' % lookup] = value
+
+            return Q(**query)
+
+        return Q(**{'value__%s' % lookup: value})
 
     @staticmethod
     def guess_format(value):
@@ -351,10 +1605,24 @@ class Resource(MPTTModel):
     created_at = models.DateTimeField('Date created', auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField('Date updated', auto_now=True, db_index=True)
     last_seen = models.DateTimeField('Date last seen', db_index=True, default=timezone.now)
+    options_data = models.TextField('Options document', default='{}', editable=False)
 
     objects = ResourcesWithOptionsManager()
     active = ResourcesActiveWithOptionsManager()
 
+    # options of the resource by name, loaded on first access
+    _options_cache = None
+
+    # options of the unsaved resource, inserted later by bulk_create_with_options()
+    _deferred_options = None
+
+    # options, selected by prefetch_options(names)
+    _selected_options = None
+
+    # status methods (lock, use, fail, free), that are called for each resource of this class on the cascade
+    # status change. Resources of the other classes are updated with a single query.
+    cascade_per_row_methods = ()
+
     class Meta:
         db_table = "resources"
 
@@ -399,12 +1667,13 @@ class Resource(MPTTModel):
         Update last_seen date of the resource
         """
 
+        now = timezone.now()
         if cascade:
-            for child in self:
-                child.last_seen = timezone.now()
-                child.save()
+            self._active_descendants().update(last_seen=now, updated_at=now)
+            ResourceIdentityMap.invalidate()
+            invalidate_query_cache()
 
-        self.last_seen = timezone.now()
+        self.last_seen = now
         self.save()
 
     def lock(self, cascade=False):
@@ -424,8 +1693,7 @@ class Resource(MPTTModel):
         assert method_name, "method_name must be defined."
 
         if cascade:
-            for child in self:
-                getattr(child, method_name)(cascade)
+            self._cascade_status(new_status, method_name)
 
         if self.status != new_status:
             logger.debug("Setting resource ID:%s status: %s -> %s" % (self.id, self.status, new_status))
@@ -433,6 +1701,42 @@ class Resource(MPTTModel):
             self.status = new_status
             self.save()
 
+    def _cascade_status(self, new_status, method_name):
+        """
+        Change status of the active descendants with a single UPDATE over the MPTT range of the resource.
+        Resources of the classes with method_name in cascade_per_row_methods are changed one by one.
+        History is generated from the statuses, selected before the update.
+        """
+        per_row_models = [model for model in apps.get_models()
+                          if issubclass(model, Resource) and method_name in model.cascade_per_row_methods]
+        per_row_type_ids = [content_type.id for content_type in
+                            ContentType.objects.get_for_models(*per_row_models, for_concrete_models=False).values()]
+
+        with transaction.atomic():
+            changed_resources = self._active_descendants().exclude(status=new_status)
+            if per_row_type_ids:
+                changed_resources = changed_resources.exclude(content_type__in=per_row_type_ids)
+
+            old_statuses = list(changed_resources.values_list('id', 'status', 'type'))
+            if old_statuses:
+                changed_resources.update(status=new_status, updated_at=timezone.now())
+                ResourceIdentityMap.invalidate([resource_id for resource_id, old_status, type_name in old_statuses])
+                invalidate_query_cache({type_name for resource_id, old_status, type_name in old_statuses})
+
+                resources_bulk_updated.send(sender=self.__class__, changes=[
+                    (resource_id, 'status', old_status, new_status)
+                    for resource_id, old_status, type_name in old_statuses])
+
+            if per_row_type_ids:
+                # resources are loaded one by one, as the methods can move them and change the tree
+                per_row_ids = list(self._active_descendants().filter(
+                    content_type__in=per_row_type_ids).values_list('id', flat=True))
+                for resource_id in per_row_ids:
+                    getattr(Resource.active.get(pk=resource_id), method_name)()
+
+    def _active_descendants(self):
+        return get_hierarchy().descendants(self, Resource.active.all())
+
     @property
     def is_locked(self):
         return self.status == self.STATUS_LOCKED
@@ -466,59 +1770,156 @@ class Resource(MPTTModel):
         Set resource option. If format is omitted, then format is guessed from value type.
         """
 
-        assert self.is_saved, "Resource must be saved before setting options"
         assert name is not None, "Parameter 'name' must be defined."
 
-        query = dict(
-            name=name,
-            defaults=dict(
-                value=value,
-                format=format,
-                journaling=journaling
+        if self._deferred_options is not None:
+            option = ResourceOption(name=name, value=value, format=format, journaling=journaling)
+            self._deferred_options[name] = option
+            self._get_options_cache()[name] = option
+            return
+
+        assert self.is_saved, "Resource must be saved before setting options"
+
+        session = ResourceSession.buffering()
+        if session:
+            session.set_option(self, name, value, format, journaling)
+            return
+
+        if not get_option_storage().stores_rows:
+            self._set_document_option(name, value, format, journaling)
+            return
+
+        option = self._get_options_cache().get(name)
+        if option:
+            option.value = value
+            option.format = format
+            option.journaling = journaling
+            option.save()
+        else:
+            query = dict(
+                name=name,
+                defaults=dict(
+                    value=value,
+                    format=format,
+                    journaling=journaling
+                )
             )
-        )
 
-        self.resourceoption_set.update_or_create(**query)
+            self.resourceoption_set.update_or_create(**query)
+
+    def _set_document_option(self, name, value, format, journaling):
+        """
+        Write the option to the JSON options document, the document is written as a whole. History events
+        of the changed journaling options are sent as the bulk updates.
+        """
+        old_option = self._get_options_cache().get(name)
 
-    def get_options(self):
-        query = dict(
-        )
+        option = ResourceOption(name=name, value=value, format=format, journaling=journaling)
+        option.resource = self
+        self._update_options_cache(option)
 
-        return self.resourceoption_set.filter(**query)
+        Resource.objects.update_options_data([self])
 
-    def get_option(self, name):
-        assert name is not None, "Parameter 'name' must be defined."
+        if journaling and (old_option is None or unicode(old_option.value) != unicode(option.value)):
+            resources_bulk_updated.send(sender=self.__class__, changes=[
+                (self.id, name, old_option.value if old_option else None, option.value)])
 
-        query = dict(
-            name=name,
-        )
+    def delete_option(self, name):
+        """
+        Remove the option of the resource.
+        """
+        option = self.get_option(name)
 
-        return self.resourceoption_set.get(**query)
+        if get_option_storage().stores_rows:
+            option.delete()
+        else:
+            self._evict_options_cache(name)
+            Resource.objects.update_options_data([self])
 
-    def has_option(self, name):
+    def get_options(self, names=None):
+        """
+        Returns options of the resource, ordered by id.
+        :param names: option names to return, all options if None
+        """
+        if names is None:
+            options = self._get_options_cache().values()
+        elif self._options_cache is None and self._selected_options is not None:
+            # options of prefetch_options(names), all options are not loaded yet
+            options = [option for option in self._selected_options if option.name in names]
+        else:
+            options = [option for option in self._get_options_cache().values() if option.name in names]
+
+        return sorted(options, key=lambda option: option.id)
+
+    def get_option(self, name):
         assert name is not None, "Parameter 'name' must be defined."
 
         try:
-            self.get_option(name)
-        except djexceptions.ObjectDoesNotExist:
-            return False
+            return self._get_options_cache()[name]
+        except KeyError:
+            raise ResourceOption.DoesNotExist("Resource %s have no option '%s'." % (self.id, name))
 
-        return True
+    def has_option(self, name):
+        assert name is not None, "Parameter 'name' must be defined."
+
+        return name in self._get_options_cache()
 
     def get_option_value(self, name, default=''):
         assert name is not None, "Parameter 'name' must be defined."
 
-        option_value = default
-        try:
-            option = self.get_option(name)
-            option_value = option.typed_value
-        except djexceptions.ObjectDoesNotExist:
-            option_value = default
+        option = self._get_options_cache().get(name)
+
+        return option.typed_value if option else default
+
+    def _get_options_cache(self):
+        """
+        Returns options of the resource by name. All options are loaded with a single query on first access
+        (or taken from the prefetch_options() results). With the JSON option storage options are the unsaved
+        ResourceOption instances, decoded from the options document.
+        """
+        if self._options_cache is None:
+            self._options_cache = OrderedDict()
+
+            if self.is_saved and get_option_storage().stores_rows:
+                for option in self.resourceoption_set.all():
+                    option.resource = self
+                    self._options_cache[option.name] = option
+            elif self.is_saved:
+                for name, (value, value_format, journaling) in JSONOptionStorage.load(self.options_data).items():
+                    option = ResourceOption(name=name, value=value, format=value_format, journaling=journaling)
+                    option.resource = self
+                    self._options_cache[name] = option
 
-        return option_value
+        return self._options_cache
+
+    def _update_options_cache(self, option):
+        if self._options_cache is not None:
+            self._options_cache[option.name] = option
+
+    def _evict_options_cache(self, name):
+        if self._options_cache is not None:
+            self._options_cache.pop(name, None)
+
+    def _reset_options_cache(self):
+        self._options_cache = None
+
+        if hasattr(self, '_prefetched_objects_cache'):
+            self._prefetched_objects_cache.pop('resourceoption', None)
 
     def get_type_name(self):
-        return self.__class__.__name__ if not self.content_type else self.content_type.model_class().__name__
+        leaf_model = self.get_leaf_model()
+
+        return self.__class__.__name__ if not leaf_model else leaf_model.__name__
+
+    def get_leaf_model(self):
+        """
+        Returns the model class of the resource, based on content_type_id. Content types are cached by the
+        ContentTypeManager, so there is no DB query.
+        """
+        if not self.content_type_id:
+            return None
+
+        return ContentType.objects.get_for_id(self.content_type_id).model_class()
 
     def cast_type(self, new_class_type):
         assert new_class_type
@@ -529,6 +1930,8 @@ class Resource(MPTTModel):
         if self.content_type.model_class == new_class_type:
             return self
 
+        # results with the old type are invalidated, the new type is invalidated on save
+        invalidate_query_cache([self.type])
         self.type = new_class_type.__name__
 
         super(Resource, self).save()
@@ -538,16 +1941,84 @@ class Resource(MPTTModel):
         return new_object
 
     def as_leaf_class(self):
-        content_type = self.content_type
-        model = content_type.model_class()
+        """
+        Cast resource to its proxy model class. All proxy models are stored in the same table,
+        so the instance is copied in memory without additional queries.
+        """
+        model = self.get_leaf_model()
 
-        if model == Resource or self.__class__ == model:
+        if not model or model == Resource or self.__class__ == model:
             return self
 
-        return model.objects.get(pk=self.id)
+        leaf_object = model.__new__(model)
+        leaf_object.__dict__.update(self.__dict__)
+        leaf_object._state = copy.copy(self._state)
+
+        return leaf_object
+
+    def refresh_from_db(self, *args, **kwargs):
+        super(Resource, self).refresh_from_db(*args, **kwargs)
+
+        self._reset_options_cache()
 
     def save(self, *args, **kwargs):
-        if not self.content_type:
+        session = ResourceSession.buffering()
+        if session and self.is_saved and not args and not kwargs:
+            session.add_resource(self)
+            return
+
+        self.save_now(*args, **kwargs)
+
+    def save_now(self, *args, **kwargs):
+        """
+        Save the resource, even if it is changed inside the resource_session().
+        """
+        self._fill_type_fields()
+
+        if not get_option_storage().stores_rows and not self._state.adding and not args and not kwargs:
+            # options document is written by set_option(), it is not overwritten by the stale instances
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'options_data']
+
+        is_moved = not self.is_saved or self._mptt_cached_fields.get('parent') != self.parent_id
+
+        # inside delay_mptt_updates() track the old and the new trees of the moved and created resources
+        changed_tree_ids = ResourcesWithOptionsManager.changed_tree_ids() if is_moved else None
+        if changed_tree_ids is not None and self.tree_id is not None:
+            changed_tree_ids.add(self.tree_id)
+
+        hierarchy = get_hierarchy()
+        if hierarchy.maintains_nested_sets:
+            # mptt moves the node using its lft and rght, they are stale if the tree was changed after loading
+            if is_moved and self.is_saved and Resource._mptt_updates_enabled:
+                self.tree_id, self.lft, self.rght, self.level = QuerySet(Resource).filter(pk=self.pk).values_list(
+                    'tree_id', 'lft', 'rght', 'level')[0]
+
+            super(Resource, self).save(*args, **kwargs)
+        else:
+            with Resource._tree_manager.disable_mptt_updates():
+                super(Resource, self).save(*args, **kwargs)
+
+            if is_moved:
+                hierarchy.node_moved(self)
+                self._mptt_meta.update_mptt_cached_fields(self)
+
+        if changed_tree_ids is not None:
+            changed_tree_ids.add(self.tree_id)
+
+        identity_map = ResourceIdentityMap.current()
+        if identity_map:
+            identity_map.replace(self)
+
+    def before_bulk_create(self):
+        """
+        Called for the new resource before it is inserted by bulk_create_with_options(), options are deferred.
+        Proxy models override it to apply the logic of their save().
+        """
+        pass
+
+    def _fill_type_fields(self):
+        if not self.content_type_id:
             self.content_type = ContentType.objects.get_for_model(self.__class__,
                                                                   for_concrete_model=not self._meta.proxy)
 
@@ -557,8 +2028,6 @@ class Resource(MPTTModel):
         if not self.last_seen:
             self.last_seen = timezone.now()
 
-        super(Resource, self).save(*args, **kwargs)
-
     def can_add(self, child):
         """
         Test if child can be added to this resource.
@@ -595,11 +2064,8 @@ class Resource(MPTTModel):
         """
         assert resource_class
 
-        query['lft__lte'] = self.lft
-        query['rght__gte'] = self.rght
-        query['tree_id'] = self.tree_id
-
-        return resource_class.active.filter(*args, **query).order_by('-level')
+        return get_hierarchy().ancestors(self, resource_class.active.filter(*args, **query),
+                                         include_self=True).order_by('-level')
 
     def filter_childs(self, resource_class, *args, **query):
         """
@@ -611,8 +2077,438 @@ class Resource(MPTTModel):
         """
         assert resource_class
 
-        query['lft__gte'] = self.lft
-        query['rght__lte'] = self.rght
-        query['tree_id'] = self.tree_id
+        return get_hierarchy().descendants(self, resource_class.active.filter(*args, **query),
+                                           include_self=True).order_by('level')
+
+
+class ArchivedResource(models.Model):
+    """
+    Deleted resource, moved out of the resources table by Resource.objects.archive_deleted(). The resource
+    keeps its id, so the history events of the resource refer to the archived resource.
+    """
+    id = models.IntegerField(primary_key=True)
+    parent_id = models.IntegerField(null=True, db_index=True)
+    content_type = models.ForeignKey(ContentType, editable=False, null=True)
+
+    name = models.CharField(db_index=True, max_length=155)
+    type = models.CharField(db_index=True, max_length=155)
+    status = models.CharField(max_length=25)
+    created_at = models.DateTimeField('Date created')
+    updated_at = models.DateTimeField('Date updated')
+    last_seen = models.DateTimeField('Date last seen')
+    options_data = models.TextField('Options document', default='{}', editable=False)
+    archived_at = models.DateTimeField('Date archived', db_index=True)
+
+    # fields, that are copied from the resource
+    RESOURCE_FIELDS = ('id', 'parent_id', 'content_type_id', 'name', 'type', 'status', 'created_at',
+                       'updated_at', 'last_seen', 'options_data')
+
+    class Meta:
+        db_table = "resources_archive"
+
+    def __unicode__(self):
+        return self.name
+
+    def get_option_values(self):
+        """
+        Returns typed values of the archived options by name, from the option rows and the options document.
+        """
+        values = ResourceOption.decode_document(self.options_data)
+        for option in self.options.all():
+            values[option.name] = ResourceOption.FORMAT_DECODERS[option.format](option.value)
+
+        return values
+
+
+class ArchivedResourceOption(models.Model):
+    """
+    Option row of the archived resource. Options are not searched, so the typed columns are not copied.
+    """
+    resource = models.ForeignKey(ArchivedResource, related_name='options')
+    key = models.ForeignKey(OptionKey, db_index=False)
+    value = models.TextField('Option value')
+    format = models.CharField(max_length=25, choices=ResourceOption.FORMAT_CHOICES)
+    journaling = models.BooleanField(default=True)
+
+    class Meta:
+        db_table = "resource_options_archive"
+
+    def __unicode__(self):
+        return "%s = %s" % (self.name, self.value)
+
+    @property
+    def name(self):
+        return OptionKey.get_name(self.key_id)
+
+
+class ArchivedResourceComment(models.Model):
+    """
+    Comment of the archived resource.
+    """
+    resource = models.ForeignKey(ArchivedResource, related_name='comments')
+    author = models.ForeignKey(User)
+
+    created_at = models.DateTimeField('Date created')
+    updated_at = models.DateTimeField('Date updated')
+
+    message = models.TextField('Comment text')
+
+    class Meta:
+        db_table = "resource_comments_archive"
+
+
+class ResourceSession(object):
+    """
+    Unit of work for the resources. Inside the session set_option() and save() of the saved resources
+    are buffered: repeated writes of the same option and repeated saves of the same instance are merged.
+    Changes are written in one transaction on exit: options with batched inserts and updates, the other
+    objects (such as history events) with bulk inserts. Changes are discarded, if an exception is raised.
+
+    Queries inside the session return the data as it was before the session.
+    Nested sessions are merged with the outer one.
+    """
+    _local = threading.local()
+
+    def __init__(self):
+        self.is_outer = False
+        self.flushing = False
+
+        # id(resource instance) -> resource
+        self.resources = OrderedDict()
+        # (resource id, option name) -> option
+        self.options = OrderedDict()
+        # (resource id, option name) -> saved option values
+        self.options_saved_values = {}
+        # objects to insert on flush
+        self.inserts = []
+
+    def __enter__(self):
+        if not ResourceSession.current():
+            self.is_outer = True
+            ResourceSession._local.session = self
+
+        return ResourceSession.current()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.is_outer:
+            return
+
+        try:
+            if exc_type is None:
+                self.flush()
+            else:
+                self.discard()
+        finally:
+            ResourceSession._local.session = None
+
+    @staticmethod
+    def current():
+        return getattr(ResourceSession._local, 'session', None)
+
+    @staticmethod
+    def buffering():
+        """
+        Returns the active session, that buffers resource changes.
+        """
+        session = ResourceSession.current()
+
+        return session if session and not session.flushing else None
+
+    def add_resource(self, resource):
+        self.resources[id(resource)] = resource
+
+    def add_insert(self, obj):
+        self.inserts.append(obj)
+
+    def set_option(self, resource, name, value, format, journaling):
+        if not get_option_storage().stores_rows:
+            self._set_document_option(resource, name, value, format, journaling)
+            return
+
+        option_key = (resource.id, name)
+
+        option = resource._get_options_cache().get(name)
+        if option:
+            if option.pk and option_key not in self.options_saved_values:
+                self.options_saved_values[option_key] = (unicode(option.value), option.format, option.journaling)
+
+            option.value = value
+            option.format = format
+            option.journaling = journaling
+            option.update_format()
+        else:
+            option = ResourceOption(resource=resource, name=name, value=value, format=format, journaling=journaling)
+            resource._update_options_cache(option)
+
+        self.options[option_key] = option
+
+    def _set_document_option(self, resource, name, value, format, journaling):
+        option_key = (resource.id, name)
+
+        # options of the JSON documents have no ids, the values before the session are saved for the history
+        if option_key not in self.options:
+            saved_option = resource._get_options_cache().get(name)
+            self.options_saved_values[option_key] = (unicode(saved_option.value), saved_option.format,
+                                                     saved_option.journaling) if saved_option else None
+
+        option = ResourceOption(name=name, value=value, format=format, journaling=journaling)
+        option.resource = resource
+        resource._update_options_cache(option)
+
+        self.options[option_key] = option
+
+    def flush(self):
+        self.flushing = True
+
+        with transaction.atomic():
+            for resource in self.resources.values():
+                resource.save_now()
+
+            if get_option_storage().stores_rows:
+                self._flush_options()
+            else:
+                self._flush_documents()
+
+            inserts_by_model = OrderedDict()
+            for obj in self.inserts:
+                inserts_by_model.setdefault(obj.__class__, []).append(obj)
+
+            for model, objs in inserts_by_model.items():
+                model._default_manager.bulk_create(objs)
+
+        self._clear()
+
+    def _flush_options(self):
+        created_options = []
+        updated_options = []
+        for option_key, option in self.options.items():
+            option.prepare_save()
+
+            if not option.pk:
+                created_options.append(option)
+            elif self.options_saved_values.get(option_key) != (unicode(option.value), option.format,
+                                                               option.journaling):
+                updated_options.append(option)
+
+        ResourceOption.objects.bulk_create(created_options)
+        ResourceOption.objects.bulk_update(updated_options)
+
+        for option in created_options + updated_options:
+            post_save.send(sender=ResourceOption, instance=option, created=not option.pk, update_fields=None,
+                           raw=False, using=ResourceOption.objects.db)
+
+        # created options have no ids, they are loaded on the next access
+        for option in created_options:
+            resource = option._get_cached_resource()
+            if resource:
+                resource._reset_options_cache()
+
+    def _flush_documents(self):
+        """
+        Write the JSON options documents of the changed resources, history of the journaling options is
+        inserted in bulk. Options of the same resource, changed through the different instances, are merged.
+        """
+        resources = OrderedDict()
+        changes = []
+        for option_key, option in self.options.items():
+            resource_id, name = option_key
+            resource = resources.setdefault(resource_id, option._get_cached_resource())
+            resource._update_options_cache(option)
+
+            saved_values = self.options_saved_values.get(option_key)
+            if option.journaling and (saved_values is None or saved_values[0] != unicode(option.value)):
+                changes.append((resource_id, name, saved_values[0] if saved_values else None, option.value))
+
+        Resource.objects.update_options_data(resources.values())
+
+        for option in self.options.values():
+            resource = option._get_cached_resource()
+            if resource is not resources[resource.id]:
+                resource.options_data = resources[resource.id].options_data
+                resource._reset_options_cache()
+
+        if changes:
+            resources_bulk_updated.send(sender=Resource, changes=changes)
+
+    def discard(self):
+        for option in self.options.values():
+            resource = option._get_cached_resource()
+            if resource:
+                resource._reset_options_cache()
+
+        self._clear()
+
+    def _clear(self):
+        self.resources.clear()
+        self.options.clear()
+        self.options_saved_values.clear()
+        del self.inserts[:]
+
+
+def resource_session():
+    """
+    Buffer changes of the resources and write them on exit:
+        with resource_session():
+            ip.free()
+            ip.set_option('services', 'ssh')
+    """
+    return ResourceSession()
+
+
+class ResourceIdentityMap(object):
+    """
+    Identity map of the loaded resources. Inside the map Resource.objects.get(pk=...) (and the other managers),
+    typed_parent and the parent FK return the already loaded instance instead of a new query.
+
+    Saved resources replace the loaded instances, deleted and bulk updated resources are evicted.
+    Nested maps are merged with the outer one.
+    """
+    _local = threading.local()
+
+    def __init__(self):
+        self.is_outer = False
+
+        # resource id -> resource
+        self.resources = {}
+
+    def __enter__(self):
+        if not ResourceIdentityMap.current():
+            self.is_outer = True
+            ResourceIdentityMap._local.identity_map = self
+
+        return ResourceIdentityMap.current()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.is_outer:
+            self.resources.clear()
+            ResourceIdentityMap._local.identity_map = None
+
+    @staticmethod
+    def current():
+        return getattr(ResourceIdentityMap._local, 'identity_map', None)
+
+    @staticmethod
+    def invalidate(resource_ids=None):
+        """
+        Evict resources from the active map, all resources if resource_ids is None.
+        """
+        identity_map = ResourceIdentityMap.current()
+        if not identity_map:
+            return
+
+        if resource_ids is None:
+            identity_map.resources.clear()
+        else:
+            for resource_id in resource_ids:
+                identity_map.resources.pop(resource_id, None)
+
+    @staticmethod
+    def lookup_id(args, kwargs):
+        """
+        Returns resource id, if get() lookups are by the primary key only.
+        """
+        if args or len(kwargs) != 1:
+            return None
+
+        field_name, value = kwargs.items()[0]
+        if field_name not in ('pk', 'id', 'pk__exact', 'id__exact'):
+            return None
+
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, resource_id):
+        return self.resources.get(resource_id)
+
+    def add(self, resource):
+        """
+        Add the loaded resource to the map.
+        :return: the instance from the map, if the resource is already loaded
+        """
+        if resource.id is None:
+            return resource
+
+        return self.resources.setdefault(resource.id, resource)
+
+    def replace(self, resource):
+        """
+        Make the saved resource the instance of the map. Resources, that are not casted to the leaf class,
+        are evicted, as get() returns the leaf class instances.
+        """
+        if resource.get_leaf_model() in (None, resource.__class__):
+            self.resources[resource.id] = resource
+        else:
+            self.resources.pop(resource.id, None)
+
+
+def resource_identity_map():
+    """
+    Return the same instance for the same resource, while the map is active:
+        with resource_identity_map():
+            for server_port in ServerPort.active.all():
+                switch = server_port.switch_port.typed_parent  # loaded once for all the ports
+    """
+    return ResourceIdentityMap()
+
+
+class IdentityMapParentDescriptor(ReverseSingleRelatedObjectDescriptor):
+    """
+    Resource.parent descriptor, that takes the parent from the active identity map.
+    """
+
+    def __get__(self, instance, instance_type=None):
+        identity_map = ResourceIdentityMap.current()
+        if instance is None or not identity_map or hasattr(instance, self.cache_name):
+            return super(IdentityMapParentDescriptor, self).__get__(instance, instance_type)
+
+        parent = identity_map.get(instance.parent_id) if instance.parent_id else None
+        if parent is None:
+            parent = super(IdentityMapParentDescriptor, self).__get__(instance, instance_type)
+            if parent is not None:
+                parent = identity_map.add(parent.as_leaf_class())
+
+        setattr(instance, self.cache_name, parent)
+
+        return parent
+
+
+Resource.parent = IdentityMapParentDescriptor(Resource._meta.get_field('parent'))
+
+
+@receiver(post_delete)
+def evict_deleted_resource(sender, instance, **kwargs):
+    if isinstance(instance, Resource):
+        ResourceIdentityMap.invalidate([instance.id])
+
+
+@receiver([post_save, post_delete])
+def invalidate_cached_queries(sender, instance, **kwargs):
+    """
+    Bump the query cache generation of the type of the changed resource (or of the option owner).
+    """
+    if isinstance(instance, Resource):
+        invalidate_query_cache([instance.type])
+    elif isinstance(instance, ResourceOption) and get_query_cache():
+        resource = instance._get_cached_resource()
+        invalidate_query_cache([resource.type] if resource else
+                               QuerySet(Resource).filter(pk=instance.resource_id).values_list('type', flat=True))
+
+
+@receiver(post_delete, sender=ResourceOption)
+def touch_option_owner(sender, instance, **kwargs):
+    """
+    Removed option changes the owner resource: updated_at of the resource is its Last-Modified in the REST API.
+    """
+    updated_at = timezone.now()
+    QuerySet(Resource).filter(pk=instance.resource_id).update(updated_at=updated_at)
+
+    resource = instance._get_cached_resource()
+    if resource:
+        resource.updated_at = updated_at
+
 
-        return resource_class.active.filter(*args, **query).order_by('level')
+@receiver(resources_bulk_created)
+def invalidate_bulk_created_queries(sender, resources, **kwargs):
+    invalidate_query_cache({resource.type for resource in resources})
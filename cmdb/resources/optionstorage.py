@@ -0,0 +1,133 @@
+from __future__ import unicode_literals
+
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class RowOptionStorage(object):
+    """
+    Options are the rows of the resource_options table, one row per option. Lookups by the options are
+    the subqueries over the indexed typed columns.
+    """
+    name = 'rows'
+
+    # options are ResourceOption rows
+    stores_rows = True
+
+
+class JSONOptionStorage(object):
+    """
+    Options of the resource are the JSON document in the resources.options_data column:
+        {"name": [value, format, journaling], ...}
+
+    Integer, float and boolean values are stored as the JSON numbers and booleans, the other values as the
+    option value strings. Options are read with the resource row, lookups by the options are the conditions
+    over the JSON functions of the database (SQLite JSON1, PostgreSQL jsonb). Lookups of the hot keys are
+    served by the expression indexes, see index_sql().
+    """
+    name = 'json'
+
+    stores_rows = False
+
+    # formats, which values are stored typed
+    TYPED_FORMATS = ('int', 'float', 'bool')
+
+    # option value expressions by database vendor, string lookups use the untyped value
+    VALUE_SQL = {
+        'sqlite': {
+            None: "json_extract(%(column)s, '$.\"%(name)s\"[0]')",
+        },
+        'postgresql': {
+            None: "(%(column)s::jsonb #>> '{\"%(name)s\",0}')",
+            'number': "(CASE WHEN jsonb_typeof(%(column)s::jsonb #> '{\"%(name)s\",0}') = 'number' "
+                      "THEN (%(column)s::jsonb #>> '{\"%(name)s\",0}')::numeric END)",
+            'boolean': "(CASE WHEN jsonb_typeof(%(column)s::jsonb #> '{\"%(name)s\",0}') = 'boolean' "
+                       "THEN (%(column)s::jsonb #>> '{\"%(name)s\",0}')::boolean END)",
+        },
+    }
+
+    @staticmethod
+    def load(data):
+        """
+        Returns options of the JSON document by name: OrderedDict of tuples (value, format, journaling).
+        """
+        if not data:
+            return OrderedDict()
+
+        return OrderedDict((name, tuple(item)) for name, item in
+                           json.loads(data, object_pairs_hook=OrderedDict).items())
+
+    @staticmethod
+    def dump(options):
+        """
+        Returns the JSON document of the ResourceOption instances.
+        """
+        return JSONOptionStorage.dumps(OrderedDict((option.name, JSONOptionStorage.encode(option))
+                                                   for option in options))
+
+    @staticmethod
+    def dumps(document):
+        """
+        Returns the JSON document of the options by name, see load().
+        """
+        return json.dumps(document, separators=(',', ':'))
+
+    @staticmethod
+    def encode(option):
+        """
+        Returns the document item of the ResourceOption: [value, format, journaling].
+        """
+        option.update_format()
+
+        value = unicode(option.value)
+        if option.format in JSONOptionStorage.TYPED_FORMATS:
+            try:
+                value = option.typed_value
+            except (TypeError, ValueError, OverflowError):
+                pass
+
+        return [value, option.format, option.journaling]
+
+    def value_sql(self, vendor, column, name, value_type=None):
+        """
+        Returns SQL expression of the option value.
+        :param vendor: database vendor
+        :param column: quoted options_data column
+        :param name: option name, it is a literal in the expression, so the expression indexes can be used
+        :param value_type: None for the raw value, 'number' or 'boolean' for the typed comparisons
+        """
+        if vendor not in self.VALUE_SQL:
+            raise NotImplementedError("JSON option storage is not supported by the '%s' database." % vendor)
+
+        if '"' in name or '\\' in name:
+            raise ValueError("Option name '%s' can't be used in the JSON path." % name)
+
+        templates = self.VALUE_SQL[vendor]
+
+        return templates.get(value_type, templates[None]) % dict(column=column, name=name.replace("'", "''"))
+
+    def index_name(self, table, name):
+        return '%s_option_%s' % (table, hashlib.md5(name.encode('utf-8')).hexdigest()[:12])
+
+    def index_sql(self, vendor, quote_name, table, column, name):
+        """
+        Returns SQL to create the expression index of the option value, it is used by the lookups by strings
+        (and by the typed values in SQLite).
+        """
+        return 'CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (
+            quote_name(self.index_name(table, name)), quote_name(table),
+            self.value_sql(vendor, quote_name(column), name))
+
+
+OPTION_STORAGES = dict((storage.name, storage) for storage in (RowOptionStorage(), JSONOptionStorage()))
+
+
+def get_option_storage():
+    """
+    Returns the option storage, selected by the RESOURCES_OPTIONS_STORAGE setting ('rows' by default).
+    Use Resource.objects.migrate_options() to move the options, when the setting is changed.
+    """
+    return OPTION_STORAGES[getattr(settings, 'RESOURCES_OPTIONS_STORAGE', RowOptionStorage.name)]
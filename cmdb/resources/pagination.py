@@ -0,0 +1,160 @@
+from __future__ import unicode_literals
+
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import ugettext_lazy as _
+from rest_framework.compat import OrderedDict
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class ResourceCursorPagination(PageNumberPagination):
+    """
+    Page number pagination with the keyset mode for the bulk clients. Keyset pages are requested with
+    the cursor parameter (empty for the first page) and ordered by id or by (updated_at, id):
+        /v1/resources/?cursor=&ordering=updated_at&page_size=1000
+
+    The next page is selected by the key of the last resource of the page: (updated_at, id) > (u, i),
+    so pages are not counted and no rows are skipped with OFFSET. The cursor in the next link is opaque,
+    pages are only followed forward.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+
+    # key fields of the orderings, the last field is unique
+    orderings = {
+        'id': ('id',),
+        'updated_at': ('updated_at', 'id'),
+    }
+    default_ordering = 'id'
+
+    invalid_cursor_message = _('Invalid cursor')
+    invalid_ordering_message = _('Invalid ordering "{ordering}", use one of: {orderings}.')
+
+    # cursor is None in the page number mode
+    cursor = None
+
+    @classmethod
+    def get_query_params(cls):
+        """
+        Returns query parameters of the pagination, they are not the filters of the resources.
+        """
+        return [cls.page_query_param, cls.page_size_query_param, cls.cursor_query_param, cls.ordering_query_param]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return super(ResourceCursorPagination, self).paginate_queryset(queryset, request, view=view)
+
+        self._handle_backwards_compat(view)
+
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.request = request
+        self.cursor = self._decode_cursor(request.query_params[self.cursor_query_param], request)
+
+        key_fields = self.orderings[self.cursor['ordering']]
+        queryset = queryset.order_by(*key_fields)
+        if self.cursor['key'] is not None:
+            queryset = self._filter_after(queryset, key_fields, self.cursor['key'])
+
+        # one more resource to know if there is the next page
+        resources = list(queryset[:self.page_size + 1])
+        self.page = resources[:self.page_size]
+        self.has_next = len(resources) > len(self.page)
+
+        return self.page
+
+    def get_paginated_response(self, data):
+        if self.cursor is None:
+            return super(ResourceCursorPagination, self).get_paginated_response(data)
+
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        if self.cursor is None:
+            return super(ResourceCursorPagination, self).get_next_link()
+
+        if not self.has_next:
+            return None
+
+        ordering = self.cursor['ordering']
+        last_resource = self.page[-1]
+        key = [getattr(last_resource, field_name) for field_name in self.orderings[ordering]]
+
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param,
+                                   self._encode_cursor(ordering, key))
+
+    def to_html(self):
+        if self.cursor is None:
+            return super(ResourceCursorPagination, self).to_html()
+
+        return ''
+
+    @staticmethod
+    def _filter_after(queryset, key_fields, key):
+        """
+        Filter the resources, that follow the key in the ordering by the key fields:
+            f1 >= v1 AND (f1 > v1 OR (f1 = v1 AND f2 > v2) ...)
+        The first condition is the range over the index of the first field.
+        """
+        after = Q()
+        for field_idx, field_name in enumerate(key_fields):
+            condition = dict(('%s__exact' % key_fields[idx], key[idx]) for idx in range(field_idx))
+            condition['%s__gt' % field_name] = key[field_idx]
+            after |= Q(**condition)
+
+        return queryset.filter(after, **{'%s__gte' % key_fields[0]: key[0]})
+
+    def _encode_cursor(self, ordering, key):
+        key = [value.isoformat() if hasattr(value, 'isoformat') else value for value in key]
+
+        return urlsafe_b64encode(json.dumps([ordering, key], separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+    def _decode_cursor(self, encoded, request):
+        """
+        Returns the cursor: dict with the ordering and the key of the last resource of the previous page,
+        the key is None for the first page.
+        """
+        if not encoded:
+            ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+            if ordering not in self.orderings:
+                raise NotFound(self.invalid_ordering_message.format(
+                    ordering=ordering, orderings=', '.join(sorted(self.orderings))))
+
+            return dict(ordering=ordering, key=None)
+
+        try:
+            ordering, key = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            key_fields = self.orderings[ordering]
+            if len(key) != len(key_fields):
+                raise ValueError("Key doesn't match the ordering.")
+
+            key = [self._parse_key_value(field_name, value) for field_name, value in zip(key_fields, key)]
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return dict(ordering=ordering, key=key)
+
+    @staticmethod
+    def _parse_key_value(field_name, value):
+        if field_name == 'id':
+            return int(value)
+
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError("Invalid datetime: %s" % value)
+
+        return parsed
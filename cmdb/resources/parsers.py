@@ -0,0 +1,46 @@
+from __future__ import unicode_literals
+
+import json
+
+import msgpack
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Newline delimited JSON: one JSON object per line, empty lines are skipped. Parsed to the list of objects,
+    so the large payloads are produced by the clients line by line.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        items = []
+        for line_number, line in enumerate(stream.read().decode(encoding).splitlines(), 1):
+            if not line.strip():
+                continue
+
+            try:
+                items.append(json.loads(line))
+            except ValueError as exc:
+                raise ParseError("NDJSON parse error at line %s: %s" % (line_number, exc))
+
+        return items
+
+
+class MessagePackParser(BaseParser):
+    """
+    MessagePack request bodies, see MessagePackRenderer. Options of the resources are accepted both as
+    the list of the option objects and as the name -> value map.
+    """
+    media_type = 'application/x-msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), encoding='utf-8')
+        except ValueError as exc:
+            raise ParseError("MessagePack parse error: %s" % exc)
@@ -0,0 +1,341 @@
+from __future__ import unicode_literals
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import connection
+from django.db.models.lookups import Lookup
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.db.models.sql.where import WhereNode, AND
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+# generation of all the cached results
+EPOCH_KEY = 'resources:epoch'
+
+# generation of the results, that are not restricted by type
+ANY_TYPE_KEY = 'resources:type:*'
+
+
+def _type_key(type_name):
+    return 'resources:type:%s' % type_name
+
+
+def _generation_seed():
+    # generations, that are dropped by the backend, are restarted from the new value, so the results
+    # cached with the old generations are not valid again
+    return int(time.time() * 1000000)
+
+
+class LocMemLRUBackend(object):
+    """
+    In-process storage of the query results. Least recently used results are dropped, when max_entries
+    is reached. Generations are kept apart from the results and are never dropped.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._results.pop(key, None)
+            if value is not None:
+                self._results[key] = value
+
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._results.pop(key, None)
+            self._results[key] = value
+
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def get_generations(self, keys):
+        with self._lock:
+            return dict((key, self._generations[key]) for key in keys if key in self._generations)
+
+    def incr_generation(self, key):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, _generation_seed()) + 1
+
+            return self._generations[key]
+
+
+class DjangoCacheBackend(object):
+    """
+    Storage in the Django cache (CACHES setting), shared by the processes, if the cache is shared.
+    """
+
+    def __init__(self, alias='default', timeout=300):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def get_generations(self, keys):
+        return self.cache.get_many(keys)
+
+    def incr_generation(self, key):
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, _generation_seed(), None)
+            return self.cache.incr(key)
+
+
+class ChangeCounters(object):
+    """
+    Change counters (generations) of the resource types. Saved and deleted resources bump the counter
+    of their type and the counter of any type, so the counters of the types selected by a query
+    change when the query results may change.
+
+    Transaction support: counters of the resources changed in the transaction are bumped on change and once
+    more, after the transaction is finished, so the values read by the other threads before the commit
+    are not valid after it.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._local = threading.local()
+
+    def invalidate(self, types=None):
+        """
+        Bump the counters of the resource types, all counters if types is None.
+        """
+        if types is None:
+            keys = [EPOCH_KEY]
+        else:
+            keys = [_type_key(type_name) for type_name in set(types)] + [ANY_TYPE_KEY]
+
+        # generations of the finished transaction are bumped before the new ones
+        self.is_usable()
+        for key in keys:
+            self.backend.incr_generation(key)
+
+        if connection.in_atomic_block:
+            self._pending_keys().update(keys)
+
+    def get_counters(self, types=None):
+        """
+        Returns the counters of the resource types: list of the generations, the first one is the generation
+        of all the types. Counters of any type are returned if types is None.
+        """
+        self.is_usable()
+
+        generation_keys = [EPOCH_KEY] + ([_type_key(type_name) for type_name in sorted(types)] if types
+                                         else [ANY_TYPE_KEY])
+
+        generations = self.backend.get_generations(generation_keys)
+        for key in generation_keys:
+            if key not in generations:
+                generations[key] = self.backend.incr_generation(key)
+
+        return [generations[key] for key in generation_keys]
+
+    def is_usable(self):
+        """
+        Returns False inside the transaction with the changes of this thread. Generations of these changes are
+        bumped once more, when the transaction is finished.
+        """
+        pending_keys = self._pending_keys()
+        if not pending_keys:
+            return True
+
+        if connection.in_atomic_block:
+            return False
+
+        for key in pending_keys:
+            self.backend.incr_generation(key)
+        pending_keys.clear()
+
+        return True
+
+    def _pending_keys(self):
+        if not hasattr(self._local, 'pending_keys'):
+            self._local.pending_keys = set()
+
+        return self._local.pending_keys
+
+
+class QueryResultCache(ChangeCounters):
+    """
+    Cache of the resource ids, selected by the queries. Results are keyed by the SQL of the query and by the
+    change counters of the resource types, selected by the query. Queries without type__in/type lookups depend
+    on the counter of any type.
+
+    Until the transaction with the changes of the resources is finished, the cache is bypassed by the thread,
+    that made the change.
+    """
+
+    def __init__(self, backend):
+        super(QueryResultCache, self).__init__(backend)
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses)
+
+    def clear(self):
+        """
+        Invalidate all the results and reset the counters.
+        """
+        self.invalidate()
+        self.hits = 0
+        self.misses = 0
+
+    def get_ids(self, query_key, types):
+        """
+        Returns cached ids of the query results, or None.
+        """
+        if not self.is_usable():
+            return None
+
+        ids = self.backend.get(self._result_key(query_key, types))
+        if ids is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return ids
+
+    def set_ids(self, query_key, types, ids):
+        if self.is_usable():
+            self.backend.set(self._result_key(query_key, types), ids)
+
+    def _result_key(self, query_key, types):
+        return 'resources:query:%s:%s' % (query_key, '.'.join(unicode(generation) for generation in
+                                                              self.get_counters(types)))
+
+
+def query_cache_key(queryset):
+    """
+    Returns (query key, types) of the queryset, or None, if the query results are not cached. Types are
+    the resource types, selected by the query, or None, if the query is not restricted by type.
+
+    Queries with joins, extra() conditions (hierarchy filters) and lookups or ordering by the MPTT fields are
+    not cached: their results are changed by the changes of the other resources.
+    """
+    query = queryset.query
+
+    if (query.extra or query.extra_tables or query.annotations or query.select_related or
+            query.select_for_update or query.deferred_loading[0]):
+        return None
+
+    if len([alias for alias, refcount in query.alias_refcount.items() if refcount]) > 1:
+        return None
+
+    tree_fields = _tree_fields(queryset.model)
+    ordering = list(query.order_by) or (list(queryset.model._meta.ordering) if query.default_ordering else [])
+    for field_name in ordering:
+        if (not isinstance(field_name, basestring) or field_name == '?' or
+                field_name.lstrip('-').split('__')[0] in tree_fields):
+            return None
+
+    cacheable, types = _inspect_where(query.where, tree_fields)
+    if not cacheable:
+        return None
+
+    try:
+        sql, params = query.sql_with_params()
+    except EmptyResultSet:
+        return None
+
+    query_key = hashlib.md5(('%s.%s|%s|%r' % (queryset.model._meta.app_label, queryset.model._meta.object_name,
+                                              sql, params)).encode('utf-8')).hexdigest()
+
+    return query_key, types
+
+
+def _tree_fields(model):
+    mptt_meta = model._mptt_meta
+    return {mptt_meta.tree_id_attr, mptt_meta.left_attr, mptt_meta.right_attr, mptt_meta.level_attr}
+
+
+def _inspect_where(node, tree_fields, restricting=True):
+    """
+    Returns tuple (cacheable, types). Types are collected from the type lookups of the AND conditions.
+    """
+    restricting = restricting and node.connector == AND and not node.negated
+    types = None
+
+    for child in node.children:
+        if isinstance(child, WhereNode):
+            cacheable, child_types = _inspect_where(child, tree_fields, restricting)
+        elif isinstance(child, Lookup) and hasattr(child.lhs, 'target'):
+            cacheable = child.lhs.target.name not in tree_fields
+            child_types = _lookup_types(child) if restricting else None
+        else:
+            return False, None
+
+        if not cacheable:
+            return False, None
+
+        if child_types is not None:
+            types = child_types if types is None else types & child_types
+
+    return True, types
+
+
+def _lookup_types(lookup):
+    if lookup.lhs.target.name != 'type':
+        return None
+
+    if lookup.lookup_name == 'exact' and isinstance(lookup.rhs, basestring):
+        return {lookup.rhs}
+
+    if lookup.lookup_name == 'in' and all(isinstance(value, basestring) for value in lookup.rhs):
+        return set(lookup.rhs)
+
+    return None
+
+
+_query_caches = {}
+
+
+def get_query_cache():
+    """
+    Returns the query result cache, configured by the RESOURCES_QUERY_CACHE setting, or None, if the cache
+    is disabled (default):
+        RESOURCES_QUERY_CACHE = {
+            'BACKEND': 'resources.querycache.LocMemLRUBackend',
+            'OPTIONS': {'max_entries': 1000},
+        }
+    """
+    config = getattr(settings, 'RESOURCES_QUERY_CACHE', None)
+    if config is None:
+        return None
+
+    if 'default' not in _query_caches:
+        backend_class = import_string(config.get('BACKEND', 'resources.querycache.LocMemLRUBackend'))
+        _query_caches['default'] = QueryResultCache(backend_class(**config.get('OPTIONS', {})))
+
+    return _query_caches['default']
+
+
+def invalidate_query_cache(types=None):
+    """
+    Invalidate cached results of the resource types, all results if types is None.
+    """
+    query_cache = get_query_cache()
+    if query_cache:
+        query_cache.invalidate(types)
+
+
+@receiver(setting_changed)
+def reset_query_cache(setting, **kwargs):
+    if setting == 'RESOURCES_QUERY_CACHE':
+        _query_caches.pop('default', None)
@@ -0,0 +1,43 @@
+from __future__ import unicode_literals
+
+import msgpack
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from resources.parsers import MessagePackParser
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Compact binary representation for the bulk clients, requested with Accept: application/x-msgpack
+    (or ?format=msgpack). Options of the resources are rendered as the map of the typed values:
+        {"options": {"mac": "001122334455", "rack_position": 5}}
+    instead of the list of the option objects, see ResourceOptionListSerializer.
+
+    Values, that are not the MessagePack types (datetimes, decimals), are encoded as JSONRenderer does.
+    Byte strings and unicode are both packed as the str type (utf-8), the bin type is not used, as the byte
+    strings of Python 2 are the text values, that the clients expect as strings.
+    """
+    media_type = 'application/x-msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    # serializers render the options as the name -> value map
+    flat_options = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return msgpack.packb(data, default=JSONEncoder().default)
+
+
+class MessagePackViewMixin(object):
+    """
+    Views with the opt-in MessagePack representation: JSON is still the default, MessagePack is selected
+    by the Accept/Content-Type headers or ?format=msgpack.
+    """
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + [MessagePackRenderer]
+    parser_classes = list(api_settings.DEFAULT_PARSER_CLASSES) + [MessagePackParser]
@@ -1,19 +1,130 @@
 from __future__ import unicode_literals
 
+import json
+from collections import OrderedDict
+
 from rest_framework import serializers
+from rest_framework.exceptions import ParseError
 
 from cmdb.settings import logger
 from resources.models import Resource, ResourceOption
 
 
+def get_query_names(request, query_param):
+    """
+    Returns the names of the comma separated query parameter: ?fields=id,status. None if there is no parameter.
+    """
+    if request is None or query_param not in request.query_params:
+        return None
+
+    return [name.strip() for name in request.query_params[query_param].split(',') if name.strip()]
+
+
+class SparseFieldsSerializerMixin(object):
+    """
+    Fields of the serialized resources are selected with the query parameters of the request:
+        ?fields=id,status,parent - serialized fields
+        ?options=address,mac - serialized options, the options field is added to the selected fields
+    Optional fields are serialized only, if they are selected.
+    """
+    fields_query_param = 'fields'
+    options_query_param = 'options'
+
+    optional_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super(SparseFieldsSerializerMixin, self).__init__(*args, **kwargs)
+
+        field_names = self.get_selected_fields(self.context.get('request'))
+        unknown_names = set(field_names) - set(self.fields.keys())
+        if unknown_names:
+            raise ParseError("Unknown fields: %s." % ', '.join(sorted(unknown_names)))
+
+        for field_name in list(self.fields.keys()):
+            if field_name not in field_names:
+                self.fields.pop(field_name)
+
+    @classmethod
+    def get_query_params(cls):
+        return [cls.fields_query_param, cls.options_query_param]
+
+    @classmethod
+    def get_selected_fields(cls, request):
+        """
+        Returns the names of the serialized fields.
+        """
+        field_names = get_query_names(request, cls.fields_query_param)
+        if field_names is None:
+            field_names = [field_name for field_name in cls.Meta.fields if field_name not in cls.optional_fields]
+
+        if get_query_names(request, cls.options_query_param) is not None and 'options' not in field_names:
+            field_names.append('options')
+
+        return field_names
+
+    @classmethod
+    def get_selected_options(cls, request):
+        """
+        Returns the names of the serialized options, None for all options.
+        """
+        return get_query_names(request, cls.options_query_param)
+
+
+class ResourceOptionListSerializer(serializers.ListSerializer):
+    """
+    Options of the resource, selected by the ?options= query parameter.
+
+    Compact renderers (flat_options = True, see MessagePackRenderer) get the options as the name -> typed value
+    map. The map is accepted on input with any parser: {"mac": "001122334455"} is [{"name": "mac", ...}].
+    """
+
+    def get_attribute(self, instance):
+        return instance.get_options(names=SparseFieldsSerializerMixin.get_selected_options(
+            self.context.get('request')))
+
+    def to_representation(self, data):
+        if not self.is_flat():
+            return super(ResourceOptionListSerializer, self).to_representation(data)
+
+        return OrderedDict((option.name, ResourceOption.FORMAT_DECODERS[option.format](option.value))
+                           for option in data)
+
+    def to_internal_value(self, data):
+        if isinstance(data, dict):
+            data = [self._map_item(name, value) for name, value in data.items()]
+
+        return super(ResourceOptionListSerializer, self).to_internal_value(data)
+
+    @staticmethod
+    def _map_item(name, value):
+        # values are stored as strings, so the format of the typed values is guessed before the value field
+        if isinstance(value, basestring):
+            return {'name': name, 'value': value}
+
+        return {'name': name, 'value': json.dumps(value) if isinstance(value, dict) else value,
+                'format': ResourceOption.guess_format(value)}
+
+    def is_flat(self):
+        if 'flat_options' in self.context:
+            return self.context['flat_options']
+
+        renderer = getattr(self.context.get('request'), 'accepted_renderer', None)
+
+        return getattr(renderer, 'flat_options', False)
+
+
 class ResourceOptionSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(max_length=155)
+
     class Meta:
         model = ResourceOption
         fields = ('id', 'name', 'value', 'format', 'updated_at', 'journaling')
+        list_serializer_class = ResourceOptionListSerializer
 
 
-class ResourceSerializer(serializers.ModelSerializer):
-    options = ResourceOptionSerializer(source='resourceoption_set', many=True, required=False)
+class ResourceSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
+    # options are read and written through the resource, so both option storages are supported
+    options = ResourceOptionSerializer(source='get_options', many=True, required=False)
 
     class Meta:
         model = Resource
@@ -21,7 +132,7 @@ class ResourceSerializer(serializers.ModelSerializer):
             'id', 'name', 'parent', 'type', 'status', 'created_at', 'updated_at', 'last_seen', 'options')
 
     def update(self, instance, validated_data):
-        options_list = validated_data.pop('resourceoption_set', [])
+        options_list = validated_data.pop('get_options', [])
 
         logger.debug(options_list)
 
@@ -30,26 +141,29 @@ class ResourceSerializer(serializers.ModelSerializer):
             defaults=validated_data
         )
 
-        for option_item in options_list:
-            ResourceOption.objects.update_or_create(
-                name=option_item['name'],
-                resource=resource,
-                defaults=option_item,
-            )
+        self._set_options(resource, options_list)
 
         resource.refresh_from_db()
 
         return resource
 
     def create(self, validated_data):
-        options_list = validated_data.pop('resourceoption_set')
+        options_list = validated_data.pop('get_options', [])
         resource = Resource.objects.create(**validated_data)
 
-        for option_item in options_list:
-            ResourceOption.objects.update_or_create(
-                name=option_item['name'],
-                resource=resource,
-                defaults=option_item
-            )
+        self._set_options(resource, options_list)
 
         return resource
+
+    @staticmethod
+    def _set_options(resource, options_list):
+        for option_item in options_list:
+            name = option_item['name']
+
+            # format and journaling of the existing option are kept, if they are not given
+            saved_option = resource.get_option(name) if resource.has_option(name) else None
+
+            resource.set_option(name, option_item['value'],
+                                format=option_item.get('format', saved_option.format if saved_option else None),
+                                journaling=option_item.get('journaling',
+                                                           saved_option.journaling if saved_option else True))
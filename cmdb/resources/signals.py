@@ -0,0 +1,10 @@
+from __future__ import unicode_literals
+
+from django.dispatch import Signal
+
+# Sent by bulk_create_with_options(), that does not send post_save for each resource and option.
+resources_bulk_created = Signal(providing_args=['resources', 'options'])
+
+# Sent by the set-based cascade status changes, that update many resources with a single query.
+# changes is a list of tuples (resource_id, field_name, old_value, new_value).
+resources_bulk_updated = Signal(providing_args=['changes'])
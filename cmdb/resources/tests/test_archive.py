@@ -0,0 +1,79 @@
+from __future__ import unicode_literals
+
+import datetime
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from assets.models import Server, ServerPort, Rack
+from events.models import HistoryEvent
+from resources.models import Resource, ResourceOption, ResourceComment, ArchivedResource
+
+
+class ArchiveDeletedTest(TestCase):
+    def _deleted_days_ago(self, resources, days):
+        Resource.objects.filter(pk__in=[resource.id for resource in resources]).update(
+            status=Resource.STATUS_DELETED, updated_at=timezone.now() - datetime.timedelta(days=days))
+
+    def test_archive_deleted(self):
+        user = User.objects.create(username='admin')
+        rack = Rack.objects.create(name='rack1')
+        server = Server.objects.create(name='server1', parent=rack, label='web', rack_position=5)
+        port = ServerPort.objects.create(name='eth0', parent=server, mac='00:11:22:33:44:55')
+        ResourceComment.objects.create(resource=server, author=user, message='decommissioned')
+
+        recent_server = Server.objects.create(name='server2', parent=rack)
+        live_server = Server.objects.create(name='server3', parent=rack)
+
+        self._deleted_days_ago([rack, server, port], 100)
+        self._deleted_days_ago([recent_server], 10)
+
+        # rack is kept with the children, that are not archived
+        self.assertEqual(2, Resource.objects.archive_deleted(retention_days=90))
+
+        self.assertEqual(sorted([live_server.id, rack.id, recent_server.id]),
+                         sorted(Resource.objects.values_list('id', flat=True)))
+        self.assertEqual(sorted([port.id, server.id]), sorted(ArchivedResource.objects.values_list('id', flat=True)))
+        self.assertEqual(0, ResourceOption.objects.filter(resource_id=server.id).count())
+        self.assertEqual(0, ResourceComment.objects.count())
+
+        archived_server = ArchivedResource.objects.get(pk=server.id)
+        self.assertEqual(('server1', 'Server', rack.id), (archived_server.name, archived_server.type,
+                                                          archived_server.parent_id))
+        self.assertEqual('web', archived_server.get_option_values()['label'])
+        self.assertEqual(5, archived_server.get_option_values()['rack_position'])
+        self.assertEqual(['decommissioned'], [comment.message for comment in archived_server.comments.all()])
+
+        # history is kept
+        events = HistoryEvent.objects.filter(resource_id=server.id)
+        self.assertTrue(events.exists())
+        self.assertEqual(archived_server, events[0].get_resource())
+
+        self.assertEqual(0, Resource.objects.archive_deleted(retention_days=90))
+
+        live_server.delete()
+        self._deleted_days_ago([live_server], 100)
+        self.assertEqual(1, Resource.objects.archive_deleted(retention_days=90))
+        self.assertEqual(sorted([rack.id, recent_server.id]), sorted(Resource.objects.values_list('id', flat=True)))
+
+        self.assertEqual(2, Resource.objects.archive_deleted(retention_days=1))
+        self.assertEqual(0, Resource.objects.count())
+
+    def test_active_resources(self):
+        resource = Resource.objects.create(name='res1')
+        deleted_resource = Resource.objects.create(name='res2')
+        deleted_resource.delete()
+
+        self.assertEqual([resource.id], list(Resource.active.values_list('id', flat=True)))
+        self.assertEqual([deleted_resource.id], list(Resource.objects.filter(pk__live=False).values_list(
+            'id', flat=True)))
+
+        if connection.vendor == 'sqlite':
+            sql, params = Resource.active.filter(type='Server').query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN %s' % sql, params)
+                plan = ' '.join(unicode(row[-1]) for row in cursor.fetchall())
+
+            self.assertIn('resources_live_type', plan)
@@ -0,0 +1,78 @@
+from __future__ import unicode_literals
+
+import csv
+import json
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from assets.models import Server, ServerPort, Rack
+from resources.export import ResourceExporter
+from resources.models import Resource
+
+
+class ResourceExporterTest(TestCase):
+    def setUp(self):
+        self.rack = Rack.objects.create(name='rack1')
+        self.server = Server.objects.create(name='server1', parent=self.rack, label='web', rack_position=5)
+        self.port = ServerPort.objects.create(name='eth0', parent=self.server, mac='00:11:22:33:44:55')
+        self.other_server = Server.objects.create(name='server2', label='db')
+
+        self.deleted_server = Server.objects.create(name='server3', parent=self.rack)
+        self.deleted_server.delete()
+
+    def test_ndjson(self):
+        # resources and options of each chunk, the last chunk is empty
+        exporter = ResourceExporter(ResourceExporter.filter(), chunk_size=2)
+        with self.assertNumQueries(5):
+            lines = list(exporter.ndjson())
+
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([self.rack.id, self.server.id, self.port.id, self.other_server.id],
+                         [row['id'] for row in rows])
+        self.assertEqual({'label': 'web', 'rack_position': 5}, rows[1]['options'])
+        self.assertEqual(('Server', 'server1', Resource.STATUS_FREE, self.rack.id),
+                         (rows[1]['type'], rows[1]['name'], rows[1]['status'], rows[1]['parent_id']))
+
+    def test_filters(self):
+        def exported_ids(**kwargs):
+            return [row['id'] for row in ResourceExporter(ResourceExporter.filter(**kwargs)).rows()]
+
+        self.assertEqual([self.server.id, self.other_server.id], exported_ids(types=['Server']))
+        self.assertEqual([self.rack.id, self.server.id, self.port.id], exported_ids(subtree=self.rack))
+        self.assertEqual([self.server.id, self.port.id], exported_ids(subtree=self.server))
+        self.assertEqual([self.deleted_server.id], exported_ids(statuses=[Resource.STATUS_DELETED]))
+
+    def test_csv(self):
+        exporter = ResourceExporter(ResourceExporter.filter(types=['Server']), option_names=['label', 'mac'])
+        rows = list(csv.reader(StringIO(b''.join(exporter.csv()))))
+
+        self.assertEqual(list(ResourceExporter.FIELDS) + ['label', 'mac'], rows[0])
+        self.assertEqual([[unicode(self.server.id), 'server1', 'web', ''], [unicode(self.other_server.id),
+                                                                             'server2', 'db', '']],
+                         [[row[0], row[2], row[-2], row[-1]] for row in rows[1:]])
+
+        # all options are in the JSON column
+        exporter = ResourceExporter(ResourceExporter.filter(types=['ServerPort']))
+        rows = list(csv.reader(StringIO(b''.join(exporter.csv()))))
+
+        self.assertEqual('options', rows[0][-1])
+        self.assertEqual({'mac': self.port.mac}, json.loads(rows[1][-1]))
+
+    @override_settings(RESOURCES_OPTIONS_STORAGE='json')
+    def test_json_storage(self):
+        Resource.objects.migrate_options('json')
+
+        rows = list(ResourceExporter(ResourceExporter.filter(types=['Server']), option_names=['label']).rows())
+
+        self.assertEqual([{'label': 'web'}, {'label': 'db'}], [row['options'] for row in rows])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('cmdbctl', 'export', '--type', 'Server,ServerPort', '--subtree', str(self.server.id),
+                     stdout=out)
+
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([self.server.id, self.port.id], [row['id'] for row in rows])
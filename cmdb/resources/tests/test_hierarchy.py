@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from assets.models import Rack, Server, ServerPort, Datacenter
+from resources.iterators import PathIterator, TreeIterator
+from resources.models import Resource
+
+
+class HierarchyTestMixin(object):
+    def setUp(self):
+        self.dc1 = Datacenter.objects.create(name='dc1')
+        self.dc2 = Datacenter.objects.create(name='dc2')
+        self.rack1 = Rack.objects.create(name='rack1', parent=self.dc1)
+        self.rack2 = Rack.objects.create(name='rack2', parent=self.dc2)
+        self.server1 = Server.objects.create(name='server1', parent=self.rack1)
+        self.server2 = Server.objects.create(name='server2', parent=self.rack1)
+        self.port1 = ServerPort.objects.create(name='port1', parent=self.server1)
+
+    def test_move_subtree(self):
+        self.server1.parent = self.rack2
+        self.server1.save()
+
+        self.assertEqual(['rack2', 'server1', 'port1'],
+                         [res.name for res in self.rack2.filter_childs(Resource)])
+        self.assertEqual(['rack1', 'server2'], [res.name for res in self.rack1.filter_childs(Resource)])
+        self.assertEqual(['port1', 'server1', 'rack2', 'dc2'],
+                         [res.name for res in self.port1.filter_parents(Resource)])
+        self.assertEqual([self.dc2.id], [res.id for res in self.port1.filter_parents(Datacenter)])
+
+        port = Resource.objects.get(pk=self.port1.id)
+        self.assertEqual(3, port.level)
+        self.assertEqual(Resource.objects.get(pk=self.dc2.id).tree_id, port.tree_id)
+
+    def test_move_to_root(self):
+        self.rack1.parent = None
+        self.rack1.save()
+
+        self.assertEqual(['dc1'], [res.name for res in self.dc1.filter_childs(Resource)])
+        self.assertEqual(['port1', 'server1', 'rack1'], [res.name for res in self.port1.filter_parents(Resource)])
+        self.assertEqual(2, Resource.objects.get(pk=self.port1.id).level)
+
+    def test_iterators(self):
+        Server.objects.create(name='server3', parent=self.rack1).delete()
+
+        tree_iterator = TreeIterator(self.dc1)
+        self.assertEqual([('dc1', 1), ('rack1', 2), ('server1', 3), ('port1', 4), ('server2', 3)],
+                         [(res.name, tree_iterator.level) for res in tree_iterator])
+        self.assertEqual(['dc1', 'rack1', 'server1', 'port1'], [res.name for res in PathIterator(self.port1)])
+
+    def test_cascade_status(self):
+        self.dc1.lock(cascade=True)
+
+        self.assertEqual(5, len(Resource.active.filter(status=Resource.STATUS_LOCKED)))
+        self.assertEqual(Resource.STATUS_FREE, Resource.objects.get(pk=self.rack2.id).status)
+
+
+class MPTTHierarchyTest(HierarchyTestMixin, TestCase):
+    pass
+
+
+@override_settings(RESOURCES_HIERARCHY='cte')
+class RecursiveCTEHierarchyTest(HierarchyTestMixin, TestCase):
+    def test_move_does_not_shift_tree(self):
+        tree_fields = list(Resource.objects.exclude(pk=self.server2.id).order_by('id').values_list('lft', 'rght'))
+
+        self.server2.parent = self.rack2
+        self.server2.save()
+
+        self.assertEqual(tree_fields,
+                         list(Resource.objects.exclude(pk=self.server2.id).order_by('id').values_list('lft', 'rght')))
+
+        # nested sets are restored by rebuild()
+        Resource.objects.rebuild()
+        with self.settings(RESOURCES_HIERARCHY='mptt'):
+            self.assertEqual(['rack2', 'server2'], [res.name for res in self.rack2.filter_childs(Resource)])
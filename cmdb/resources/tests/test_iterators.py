@@ -1,5 +1,7 @@
 from __future__ import unicode_literals
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from resources.iterators import PathIterator, TreeIterator
 from resources.models import Resource
@@ -47,3 +49,27 @@ class ResourceTest(TestCase):
         self.assertEqual('res4', path_list[3].name)
         self.assertEqual('res5', path_list[4].name)
         self.assertEqual('res6', path_list[5].name)
+
+    def test_iterate_tree_levels(self):
+        res1 = Resource.objects.create(name='res1')
+        res2 = Resource.objects.create(name='res2', parent=res1)
+        res3 = Resource.objects.create(name='res3', parent=res2)
+        res4 = Resource.objects.create(name='res4', parent=res1)
+        res5 = Resource.objects.create(name='res5', parent=res4)
+        Resource.objects.create(name='res6', parent=res5)
+        res5.status = Resource.STATUS_DELETED
+        res5.save()
+
+        tree_iterator = TreeIterator(res1, ['name', 'opt1'])
+        with CaptureQueriesContext(connection) as queries:
+            path_list = [(node.name, tree_iterator.level) for node in tree_iterator]
+
+        # resources and options
+        self.assertEqual(2, len(queries))
+        self.assertEqual([('res1', 1), ('res2', 2), ('res3', 3), ('res4', 2)], path_list)
+
+        with CaptureQueriesContext(connection) as queries:
+            path_list = [node.name for node in PathIterator(res3)]
+
+        self.assertEqual(1, len(queries))
+        self.assertEqual(['res1', 'res2', 'res3'], path_list)
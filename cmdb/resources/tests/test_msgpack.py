@@ -0,0 +1,99 @@
+from __future__ import unicode_literals
+
+import msgpack
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from assets.models import Server, Rack
+from ipman.models import IPNetworkPool
+from resources.models import Resource
+from resources.renderers import MessagePackRenderer
+
+
+class MessagePackAPITests(APITestCase):
+    def setUp(self):
+        super(MessagePackAPITests, self).setUp()
+
+        user, created = User.objects.get_or_create(username='admin', password='admin', email='admin@admin.com',
+                                                   is_staff=True)
+        token, created = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+        self.rack = Rack.objects.create(name='rack1')
+        self.server = Server.objects.create(name='server1', parent=self.rack, label='web', rack_position=5)
+
+    @staticmethod
+    def unpack(response):
+        return msgpack.unpackb(response.content, encoding='utf-8')
+
+    def test_retrieve(self):
+        response = self.client.get('/v1/resources/%s/' % self.server.id, HTTP_ACCEPT='application/x-msgpack')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/x-msgpack', response['Content-Type'])
+
+        data = self.unpack(response)
+        self.assertEqual(self.server.id, data['id'])
+        self.assertEqual('server1', data['name'])
+        self.assertEqual({'label': 'web', 'rack_position': 5}, data['options'])
+        self.assertEqual(self.server.created_at.isoformat().replace('+00:00', 'Z'), data['created_at'])
+
+    def test_list_selected_options(self):
+        response = self.client.get('/v1/resources/?format=msgpack&name=server1&fields=id&options=rack_position')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{'id': self.server.id, 'options': {'rack_position': 5}}], self.unpack(response)['results'])
+
+    def test_json_is_default(self):
+        response = self.client.get('/v1/resources/%s/' % self.server.id)
+
+        self.assertEqual('application/json', response['Content-Type'])
+        self.assertEqual(['label', 'rack_position'], sorted(option['name'] for option in response.data['options']))
+
+    def test_create(self):
+        content = msgpack.packb({'name': 'server2', 'parent': self.rack.id, 'options': {'label': 'db', 'cores': 8, 'disks': {'sda': 100}}},
+                                use_bin_type=True)
+        response = self.client.post('/v1/resources/', content, content_type='application/x-msgpack',
+                                    HTTP_ACCEPT='application/x-msgpack')
+
+        self.assertEqual(201, response.status_code)
+        self.assertEqual({'label': 'db', 'cores': 8, 'disks': {'sda': 100}}, self.unpack(response)['options'])
+
+        resource = Resource.objects.get(name='server2')
+        self.assertEqual(self.rack.id, resource.parent_id)
+        self.assertEqual(8, resource.get_option_value('cores'))
+
+    def test_bulk(self):
+        content = msgpack.packb([
+            {'op': 'create', 'type': 'assets.Server', 'name': 'server2', 'options': {'label': 'db'}},
+            {'op': 'update', 'id': self.server.id, 'options': {'label': 'cache'}},
+        ], use_bin_type=True)
+        response = self.client.post('/v1/resources/bulk/', content, content_type='application/x-msgpack')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('db', Server.objects.get(name='server2').get_option_value('label'))
+        self.assertEqual('cache', Resource.objects.get(pk=self.server.id).get_option_value('label'))
+
+    def test_byte_strings(self):
+        # byte strings are packed as the str type, not as bin
+        content = MessagePackRenderer().render({'label': b'web', 'name': 'server1'})
+
+        self.assertEqual(msgpack.packb({'label': 'web', 'name': 'server1'}), content)
+        self.assertEqual({'label': 'web', 'name': 'server1'}, msgpack.unpackb(content, encoding='utf-8'))
+
+    def test_parse_error(self):
+        response = self.client.post('/v1/resources/', b'\xc1', content_type='application/x-msgpack')
+
+        self.assertEqual(400, response.status_code)
+
+    def test_ipman_rent(self):
+        ipnet = IPNetworkPool.objects.create(network='192.168.1.1/24')
+
+        response = self.client.get('/v1/ipman/rent?pool=%s&count=2&format=msgpack' % ipnet.id)
+
+        self.assertEqual(200, response.status_code)
+
+        data = self.unpack(response)
+        self.assertEqual(2, data['count'])
+        self.assertEqual(['192.168.1.2', '192.168.1.3'], [item['address'] for item in data['results']])
@@ -0,0 +1,171 @@
+from __future__ import unicode_literals
+
+from django.core.exceptions import FieldError
+from django.db import connection
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from assets.models import Server, Rack
+from events.models import HistoryEvent
+from ipman.models import IPNetworkPool, IPAddress, IPAddressPool
+from resources.models import Resource, ResourceOption, resource_session
+from resources.serializers import ResourceSerializer
+
+
+@override_settings(RESOURCES_OPTIONS_STORAGE='json')
+class JSONOptionStorageTest(TestCase):
+    def test_set_get_options(self):
+        resource = Resource.objects.create(name='res1', label='web', weight=1.5, on=False, specs={'cpu': 'xeon'})
+        resource.set_option('rack_position', '5', format=ResourceOption.FORMAT_INT)
+
+        self.assertEqual(0, ResourceOption.objects.count())
+
+        resource = Resource.objects.get(pk=resource.id)
+        self.assertEqual('web', resource.get_option_value('label'))
+        self.assertEqual(1.5, resource.get_option_value('weight'))
+        self.assertEqual(False, resource.get_option_value('on'))
+        self.assertEqual({'cpu': 'xeon'}, resource.get_option_value('specs'))
+        self.assertEqual(5, resource.get_option_value('rack_position'))
+        self.assertEqual(ResourceOption.FORMAT_INT, resource.get_option('rack_position').format)
+        self.assertEqual('default', resource.get_option_value('missing', default='default'))
+        self.assertEqual('rack_position', resource.get_options()[-1].name)
+
+        resource.delete_option('weight')
+        self.assertFalse(Resource.objects.get(pk=resource.id).has_option('weight'))
+
+    def test_filter(self):
+        server1 = Server.objects.create(name='server1', label='web', rack_position=10, on_rails=True)
+        server2 = Server.objects.create(name='server2', label='db', rack_position=2)
+        Resource.objects.create(name='res3', rack_position='10')
+
+        def ids(queryset):
+            return sorted(resource.id for resource in queryset)
+
+        self.assertEqual([server1.id], ids(Server.active.filter(label='web')))
+        self.assertEqual([server1.id], ids(Server.active.filter(rack_position=10)))
+        self.assertEqual([server1.id], ids(Server.active.filter(rack_position__gt=5.5)))
+        self.assertEqual([server1.id, server2.id], ids(Server.active.filter(rack_position__in=[2, 10])))
+        self.assertEqual([server1.id], ids(Server.active.filter(on_rails=True)))
+        self.assertEqual([server2.id], ids(Server.active.filter(label__startswith='d')))
+        self.assertEqual([server1.id], ids(Server.active.filter(Q(label__contains='e') | Q(label='none'))))
+        self.assertEqual([server2.id], ids(Server.active.filter(rack_position__range=(1, 5))))
+        self.assertEqual([server2.id], ids(Server.active.filter(label__iregex='^D')))
+
+        # strings are also matched with the typed values, as the option rows are matched by the value string
+        self.assertEqual([server1.id], ids(Server.active.filter(rack_position='10')))
+        self.assertEqual([server1.id], ids(Server.active.filter(on_rails='True')))
+
+        # resources without the option are excluded too
+        self.assertEqual([server2.id], ids(Server.active.exclude(on_rails=True)))
+
+        # option fields and the lookups, that the typed values don't have, are not supported
+        self.assertRaisesMessage(FieldError, "option field 'format'", lambda: Resource.objects.filter(format='int'))
+        self.assertRaisesMessage(FieldError, "Lookup 'year' of the option 'label'",
+                                 lambda: Server.active.filter(label__year=2015))
+        self.assertRaises(FieldError, lambda: Server.active.exclude(label__isnull=True))
+
+    def test_stale_instance_save(self):
+        resource = Resource.objects.create(name='res1', label='web')
+        stale_resource = Resource.objects.get(pk=resource.id)
+
+        resource.set_option('label', 'db')
+        stale_resource.name = 'res2'
+        stale_resource.save()
+
+        resource = Resource.objects.get(pk=resource.id)
+        self.assertEqual('res2', resource.name)
+        self.assertEqual('db', resource.get_option_value('label'))
+
+    def test_history(self):
+        resource = Resource.objects.create(name='res1', label='web')
+        self.assertEqual(1, HistoryEvent.objects.filter(resource=resource, field_name='label').count())
+
+        resource.set_option('label', 'web')
+        resource.set_option('label', 'db')
+        resource.set_option('heartbeat', 1, journaling=False)
+
+        events = list(HistoryEvent.objects.filter(resource=resource, type=HistoryEvent.UPDATE).order_by('id'))
+        self.assertEqual([('label', None, 'web'), ('label', 'web', 'db')],
+                         [(event.field_name, event.field_old_value, event.field_new_value) for event in events])
+
+    def test_resource_session(self):
+        resource1 = Resource.objects.create(name='res1', opt1='value1')
+        resource2 = Resource.objects.create(name='res2')
+
+        with resource_session():
+            for idx in range(10):
+                resource1.set_option('counter', idx)
+                resource2.set_option('counter', idx)
+
+            # other instance of the same resource
+            Resource.objects.get(pk=resource1.id).set_option('opt2', 'value2')
+
+            self.assertEqual(0, Resource.objects.get(pk=resource1.id).get_option_value('counter', default=0))
+
+        resource1 = Resource.objects.get(pk=resource1.id)
+        self.assertEqual('value1', resource1.get_option_value('opt1'))
+        self.assertEqual('value2', resource1.get_option_value('opt2'))
+        self.assertEqual(9, resource1.get_option_value('counter'))
+        self.assertEqual(9, Resource.objects.get(pk=resource2.id).get_option_value('counter'))
+        self.assertEqual(1, HistoryEvent.objects.filter(resource=resource1, field_name='counter').count())
+
+    def test_bulk_read_paths(self):
+        rack = Rack.objects.create(name='rack1')
+        servers = Server.objects.bulk_create_with_options(Server, [
+            dict(name='server%s' % idx, parent=rack, label='web', position=idx) for idx in range(1, 4)])
+
+        self.assertEqual([('server1', 'web', 1), ('server2', 'web', 2), ('server3', 'web', 3)],
+                         list(Server.active.filter(label='web').order_by('id').values_list_with_options(
+                             'name', 'label', 'rack_position')))
+        self.assertEqual({servers[0].id: {'rack_position': 1}, 0: {}},
+                         ResourceOption.objects.decoded_by_resource([servers[0].id, 0], names=['rack_position']))
+
+        pool = IPNetworkPool.objects.create(network='192.168.0.0/30')
+        IPAddress.objects.create(address='192.168.0.2', parent=pool, status=Resource.STATUS_INUSE)
+        self.assertEqual({pool.id: 25}, IPAddressPool.get_usages([pool]))
+        self.assertEqual(25, pool.get_usage())
+
+    def test_serializer(self):
+        resource = Resource.objects.create(name='res1', label='web', rack_position=5)
+
+        options = ResourceSerializer(Resource.objects.get(pk=resource.id)).data['options']
+
+        self.assertEqual([('label', 'web', 'string'), ('rack_position', '5', 'int')],
+                         sorted((option['name'], option['value'], option['format']) for option in options))
+
+    def test_migrate_options(self):
+        with override_settings(RESOURCES_OPTIONS_STORAGE='rows'):
+            resource = Server.objects.create(name='server1', label='web', rack_position=5)
+            self.assertEqual(2, ResourceOption.objects.count())
+
+        self.assertEqual(1, Resource.objects.migrate_options('json'))
+        self.assertEqual(0, ResourceOption.objects.count())
+        self.assertEqual(5, Server.active.get(label='web').get_option_value('rack_position'))
+
+        self.assertEqual(1, Resource.objects.migrate_options('rows'))
+        with override_settings(RESOURCES_OPTIONS_STORAGE='rows'):
+            self.assertEqual(2, ResourceOption.objects.count())
+            self.assertEqual([resource.id], [server.id for server in Server.active.filter(rack_position=5)])
+
+    def test_migrate_selected_resources(self):
+        with override_settings(RESOURCES_OPTIONS_STORAGE='rows'):
+            server1 = Server.objects.create(name='server1', label='web')
+            server2 = Server.objects.create(name='server2', label='db')
+
+        self.assertEqual(1, Resource.objects.migrate_options('json', resources=Resource.objects.filter(name='server1')))
+        self.assertEqual([server2.id], list(ResourceOption.objects.values_list('resource', flat=True)))
+        self.assertIn('web', QuerySet(Resource).get(pk=server1.id).options_data)
+
+    def test_option_indexes(self):
+        Resource.objects.create_option_indexes(['mac'])
+        Resource.objects.create_option_indexes(['mac'])
+
+        if connection.vendor == 'sqlite':
+            sql, params = Resource.objects.filter(mac='00:11').query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN %s' % sql, params)
+                plan = ' '.join(unicode(row[-1]) for row in cursor.fetchall())
+
+            self.assertIn('resources_option_', plan)
@@ -0,0 +1,118 @@
+from __future__ import unicode_literals
+
+from django.db import transaction
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+
+from assets.models import Server, Rack
+from ipman.models import IPNetworkPool, IPAddressPool
+from resources.models import Resource, OptionKey
+from resources.querycache import get_query_cache, LocMemLRUBackend
+
+
+@override_settings(RESOURCES_QUERY_CACHE={'OPTIONS': {'max_entries': 100}})
+class QueryCacheTest(TransactionTestCase):
+    def setUp(self):
+        self.rack = Rack.objects.create(name='rack1')
+        self.server1 = Server.objects.create(name='server1', parent=self.rack, role='hypervisor')
+        self.server2 = Server.objects.create(name='server2', parent=self.rack)
+        self.pool = IPNetworkPool.objects.create(network='192.168.0.0/24', status=Resource.STATUS_FREE)
+
+        self.query_cache = get_query_cache()
+        self.query_cache.clear()
+
+    def tearDown(self):
+        OptionKey.clear_cache()
+
+    def test_cached_results(self):
+        self.assertEqual([self.server1.id, self.server2.id], [res.id for res in Server.active.order_by('id')])
+        self.assertEqual(dict(hits=0, misses=1), self.query_cache.stats())
+
+        with self.assertNumQueries(1):
+            servers = list(Server.active.order_by('id'))
+        self.assertEqual([self.server1.id, self.server2.id], [res.id for res in servers])
+        self.assertEqual(Server, servers[0].__class__)
+        self.assertEqual(dict(hits=1, misses=1), self.query_cache.stats())
+
+        self.assertEqual([self.server1.id], [res.id for res in Server.active.filter(role='hypervisor')])
+        self.assertEqual([self.server1.id], [res.id for res in Server.active.filter(role='hypervisor')])
+        self.assertEqual(dict(hits=2, misses=2), self.query_cache.stats())
+
+    def test_invalidation_by_type(self):
+        pools = Resource.active.filter(type__in=IPAddressPool.ip_pool_types)
+        self.assertEqual([self.pool.id], [res.id for res in pools.all()])
+
+        # changes of the other types keep the results
+        Server.objects.create(name='server3', parent=self.rack)
+        self.assertEqual([self.pool.id], [res.id for res in pools.all()])
+        self.assertEqual(1, self.query_cache.hits)
+
+        self.pool.use()
+        self.assertEqual([], [res.id for res in pools.filter(status=Resource.STATUS_FREE)])
+
+        pool2 = IPNetworkPool.objects.create(network='192.168.1.0/24')
+        self.assertEqual({self.pool.id, pool2.id}, {res.id for res in pools.all()})
+
+        pool2.delete()
+        self.assertEqual([self.pool.id], [res.id for res in pools.all()])
+
+    def test_invalidation_by_options(self):
+        self.assertEqual([self.server1.id], [res.id for res in Server.active.filter(role='hypervisor')])
+
+        Resource.objects.get(pk=self.server2.id).set_option('role', 'hypervisor')
+        self.assertEqual({self.server1.id, self.server2.id},
+                         {res.id for res in Server.active.filter(role='hypervisor')})
+
+        self.rack.lock(cascade=True)
+        self.assertEqual(2, len(Server.active.filter(status=Resource.STATUS_LOCKED)))
+
+    def test_not_cached_queries(self):
+        list(self.rack.filter_childs(Server))
+        list(Resource.active.filter(parent__name='rack1'))
+        list(Resource.active.order_by('lft'))
+
+        self.assertEqual(dict(hits=0, misses=0), self.query_cache.stats())
+
+    def test_transaction(self):
+        list(Server.active.all())
+
+        with transaction.atomic():
+            Server.objects.create(name='server3', parent=self.rack)
+            self.assertEqual(3, len(Server.active.all()))
+            self.assertEqual(dict(hits=0, misses=1), self.query_cache.stats())
+
+        self.assertEqual(3, len(Server.active.all()))
+        self.assertEqual(dict(hits=0, misses=2), self.query_cache.stats())
+
+    def test_lru_backend(self):
+        backend = LocMemLRUBackend(max_entries=2)
+        backend.set('a', [1])
+        backend.set('b', [2])
+        backend.get('a')
+        backend.set('c', [3])
+
+        self.assertEqual([1], backend.get('a'))
+        self.assertIsNone(backend.get('b'))
+
+        generation = backend.incr_generation('type')
+        self.assertEqual({'type': generation}, backend.get_generations(['type', 'other']))
+        self.assertEqual(generation + 1, backend.incr_generation('type'))
+
+    def test_change_counters(self):
+        counters = self.query_cache
+        server_counters = counters.get_counters(['Server'])
+        rack_counters = counters.get_counters(['Rack'])
+        any_counters = counters.get_counters()
+
+        self.server1.set_option('role', 'storage')
+
+        self.assertNotEqual(server_counters, counters.get_counters(['Server']))
+        self.assertEqual(rack_counters, counters.get_counters(['Rack']))
+        self.assertNotEqual(any_counters, counters.get_counters())
+
+        # counters read in the transaction are bumped after the commit
+        with transaction.atomic():
+            self.server2.delete()
+            server_counters = counters.get_counters(['Server'])
+
+        self.assertNotEqual(server_counters, counters.get_counters(['Server']))
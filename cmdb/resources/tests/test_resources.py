@@ -2,11 +2,15 @@
 from __future__ import unicode_literals
 
 from django.core.exceptions import ValidationError
+from django.db import connection, transaction, DatabaseError
+from django.db.models import Q
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-from assets.models import VirtualServer, RegionResource, Datacenter, Server, Rack
-from ipman.models import IPNetworkPool
-from resources.models import Resource, ResourceOption, ModelFieldChecker
+from assets.models import VirtualServer, RegionResource, Datacenter, Server, Rack, ServerPort
+from ipman.models import IPNetworkPool, IPAddress
+from resources.models import Resource, ResourceOption, ModelFieldChecker, OptionKey, resource_session, \
+    resource_identity_map
 
 
 class ResourceTest(TestCase):
@@ -133,6 +137,365 @@ class ResourceTest(TestCase):
         found4 = Resource.active.filter(somekey='someval')
         self.assertEqual(2, len(found4))
 
+    def test_find_by_options_no_distinct(self):
+        Resource.objects.create(somekey1='someval1', somekey2='someval2', somekey3='someval3')
+
+        query_set = Resource.active.filter(somekey1='someval1', somekey2='someval2', somekey3__contains='val')
+
+        self.assertEqual(1, len(query_set))
+        self.assertNotIn('DISTINCT', unicode(query_set.query))
+
+    def test_exclude_and_q_by_options(self):
+        new_res1 = Resource.objects.create(name='res1', somekey1='someval1', somekey='someval')
+        new_res2 = Resource.objects.create(name='res2', somekey1='someval2', somekey='someval')
+        new_res3 = Resource.objects.create(name='res3', somekey1='someval3')
+
+        found1 = Resource.active.exclude(somekey1='someval1').order_by('id')
+        self.assertEqual([new_res2.id, new_res3.id], [res.id for res in found1])
+
+        found2 = Resource.active.filter(somekey='someval').exclude(somekey1__in=['someval1', 'someval3'])
+        self.assertEqual([new_res2.id], [res.id for res in found2])
+
+        found3 = Resource.active.filter(Q(somekey1='someval1') | Q(somekey1='someval3')).order_by('id')
+        self.assertEqual([new_res1.id, new_res3.id], [res.id for res in found3])
+
+        found4 = Resource.active.filter(Q(name='res3') | Q(somekey1='someval2'), ~Q(somekey='someval')).order_by('id')
+        self.assertEqual([new_res3.id], [res.id for res in found4])
+
+        self.assertEqual(new_res2.id, Resource.active.get(Q(somekey1='someval2')).id)
+
+    def test_typed_option_values(self):
+        res1 = Resource.objects.create(name='res1')
+        res1.set_option('position', 9)
+        res1.set_option('usage', 95.5)
+        res1.set_option('on_rails', True)
+        res1.set_option('label', 'x' * 100)
+
+        option = res1.get_option('position')
+        self.assertEqual(9, option.value_int)
+        self.assertEqual(9.0, option.value_float)
+        self.assertEqual('9', option.value_prefix)
+
+        option = ResourceOption.objects.get(resource=res1, name='on_rails')
+        self.assertEqual(True, option.value_bool)
+        self.assertEqual(None, option.value_int)
+
+        option = ResourceOption.objects.get(resource=res1, name='label')
+        self.assertEqual(ResourceOption.VALUE_PREFIX_LENGTH, len(option.value_prefix))
+
+        res1.set_option('position', 'top')
+        option = ResourceOption.objects.get(resource=res1, name='position')
+        self.assertEqual(None, option.value_int)
+        self.assertEqual('top', option.value_prefix)
+
+        ResourceOption.objects.bulk_create([ResourceOption(resource=res1, name='rack_size', value=42,
+                                                                format=ResourceOption.FORMAT_INT)])
+        self.assertEqual(42, ResourceOption.objects.get(resource=res1, name='rack_size').value_int)
+
+    def test_option_keys(self):
+        res1 = Resource.objects.create(name='res1', somekey='someval1')
+        res2 = Resource.objects.create(name='res2', somekey='someval2', otherkey='otherval')
+
+        self.assertEqual(2, OptionKey.objects.count())
+        self.assertEqual(res1.get_option('somekey').key_id, res2.get_option('somekey').key_id)
+        self.assertEqual('somekey', OptionKey.get_name(res1.get_option('somekey').key_id))
+
+        # names are resolved from the cache
+        options = list(ResourceOption.objects.filter(resource=res2).order_by('name'))
+        with self.assertNumQueries(0):
+            self.assertEqual(['otherkey', 'somekey'], [option.name for option in options])
+
+        self.assertEqual(2, ResourceOption.objects.filter(name='somekey').count())
+        self.assertEqual(1, ResourceOption.objects.filter(name__startswith='other').count())
+        self.assertEqual(1, ResourceOption.objects.exclude(Q(name='somekey')).count())
+
+        option, created = ResourceOption.objects.update_or_create(resource=res1, name='otherkey',
+                                                                   defaults=dict(value='otherval1'))
+        self.assertTrue(created)
+        self.assertEqual(res2.get_option('otherkey').key_id, option.key_id)
+        self.assertEqual('otherval1', Resource.objects.get(pk=res1.id).get_option_value('otherkey'))
+
+    def test_option_key_ids_cache(self):
+        self.addCleanup(OptionKey.clear_cache)
+
+        # key, committed by the other transaction, is cached
+        committed_key = OptionKey.objects.create(name='committedkey')
+        self.assertEqual(committed_key.id, OptionKey.get_id('committedkey'))
+        with self.assertNumQueries(0):
+            self.assertEqual(committed_key.id, OptionKey.get_id('committedkey'))
+
+        # key, created in the rolled back transaction, is not cached
+        try:
+            with transaction.atomic():
+                OptionKey.get_id('rolledbackkey')
+                raise DatabaseError()
+        except DatabaseError:
+            pass
+
+        key_id = OptionKey.get_id('rolledbackkey')
+        self.assertTrue(OptionKey.objects.filter(id=key_id, name='rolledbackkey').exists())
+
+    def test_find_by_typed_options(self):
+        res1 = Resource.objects.create(name='res1', position=9, usage=95.5, on_rails=True, label='x' * 100)
+        res2 = Resource.objects.create(name='res2', position=10, usage=40, on_rails=False, label='x' * 99)
+
+        # numbers are compared as numbers, not strings
+        self.assertEqual([res2.id], [res.id for res in Resource.active.filter(position__gt=9)])
+        self.assertEqual([res1.id], [res.id for res in Resource.active.filter(position__lt=10)])
+        self.assertEqual([res1.id], [res.id for res in Resource.active.filter(usage__gte=95)])
+        self.assertEqual([res2.id], [res.id for res in Resource.active.filter(usage__lt=50.0)])
+        self.assertEqual([res2.id], [res.id for res in Resource.active.filter(position__range=(10, 20))])
+        self.assertEqual(2, len(Resource.active.filter(position__in=[9, 10])))
+
+        self.assertEqual([res1.id], [res.id for res in Resource.active.filter(on_rails=True)])
+        self.assertEqual([res2.id], [res.id for res in Resource.active.exclude(on_rails=True)])
+
+        # long strings are found by the prefix and checked by the whole value
+        self.assertEqual([res1.id], [res.id for res in Resource.active.filter(label='x' * 100)])
+        self.assertEqual(2, len(Resource.active.filter(label__startswith='x' * 99)))
+
+        query = unicode(Resource.active.filter(position__gt=9, label='x').query)
+        self.assertIn('value_float', query)
+        self.assertIn('value_prefix', query)
+
+        # options stored in the other format are matched by the value string
+        res3 = Resource.objects.create(name='res3')
+        res3.set_option('position', '11', format=ResourceOption.FORMAT_STRING)
+        self.assertEqual([res3.id], [res.id for res in Resource.active.filter(position=11)])
+        self.assertEqual([res2.id, res3.id], sorted(res.id for res in Resource.active.filter(position__in=[10, 11])))
+
+    def test_bulk_create_with_options(self):
+        rack1 = Rack.objects.create(name='rack1')
+        rack2 = Rack.objects.create(name='rack2')
+        Server.objects.create(name='srv0', parent=rack1, label='srv0')
+
+        rows = [dict(name='srv%s' % idx, parent=rack1 if idx % 2 else rack2, label='label%s' % idx,
+                     on_rails=True, somekey=idx) for idx in range(1, 11)]
+        rows.append(dict(name='srv11', label='root'))
+
+        servers = Resource.objects.bulk_create_with_options('assets.Server', rows, batch_size=4)
+        self.assertEqual(11, len(servers))
+
+        server = Resource.active.get(label='label3')
+        self.assertIsInstance(server, Server)
+        self.assertEqual(servers[2].id, server.id)
+        self.assertEqual(rack1.id, server.parent_id)
+        self.assertEqual(True, server.on_rails)
+        self.assertEqual(3, server.get_option_value('somekey'))
+        self.assertEqual(10, len(Server.active.filter(on_rails=True)))
+        self.assertEqual(None, Resource.active.get(label='root').parent_id)
+
+        # MPTT fields are the same as the rebuilt ones
+        tree_fields = list(Resource.objects.order_by('id').values_list('tree_id', 'lft', 'rght', 'level'))
+        Resource.objects.rebuild()
+        self.assertEqual(tree_fields, list(Resource.objects.order_by('id').values_list('tree_id', 'lft', 'rght',
+                                                                                      'level')))
+        self.assertEqual(6, len(list(Resource.active.get(pk=rack1.id))))
+
+    def assert_bulk_tree(self, rows):
+        """
+        Creates the servers in bulk and checks, that the tree fields are the same as the rebuilt ones.
+        """
+        servers = Resource.objects.bulk_create_with_options('assets.Server', rows)
+
+        tree_fields = list(Resource.objects.order_by('id').values_list('tree_id', 'lft', 'rght', 'level'))
+        Resource.objects.rebuild()
+        self.assertEqual(tree_fields, list(Resource.objects.order_by('id').values_list('tree_id', 'lft', 'rght',
+                                                                                      'level')))
+        for server, row in zip(servers, rows):
+            self.assertEqual(row['parent'].id, Resource.objects.get(pk=server.id).parent_id)
+
+    @staticmethod
+    def descendant_names(resource):
+        return sorted(res.name for res in Resource.objects.get(pk=resource.id).get_descendants())
+
+    def test_bulk_create_with_sibling_parents(self):
+        dc = Datacenter.objects.create(name='dc')
+        rack1 = Rack.objects.create(name='rack1', parent=dc)
+        rack2 = Rack.objects.create(name='rack2', parent=dc)
+
+        self.assert_bulk_tree([dict(name='srv1', parent=rack2), dict(name='srv2', parent=rack1)])
+        self.assert_bulk_tree([dict(name='srv3', parent=rack1), dict(name='srv4', parent=rack2),
+                               dict(name='srv5', parent=rack1)])
+
+        self.assertEqual(['srv2', 'srv3', 'srv5'], self.descendant_names(rack1))
+        self.assertEqual(['srv1', 'srv4'], self.descendant_names(rack2))
+        self.assertEqual(7, len(self.descendant_names(dc)))
+
+    def test_bulk_create_with_nested_parents(self):
+        dc = Datacenter.objects.create(name='dc')
+        rack = Rack.objects.create(name='rack', parent=dc)
+
+        self.assert_bulk_tree([dict(name='srv1', parent=rack), dict(name='srv2', parent=dc)])
+        self.assert_bulk_tree([dict(name='srv3', parent=dc), dict(name='srv4', parent=rack)])
+
+        self.assertEqual(['srv1', 'srv4'], self.descendant_names(rack))
+        self.assertEqual(['rack', 'srv1', 'srv2', 'srv3', 'srv4'], 
+                         sorted(res.name for res in Resource.objects.get(pk=dc.id).get_descendants()))
+
+    def test_delay_mptt_updates(self):
+        rack1 = Rack.objects.create(name='rack1')
+        rack2 = Rack.objects.create(name='rack2')
+        rack3 = Rack.objects.create(name='rack3')
+        Server.objects.create(name='srv0', parent=rack3)
+        servers = [Server.objects.create(name='srv%s' % idx, parent=rack1) for idx in range(1, 5)]
+        rack3_fields = list(Resource.objects.filter(tree_id=rack3.tree_id).values_list('id', 'lft', 'rght'))
+
+        with Resource.objects.delay_mptt_updates():
+            servers[0].parent = rack2
+            servers[0].save()
+            servers[1].parent = None
+            servers[1].save()
+            servers[2].touch()
+            Server.objects.create(name='srv5', parent=rack2)
+            Server.objects.create(name='srv6')
+
+            self.assertEqual(set([rack1.tree_id, rack2.tree_id, 0]), Resource.objects.changed_tree_ids())
+
+        rack2 = Resource.objects.get(pk=rack2.id)
+        self.assertEqual(['srv1', 'srv5'], [server.name for server in rack2.filter_childs(Server).order_by('lft')])
+        self.assertEqual(2, len(Resource.objects.get(pk=rack1.id).filter_childs(Server)))
+        self.assertEqual(rack3_fields,
+                         list(Resource.objects.filter(tree_id=rack3.tree_id).values_list('id', 'lft', 'rght')))
+
+        # partial rebuild gives the same trees as the full one
+        def get_trees():
+            trees = {}
+            for resource_id, tree_id, lft, rght, level in Resource.objects.values_list(
+                    'id', 'tree_id', 'lft', 'rght', 'level'):
+                trees.setdefault(tree_id, set()).add((resource_id, lft, rght, level))
+            return sorted(trees.values())
+
+        trees = get_trees()
+        self.assertEqual(5, len(trees))
+        Resource.objects.rebuild()
+        self.assertEqual(trees, get_trees())
+
+    def test_resource_session(self):
+        resource1 = Resource.objects.create(name='res1', opt1='value1', opt2='value2')
+        resource2 = Resource.objects.create(name='res2')
+
+        with CaptureQueriesContext(connection) as queries:
+            with resource_session():
+                for idx in range(10):
+                    resource1.set_option('opt1', 'value1-%s' % idx)
+                    resource1.set_option('counter', idx)
+                    resource2.set_option('counter', idx)
+                    resource1.save()
+
+                resource1.set_option('opt2', 'value2')
+                resource1.status = Resource.STATUS_INUSE
+                resource1.save()
+
+                # buffered values are visible from the instance, not from the database
+                self.assertEqual('value1-9', resource1.get_option_value('opt1'))
+                self.assertEqual(9, resource2.get_option_value('counter'))
+                self.assertEqual('value1', Resource.objects.get(pk=resource1.id).get_option_value('opt1'))
+
+            # repeated writes are merged, unchanged opt2 is not written
+            self.assertEqual(1, len([query for query in queries if 'UPDATE "resource_options"' in query['sql']]))
+            self.assertEqual(1, len([query for query in queries if 'INSERT INTO "resource_options"' in query['sql']]))
+            self.assertEqual(1, len([query for query in queries if 'INSERT INTO "resource_history"' in query['sql']]))
+
+        resource1 = Resource.objects.get(pk=resource1.id)
+        self.assertEqual(Resource.STATUS_INUSE, resource1.status)
+        self.assertEqual('value1-9', resource1.get_option_value('opt1'))
+        self.assertEqual(9, resource1.get_option_value('counter'))
+        self.assertEqual(ResourceOption.FORMAT_INT, resource1.get_option('counter').format)
+        self.assertEqual(9, Resource.objects.get(pk=resource2.id).get_option_value('counter'))
+        self.assertEqual(1, len(Resource.active.filter(counter__gte=9, opt1='value1-9')))
+
+        # changes are discarded on exception
+        try:
+            with resource_session():
+                resource1.set_option('opt1', 'discarded')
+                resource1.status = Resource.STATUS_FREE
+                resource1.save()
+
+                with resource_session():
+                    resource1.set_option('opt2', 'discarded')
+
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual('value1-9', resource1.get_option_value('opt1'))
+        resource1 = Resource.objects.get(pk=resource1.id)
+        self.assertEqual(Resource.STATUS_INUSE, resource1.status)
+        self.assertEqual('value1-9', resource1.get_option_value('opt1'))
+        self.assertEqual('value2', resource1.get_option_value('opt2'))
+
+    def test_cascade_status(self):
+        rack = Rack.objects.create(name='rack')
+        pool = IPNetworkPool.objects.create(network='192.168.0.0/24')
+        for idx in range(1, 11):
+            server = Server.objects.create(name='server%s' % idx, parent=rack, status=Resource.STATUS_INUSE)
+            ip = IPAddress.objects.create(address='192.168.0.%s' % idx, parent=pool)
+            ip.parent = server
+            ip.use()
+        deleted_server = Server.objects.create(name='deleted', parent=rack)
+        deleted_server.delete()
+
+        with CaptureQueriesContext(connection) as queries:
+            rack.lock(cascade=True)
+        # descendants and the rack itself
+        self.assertEqual(2, len([query for query in queries if 'UPDATE "resources"' in query['sql']]))
+
+        self.assertEqual(21, len(Resource.active.filter(tree_id=rack.tree_id, status=Resource.STATUS_LOCKED)))
+        self.assertEqual(Resource.STATUS_DELETED, Resource.objects.get(pk=deleted_server.id).status)
+
+        last_seen = Resource.active.get(name='server1').last_seen
+        rack.touch(cascade=True)
+        self.assertLess(last_seen, Resource.active.get(name='server1').last_seen)
+        self.assertLess(last_seen, Resource.active.get(address='192.168.0.1').last_seen)
+
+        # touched descendants are changed for the conditional requests
+        server = Resource.active.get(name='server1')
+        self.assertEqual(server.last_seen, server.updated_at)
+        self.assertEqual(rack.last_seen, server.last_seen)
+
+        # IPAddress.free() is called for each IP, IPs are returned to the pool
+        rack.free(cascade=True)
+        self.assertEqual(11, len(Resource.active.filter(tree_id=rack.tree_id, status=Resource.STATUS_FREE)))
+        self.assertEqual(10, len(IPAddress.active.filter(parent=pool, status=Resource.STATUS_FREE)))
+
+    def test_identity_map(self):
+        rack = Rack.objects.create(name='rack')
+        server = Server.objects.create(name='server', parent=rack)
+        ports = [ServerPort.objects.create(name='port%s' % idx, parent=server) for idx in range(3)]
+
+        self.assertIsNot(Resource.objects.get(pk=rack.id), Resource.objects.get(pk=rack.id))
+
+        with resource_identity_map():
+            loaded_rack = Resource.active.get(pk=rack.id)
+            self.assertIsInstance(loaded_rack, Rack)
+            self.assertIs(loaded_rack, Rack.objects.get(pk=str(rack.id)))
+            self.assertRaises(Server.DoesNotExist, Server.active.get, pk=rack.id)
+
+            with CaptureQueriesContext(connection) as queries:
+                self.assertIs(loaded_rack, Resource.active.get(pk=rack.id))
+            self.assertEqual(0, len(queries))
+
+            loaded_ports = [Resource.active.get(pk=port.id) for port in ports]
+            loaded_server = loaded_ports[0].typed_parent
+            with CaptureQueriesContext(connection) as queries:
+                for port in loaded_ports:
+                    self.assertIs(loaded_server, port.typed_parent)
+                    self.assertIs(loaded_server, Resource.objects.get(pk=server.id))
+                self.assertIs(loaded_rack, loaded_server.parent)
+            self.assertEqual(0, len(queries))
+
+            # saved instance replaces the loaded one
+            server.name = 'server1'
+            server.save()
+            self.assertIs(server, Resource.active.get(pk=server.id))
+
+            rack.lock(cascade=True)
+            self.assertEqual(Resource.STATUS_LOCKED, Resource.active.get(pk=ports[0].id).status)
+
+            ports[1].delete()
+            self.assertRaises(Resource.DoesNotExist, Resource.active.get, pk=ports[1].id)
+
     def test_delete(self):
         resource1 = Resource()
         resource1.save()
@@ -332,6 +695,66 @@ class ResourceTest(TestCase):
 
         self.assertEqual('value_2_ed', resource2.get_option_value('nst_field'))
 
+    def test_options_cache(self):
+        resource1 = Resource.objects.create(somekey1='someval1', somekey2='someval2')
+        resource1 = Resource.objects.get(pk=resource1.id)
+
+        # all options are loaded at once
+        with self.assertNumQueries(1):
+            self.assertEqual('someval1', resource1.get_option_value('somekey1'))
+            self.assertEqual('someval2', resource1.get_option_value('somekey2'))
+            self.assertEqual(True, resource1.has_option('somekey1'))
+            self.assertEqual(False, resource1.has_option('somekey3'))
+            self.assertEqual(2, len(resource1.get_options()))
+
+        # cache is updated on set_option
+        resource1.set_option('somekey1', 'someval1_ed')
+        resource1.set_option('somekey3', 'someval3')
+        with self.assertNumQueries(0):
+            self.assertEqual('someval1_ed', resource1.get_option_value('somekey1'))
+            self.assertEqual('someval3', resource1.get_option_value('somekey3'))
+
+        # and on option delete
+        resource1.get_option('somekey3').delete()
+        self.assertEqual(False, resource1.has_option('somekey3'))
+        self.assertEqual(2, len(ResourceOption.objects.filter(resource=resource1)))
+
+        resource1 = Resource.objects.get(pk=resource1.id)
+        self.assertEqual('someval1_ed', resource1.get_option_value('somekey1'))
+        self.assertEqual('', resource1.get_option_value('somekey3'))
+
+    def test_prefetch_options(self):
+        self._create_test_resources(5)
+
+        resources = list(Resource.objects.filter().prefetch_options())
+        self.assertEqual(5, len(resources))
+
+        with self.assertNumQueries(0):
+            for resource in resources:
+                self.assertEqual('value_3', resource.get_option_value('field_3'))
+                self.assertEqual(5, len(resource.get_options()))
+
+    def test_leaf_class_casting(self):
+        Server.objects.create(name='srv1')
+        Rack.objects.create(name='rack1')
+        IPNetworkPool.objects.create(network='192.168.0.0/23')
+        Resource.objects.create(name='res1')
+
+        # single query to get all the typed resources
+        with self.assertNumQueries(1):
+            resources = list(Resource.objects.filter().order_by('id'))
+
+        self.assertEqual([Server, Rack, IPNetworkPool, Resource], [res.__class__ for res in resources])
+        self.assertEqual('192.168.0.0/23', unicode(resources[2]))
+
+        with self.assertNumQueries(1):
+            rack = Resource.objects.get(name='rack1')
+        self.assertEqual(Rack, rack.__class__)
+
+        with self.assertNumQueries(1):
+            server = Resource.objects.filter(name='srv1')[0]
+        self.assertEqual(Server, server.__class__)
+
     def test_proxy_models(self):
         resource1 = Resource()
         resource1.status = Resource.STATUS_FREE
@@ -365,6 +788,41 @@ class ResourceTest(TestCase):
         self.assertEqual(10, len(Resource.objects.filter(status=Resource.STATUS_FREE)))
         self.assertEqual(10, len(Resource.objects.filter(status=Resource.STATUS_DELETED)))
 
+    def test_values_with_options(self):
+        rack = Rack.objects.create(name='rack1')
+        server1 = Server.objects.create(name='server1', parent=rack, rack_position=5, label='web', on=True,
+                                        specs={'cpu': 'xeon'})
+        server2 = Server.objects.create(name='server2', parent=rack)
+
+        with self.assertNumQueries(1):
+            rows = list(Server.active.filter(parent=rack).order_by('id').values_list_with_options(
+                'id', 'status', 'rack_position', 'label', 'on', 'specs', 'missing'))
+
+        self.assertEqual([(server1.id, Resource.STATUS_FREE, 5, 'web', True, {'cpu': 'xeon'}, None),
+                          (server2.id, Resource.STATUS_FREE, None, None, None, None, None)], rows)
+
+        self.assertEqual([{'name': 'server1', 'label': 'web'}],
+                         list(Server.active.filter(label='web').prefetch_options().values_with_options('name',
+                                                                                                      'label')))
+
+    def test_decoded_options(self):
+        server = Server.objects.create(name='server1', rack_position=5, on=False, label='web',
+                                       specs={'cpu': 'xeon'})
+        server.set_option('weight', 1.5)
+
+        with self.assertNumQueries(1):
+            decoded = list(ResourceOption.objects.filter(resource=server).decoded())
+
+        self.assertEqual({'rack_position': 5, 'on': False, 'label': 'web', 'specs': {'cpu': 'xeon'}, 'weight': 1.5},
+                         dict((name, value) for resource_id, name, value in decoded))
+        self.assertEqual({server.id}, set(resource_id for resource_id, name, value in decoded))
+
+        for option in server.get_options():
+            self.assertEqual(option.typed_value, ResourceOption.FORMAT_DECODERS[option.format](option.value))
+
+        self.assertEqual({server.id: {'label': 'web'}, 0: {}},
+                         ResourceOption.objects.decoded_by_resource([server.id, 0], names=['label', 'missing']))
+
     def _create_test_resources(self, count):
         for idx1 in range(1, count + 1):
             resource = Resource.objects.create(status=Resource.STATUS_CHOICES[idx1 % len(Resource.STATUS_CHOICES)][0])
@@ -1,12 +1,18 @@
 from __future__ import unicode_literals
 
+import datetime
+import json
+
 from django.contrib.auth.models import User
+from django.test.utils import modify_settings, override_settings
+from django.utils import timezone
+from django.utils.http import parse_http_date
 from rest_framework.authtoken.models import Token
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
-from assets.models import Server, ServerPort
+from assets.models import Datacenter, Rack, Server, ServerPort
 from events.models import HistoryEvent
-from resources.models import Resource
+from resources.models import OptionKey, Resource, ResourceIdentityMap, ResourceOption
 
 
 class ResourcesAPITests(APITestCase):
@@ -33,6 +39,77 @@ class ResourcesAPITests(APITestCase):
         self.assertEqual(200, response.status_code)
         self.assertEqual(10, len(response.data['results']))
 
+    def test_resource_retrieve_cursor(self):
+        ports = [ServerPort.objects.create(name='res-%s' % x, number=x) for x in range(1, 26)]
+
+        # updates with the same updated_at are paged by id
+        updated_at = timezone.now()
+        Resource.objects.filter(pk__in=[port.id for port in ports[5:15]]).update(updated_at=updated_at)
+        Resource.objects.filter(pk=ports[0].id).update(updated_at=updated_at + datetime.timedelta(seconds=1))
+
+        for ordering, expected_ids in (
+                ('id', [port.id for port in ports]),
+                ('updated_at', [port.id for port in ports[1:5] + ports[15:] + ports[5:15] + ports[:1]])):
+            ids = []
+            response = self.client.get('/v1/resources/', data={'type': 'ServerPort', 'cursor': '',
+                                                               'ordering': ordering, 'page_size': 7}, format='json')
+            while True:
+                self.assertEqual(200, response.status_code)
+                self.assertNotIn('count', response.data)
+                ids.extend([resource['id'] for resource in response.data['results']])
+                self.assertEqual([['number']] * len(response.data['results']),
+                                 [[option['name'] for option in resource['options']]
+                                  for resource in response.data['results']])
+
+                if not response.data['next']:
+                    break
+
+                # token, version, resources and options of the page
+                with self.assertNumQueries(4):
+                    response = self.client.get(response.data['next'], format='json')
+
+            self.assertEqual(expected_ids, ids)
+
+        response = self.client.get('/v1/resources/', data={'cursor': 'invalid'}, format='json')
+        self.assertEqual(404, response.status_code)
+
+        response = self.client.get('/v1/resources/', data={'cursor': '', 'ordering': 'name'}, format='json')
+        self.assertEqual(404, response.status_code)
+
+    def test_resource_sparse_fields(self):
+        res1 = Resource.objects.create(name='res1')
+        res2 = Server.objects.create(name='res2', parent=res1, label='web', serial='sn1', rack_position=5)
+
+        # token, version and resources, options are not loaded
+        with self.assertNumQueries(3):
+            response = self.client.get('/v1/resources/', data={'fields': 'id,status,parent', 'ordering': 'id',
+                                                               'cursor': ''}, format='json')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{'id': res1.id, 'status': Resource.STATUS_FREE, 'parent': None},
+                          {'id': res2.id, 'status': Resource.STATUS_FREE, 'parent': res1.id}],
+                         [dict(resource) for resource in response.data['results']])
+
+        # token, version, count, resources and the selected options
+        with self.assertNumQueries(5):
+            response = self.client.get('/v1/resources/', data={'fields': 'id', 'options': 'label,rack_position',
+                                                               'type': 'Server'}, format='json')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, response.data['count'])
+        self.assertEqual(['id', 'options'], sorted(response.data['results'][0].keys()))
+        options = response.data['results'][0]['options']
+        self.assertEqual([('label', 'web'), ('rack_position', '5')],
+                         sorted((option['name'], option['value']) for option in options))
+
+        response = self.client.get('/v1/resources/%s/' % res2.id, data={'options': 'serial'}, format='json')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('res2', response.data['name'])
+        self.assertEqual(['serial'], [option['name'] for option in response.data['options']])
+
+        response = self.client.get('/v1/resources/', data={'fields': 'id,unknown'}, format='json')
+        self.assertEqual(400, response.status_code)
+
     def test_resource_delete(self):
         res1 = Resource.objects.create(name='res1')
         res2 = Server.objects.create(name='res2', parent=res1)
@@ -190,3 +267,336 @@ class ResourcesAPITests(APITestCase):
 
         self.assertEqual(1, response.data['count'])
         self.assertEqual(1, len(response.data['results']))
+
+    @modify_settings(MIDDLEWARE_CLASSES={'append': 'resources.middleware.ResourceIdentityMapMiddleware'})
+    def test_resource_identity_map_middleware(self):
+        res1 = Resource.objects.create(name='res1')
+        res2 = Server.objects.create(name='res2', parent=res1)
+
+        response = self.client.patch('/v1/resources/%s/' % res2.id, {'name': 'res3'}, format='json')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('res3', Resource.active.get(pk=res2.id).name)
+        self.assertEqual(None, ResourceIdentityMap.current())
+
+    def test_resource_bulk(self):
+        res1 = Resource.objects.create(name='res1')
+        res2 = Server.objects.create(name='res2', parent=res1, label='web', serial='sn1')
+
+        payload = [
+            {'type': 'assets.Server', 'name': 'srv1', 'parent': res1.id,
+             'options': [{'name': 'label', 'value': 'db'}, {'name': 'units', 'value': '2', 'format': 'int'}]},
+            {'op': 'update', 'id': res2.id, 'name': 'res2_ed', 'options': [{'name': 'label', 'value': 'mail'}]},
+            {'op': 'status', 'id': res1.id, 'status': Resource.STATUS_INUSE},
+            {'name': 'res3'},
+        ]
+
+        response = self.client.post('/v1/resources/bulk/', payload, format='json')
+
+        self.assertEqual(200, response.status_code)
+        results = response.data['results']
+        self.assertEqual([(0, 'create'), (1, 'update'), (2, 'status'), (3, 'create')],
+                         [(result['index'], result['op']) for result in results])
+        self.assertEqual([res2.id, res1.id], [results[1]['id'], results[2]['id']])
+
+        srv1 = Resource.active.get(pk=results[0]['id'])
+        self.assertIsInstance(srv1, Server)
+        self.assertEqual(res1.id, srv1.parent_id)
+        self.assertEqual('db', srv1.get_option_value('label'))
+        self.assertEqual(2, srv1.get_option_value('units'))
+        self.assertEqual('res3', Resource.active.get(pk=results[3]['id']).name)
+
+        res2 = Resource.active.get(pk=res2.id)
+        self.assertEqual('res2_ed', res2.name)
+        self.assertEqual('mail', res2.get_option_value('label'))
+        self.assertEqual('sn1', res2.get_option_value('serial'))
+        self.assertEqual(Resource.STATUS_INUSE, Resource.active.get(pk=res1.id).status)
+        self.assertEqual([res2.id, srv1.id],
+                         sorted(Resource.active.get(pk=res1.id).get_children().values_list('id', flat=True)))
+
+    def test_resource_bulk_parents_in_one_tree(self):
+        dc = Datacenter.objects.create(name='dc')
+        rack1 = Rack.objects.create(name='rack1', parent=dc)
+        rack2 = Rack.objects.create(name='rack2', parent=dc)
+
+        payload = [
+            {'type': 'assets.Server', 'name': 'srv1', 'parent': rack2.id},
+            {'type': 'assets.Server', 'name': 'srv2', 'parent': rack1.id},
+            {'type': 'assets.Server', 'name': 'srv3', 'parent': rack2.id},
+            {'type': 'assets.Rack', 'name': 'rack3', 'parent': dc.id},
+        ]
+
+        response = self.client.post('/v1/resources/bulk/', payload, format='json')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['srv2'], [res.name for res in Resource.active.get(pk=rack1.id).get_descendants()])
+        self.assertEqual(['srv1', 'srv3'], [res.name for res in Resource.active.get(pk=rack2.id).get_descendants()])
+        self.assertEqual(['rack1', 'rack2', 'rack3', 'srv1', 'srv2', 'srv3'],
+                         sorted(res.name for res in Resource.active.get(pk=dc.id).get_descendants()))
+
+        # MPTT fields are the same as the rebuilt ones
+        tree_fields = list(Resource.objects.order_by('id').values_list('tree_id', 'lft', 'rght', 'level'))
+        Resource.objects.rebuild()
+        self.assertEqual(tree_fields, list(Resource.objects.order_by('id').values_list('tree_id', 'lft', 'rght',
+                                                                                      'level')))
+
+    def test_resource_bulk_ndjson(self):
+        res1 = Resource.objects.create(name='res1')
+
+        body = '\n'.join([
+            '{"name": "res2", "parent": %s}' % res1.id,
+            '',
+            '{"id": %s, "last_seen": "2016-01-01T00:00:00Z"}' % res1.id,
+        ])
+        response = self.client.post('/v1/resources/bulk/', body, content_type='application/x-ndjson')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['create', 'update'], [result['op'] for result in response.data['results']])
+        self.assertEqual(2016, Resource.active.get(pk=res1.id).last_seen.year)
+
+        response = self.client.post('/v1/resources/bulk/', '{"name": "res3"}\n{invalid',
+                                    content_type='application/x-ndjson')
+        self.assertEqual(400, response.status_code)
+        self.assertIn('line 2', response.data['detail'])
+
+    def test_resource_bulk_invalid(self):
+        res1 = Resource.objects.create(name='res1')
+
+        payload = [
+            {'name': 'res2'},
+            {'op': 'update', 'id': 100500},
+            {'op': 'status', 'id': res1.id, 'status': 'unknown', 'name': 'res1_ed'},
+            {'type': 'assets.Unknown', 'parent': 100500},
+            {'op': 'delete', 'id': res1.id},
+        ]
+
+        # nothing is written
+        response = self.client.post('/v1/resources/bulk/', payload, format='json')
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual([2, 3, 4], [error['index'] for error in response.data['errors']])
+        self.assertEqual(['name', 'status'], sorted(response.data['errors'][0]['errors'].keys()))
+        self.assertEqual(['type'], list(response.data['errors'][1]['errors'].keys()))
+        self.assertEqual(['op'], list(response.data['errors'][2]['errors'].keys()))
+        self.assertEqual(1, Resource.objects.count())
+
+        # missing resources are reported, when the items are valid
+        response = self.client.post('/v1/resources/bulk/', payload[:2] + [{'parent': 100501}], format='json')
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual([(1, ['id']), (2, ['parent'])],
+                         [(error['index'], list(error['errors'].keys())) for error in response.data['errors']])
+        self.assertEqual(1, Resource.objects.count())
+
+    def test_resource_bulk_delete_with_children(self):
+        res1 = Resource.objects.create(name='res1')
+        res2 = Resource.objects.create(name='res2', parent=res1)
+        res3 = Resource.objects.create(name='res3')
+
+        # resources with children are not deleted, as with Resource.delete()
+        for payload in ([{'op': 'status', 'id': res1.id, 'status': Resource.STATUS_DELETED}],
+                        [{'op': 'status', 'id': res3.id, 'status': Resource.STATUS_DELETED},
+                         {'name': 'res4', 'parent': res3.id}],
+                        [{'op': 'status', 'id': res3.id, 'status': Resource.STATUS_DELETED},
+                         {'id': res2.id, 'parent': res3.id}]):
+            response = self.client.post('/v1/resources/bulk/', payload, format='json')
+
+            self.assertEqual(400, response.status_code)
+            self.assertEqual([(0, ['status'])],
+                             [(error['index'], list(error['errors'].keys())) for error in response.data['errors']])
+            self.assertEqual(0, Resource.objects.filter(status=Resource.STATUS_DELETED).count())
+
+        # children are deleted or moved in the same request
+        response = self.client.post('/v1/resources/bulk/', [
+            {'op': 'status', 'id': res1.id, 'status': Resource.STATUS_DELETED},
+            {'id': res2.id, 'parent': res3.id},
+        ], format='json')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(Resource.STATUS_DELETED, Resource.objects.get(pk=res1.id).status)
+
+    def test_resource_export(self):
+        res1 = Resource.objects.create(name='res1')
+        res2 = Server.objects.create(name='res2', parent=res1, label='web')
+        Server.objects.create(name='res3', label='db')
+
+        response = self.client.get('/v1/resources/export/', data={'subtree': res1.id})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/x-ndjson', response['Content-Type'])
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([res1.id, res2.id], [row['id'] for row in rows])
+        self.assertEqual({'label': 'web'}, rows[1]['options'])
+
+        response = self.client.get('/v1/resources/export/', data={'output': 'csv', 'type': 'Server',
+                                                                  'options': 'label'})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/csv', response['Content-Type'])
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].endswith(b',label'))
+        self.assertTrue(lines[2].endswith(b',db'))
+
+        response = self.client.get('/v1/resources/export/', data={'output': 'xml'})
+        self.assertEqual(400, response.status_code)
+
+        response = self.client.get('/v1/resources/export/', data={'status': 'unknown'})
+        self.assertEqual(400, response.status_code)
+
+        response = self.client.get('/v1/resources/export/', data={'subtree': 100500})
+        self.assertEqual(404, response.status_code)
+
+    def test_resource_conditional_get(self):
+        res1 = Resource.objects.create(name='res1')
+        res2 = Server.objects.create(name='res2', parent=res1, label='web')
+        Resource.objects.create(name='res3')
+
+        for path, params in (('/v1/resources/%s/' % res2.id, {}), ('/v1/resources/', {'type': 'Server'})):
+            response = self.client.get(path, data=params, format='json')
+
+            self.assertEqual(200, response.status_code)
+            etag = response['ETag']
+
+            # token and version, the serializer is not used
+            with self.assertNumQueries(2):
+                response = self.client.get(path, data=params, format='json', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(304, response.status_code)
+            self.assertEqual(b'', response.content)
+
+            # representation with the other fields
+            response = self.client.get(path, data=dict(params, fields='id'), format='json', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(200, response.status_code)
+
+        detail_etag = self.client.get('/v1/resources/%s/' % res2.id, format='json')['ETag']
+        list_etag = self.client.get('/v1/resources/', data={'type': 'Server'}, format='json')['ETag']
+
+        # changes of the other types don't change the list of servers
+        Resource.objects.create(name='res4')
+        response = self.client.get('/v1/resources/', data={'type': 'Server'}, format='json',
+                                   HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(304, response.status_code)
+
+        # option is changed
+        res2.set_option('label', 'db')
+
+        response = self.client.get('/v1/resources/%s/' % res2.id, format='json', HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('db', dict((option['name'], option['value']) for option in response.data['options'])['label'])
+
+        response = self.client.get('/v1/resources/', data={'type': 'Server'}, format='json',
+                                   HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(200, response.status_code)
+
+        # resource is removed from the list
+        list_etag = response['ETag']
+        Server.objects.create(name='res5').delete()
+        res2.delete()
+
+        response = self.client.get('/v1/resources/', data={'type': 'Server'}, format='json',
+                                   HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(0, response.data['count'])
+
+        response = self.client.get('/v1/resources/%s/' % res2.id, format='json', HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertEqual(404, response.status_code)
+
+    def test_resource_conditional_get_removed(self):
+        res1 = Server.objects.create(name='res1', label='web', serial='sn1')
+        res2 = Server.objects.create(name='res2', label='db')
+
+        # timestamps are moved back, as If-Modified-Since has the second precision
+        hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        Resource.objects.filter(pk__in=[res1.id, res2.id]).update(updated_at=hour_ago)
+        ResourceOption.objects.filter(resource__in=[res1.id, res2.id]).update(updated_at=hour_ago)
+
+        response = self.client.get('/v1/resources/%s/' % res1.id, format='json')
+        detail_etag = response['ETag']
+        last_modified = response['Last-Modified']
+        response = self.client.get('/v1/resources/%s/' % res1.id, format='json', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(304, response.status_code)
+
+        # lists have no Last-Modified, the removed resources are found by the ETag only
+        response = self.client.get('/v1/resources/', data={'type': 'Server'}, format='json')
+        list_etag = response['ETag']
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        # option is removed
+        Resource.objects.get(pk=res1.id).delete_option('serial')
+
+        for headers in ({'HTTP_IF_NONE_MATCH': detail_etag}, {'HTTP_IF_MODIFIED_SINCE': last_modified}):
+            response = self.client.get('/v1/resources/%s/' % res1.id, format='json', **headers)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(['label'], [option['name'] for option in response.data['options']])
+
+        response = self.client.get('/v1/resources/', data={'type': 'Server'}, format='json',
+                                   HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(200, response.status_code)
+
+        # resource is deleted, the latest updated_at of the list is not changed
+        Resource.objects.filter(pk=res1.id).update(updated_at=hour_ago)
+        ResourceOption.objects.filter(resource=res1.id).update(updated_at=hour_ago)
+        list_etag = self.client.get('/v1/resources/', data={'type': 'Server'}, format='json')['ETag']
+        Resource.objects.get(pk=res2.id).delete()
+
+        response = self.client.get('/v1/resources/', data={'type': 'Server'}, format='json',
+                                   HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([res1.id], [resource['id'] for resource in response.data['results']])
+
+
+@override_settings(RESOURCES_QUERY_CACHE={'BACKEND': 'resources.querycache.LocMemLRUBackend'})
+class ResourcesVersionAPITests(APITransactionTestCase):
+    """
+    Versions of the lists with the query cache, that is bypassed in the transactions with the changes.
+    """
+
+    def setUp(self):
+        super(ResourcesVersionAPITests, self).setUp()
+
+        user = User.objects.create(username='admin', is_staff=True)
+        token, created = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+
+    def tearDown(self):
+        OptionKey.clear_cache()
+
+    def test_resource_conditional_get_counters(self):
+        res1 = Server.objects.create(name='res1', label='web')
+        params = {'type': 'Server'}
+
+        response = self.client.get('/v1/resources/', data=params, format='json')
+        list_etag = response['ETag']
+        last_modified = response['Last-Modified']
+
+        # version is read from the cache, until the servers are changed
+        for headers in ({'HTTP_IF_NONE_MATCH': list_etag}, {'HTTP_IF_MODIFIED_SINCE': last_modified}):
+            with self.assertNumQueries(1):
+                response = self.client.get('/v1/resources/', data=params, format='json', **headers)
+            self.assertEqual(304, response.status_code)
+
+        Resource.objects.create(name='res2')
+        with self.assertNumQueries(1):
+            response = self.client.get('/v1/resources/', data=params, format='json', HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(304, response.status_code)
+
+        # the same state is found again after the change of the counters
+        res1.save()
+        response = self.client.get('/v1/resources/', data=params, format='json', HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(200, response.status_code)
+        list_etag = response['ETag']
+        last_modified = response['Last-Modified']
+
+        Server.objects.create(name='res3').delete()
+        with self.assertNumQueries(2):
+            response = self.client.get('/v1/resources/', data=params, format='json', HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(last_modified, response['Last-Modified'])
+
+        # resource is removed from the list, the list is modified in the later second
+        Resource.objects.get(pk=res1.id).delete()
+        for headers in ({'HTTP_IF_NONE_MATCH': list_etag}, {'HTTP_IF_MODIFIED_SINCE': last_modified}):
+            response = self.client.get('/v1/resources/', data=params, format='json', **headers)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(0, response.data['count'])
+        self.assertLess(parse_http_date(last_modified), parse_http_date(response['Last-Modified']))
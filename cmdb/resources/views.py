@@ -1,11 +1,23 @@
 from __future__ import unicode_literals
 
 import django_filters
-from rest_framework import viewsets
-from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import viewsets, status
+from rest_framework.exceptions import ParseError, NotFound
+from rest_framework.decorators import list_route
+from rest_framework.parsers import JSONParser
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
+from resources.bulk import ResourceBulkWriter
+from resources.conditional import ResourcesVersion, conditional_response
+from resources.export import ResourceExporter
 from resources.models import Resource
-from resources.serializers import ResourceSerializer
+from resources.pagination import ResourceCursorPagination
+from resources.parsers import NDJSONParser, MessagePackParser
+from resources.renderers import MessagePackViewMixin
+from resources.serializers import ResourceSerializer, get_query_names
 
 
 class ResourceFilter(django_filters.FilterSet):
@@ -13,14 +25,17 @@ class ResourceFilter(django_filters.FilterSet):
         model = Resource
 
 
-class ResourcesViewSet(viewsets.ModelViewSet):
+class ResourcesViewSet(MessagePackViewMixin, viewsets.ModelViewSet):
     queryset = Resource.active.filter()
     serializer_class = ResourceSerializer
     filter_class = ResourceFilter
-    pagination_class = PageNumberPagination
+    pagination_class = ResourceCursorPagination
 
     def get_queryset(self):
-        skip_fields = [self.pagination_class.page_query_param, self.pagination_class.page_size_query_param]
+        serializer_class = self.get_serializer_class()
+
+        skip_fields = self.pagination_class.get_query_params() + serializer_class.get_query_params() + [
+            api_settings.URL_FORMAT_OVERRIDE]
         params = {}
         for field_name in self.request.query_params:
             if field_name in skip_fields:
@@ -28,4 +43,86 @@ class ResourcesViewSet(viewsets.ModelViewSet):
 
             params[field_name] = self.request.query_params.get(field_name)
 
-        return Resource.active.filter(**params)
+        queryset = Resource.active.filter(**params)
+
+        # options of the page are loaded with one query, only the selected options are loaded
+        if 'options' in serializer_class.get_selected_fields(self.request):
+            queryset = queryset.prefetch_options(names=serializer_class.get_selected_options(self.request))
+
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """
+        Conditional GET: the page is not serialized, if the selected resources are not changed (see ResourcesVersion).
+        """
+        version = ResourcesVersion.of_queryset(self.filter_queryset(self.get_queryset()),
+                                               key=self._get_representation_key(request))
+
+        return conditional_response(request, version,
+                                    lambda: super(ResourcesViewSet, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            version = ResourcesVersion.of_resource(int(kwargs['pk']), key=self._get_representation_key(request))
+        except ValueError:
+            version = None
+
+        return conditional_response(request, version,
+                                    lambda: super(ResourcesViewSet, self).retrieve(request, *args, **kwargs))
+
+    @staticmethod
+    def _get_representation_key(request):
+        # representation depends on the query parameters (fields, options, pages) and on the renderer
+        return '%s|%s' % (request.get_full_path(), request.accepted_media_type)
+
+    @list_route(methods=['post'], parser_classes=[JSONParser, NDJSONParser, MessagePackParser])
+    def bulk(self, request):
+        """
+        Create and update many resources in one transaction. The body is the JSON list of the operations,
+        NDJSON with one operation per line or the MessagePack array, see ResourceBulkWriter. Returns the per item results,
+        nothing is written if any of the items is invalid.
+        """
+        max_items = getattr(settings, 'RESOURCES_BULK_MAX_ITEMS', 10000)
+        if isinstance(request.data, list) and len(request.data) > max_items:
+            return Response({'non_field_errors': ["Too many items, the limit is %s." % max_items]},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        writer = ResourceBulkWriter(request.data)
+        if not writer.is_valid():
+            return Response({'errors': writer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'results': writer.save()})
+
+    @list_route(methods=['get'])
+    def export(self, request):
+        """
+        Stream all the selected resources with their options as NDJSON or CSV, see ResourceExporter:
+            /v1/resources/export/?output=csv&type=Server,ServerPort&status=free,inuse&subtree=10&options=label
+        Live resources are exported by default.
+        """
+        export_format = request.query_params.get('output', ResourceExporter.FORMAT_NDJSON)
+        if export_format not in ResourceExporter.FORMATS:
+            raise ParseError("Invalid output \"%s\", use one of: %s." % (export_format,
+                                                                        ', '.join(ResourceExporter.FORMATS)))
+
+        statuses = get_query_names(request, 'status')
+        unknown_statuses = set(statuses or []) - set(dict(Resource.STATUS_CHOICES))
+        if unknown_statuses:
+            raise ParseError("Invalid status: %s." % ', '.join(sorted(unknown_statuses)))
+
+        subtree = None
+        if request.query_params.get('subtree'):
+            try:
+                subtree = Resource.objects.get(pk=int(request.query_params['subtree']))
+            except (ValueError, Resource.DoesNotExist):
+                raise NotFound("Subtree resource is not found.")
+
+        queryset = ResourceExporter.filter(types=get_query_names(request, 'type'), statuses=statuses,
+                                           subtree=subtree)
+        exporter = ResourceExporter(queryset, option_names=get_query_names(request, 'options'))
+
+        response = StreamingHttpResponse(exporter.export(export_format),
+                                         content_type=ResourceExporter.CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = 'attachment; filename="resources.%s"' % export_format
+
+        return response